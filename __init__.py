@@ -1,6 +1,99 @@
 """
 This library allows you to easily create a windows virtual printer.
+
+Submodules are only imported the first time something in them is
+used, so importing the package itself is quick (and does not go
+looking for ghostscript).
 """
-from .printer import * # noqa: F401,F403
-from .printServer import * # noqa: F401,F403
-from .windowsPrinters import * # type: ignore # noqa: F401,F403
+import typing
+import importlib
+
+if typing.TYPE_CHECKING:
+    from .printer import * # noqa: F401,F403
+    from .printServer import * # noqa: F401,F403
+    from .pjlHeader import * # noqa: F401,F403
+    from .jobSpool import * # noqa: F401,F403
+    from .asyncPrintServer import * # noqa: F401,F403
+    from .ghostscriptApp import * # noqa: F401,F403
+    from .ghostscriptPool import * # noqa: F401,F403
+    from .ghostscriptLib import * # noqa: F401,F403
+    from .postscriptStream import * # noqa: F401,F403
+    from .parallelRender import * # noqa: F401,F403
+    from .pageStream import * # noqa: F401,F403
+    from .dscIndex import * # noqa: F401,F403
+    from .conversionCache import * # noqa: F401,F403
+    from .batchConvert import * # noqa: F401,F403
+    from .printHost import * # noqa: F401,F403
+    from .preforkServer import * # noqa: F401,F403
+    from .lpdServer import * # noqa: F401,F403
+    from .jobMetrics import * # noqa: F401,F403
+    from .jobLimits import * # noqa: F401,F403
+    from .printerLogging import * # noqa: F401,F403
+    from .printerException import * # noqa: F401,F403
+    from .windowsPrinters import * # type: ignore # noqa: F401,F403
+
+
+# what name comes from what submodule
+_SUBMODULES:typing.Dict[str,typing.Tuple[str,...]]={
+    'printer':('Printer','PostscriptData','shell_escape','GHOSTSCRIPT_APP'),
+    'printServer':('PrintServer',
+        'PrintCallbackDocType','PrintCallbackFunctionType'),
+    'pjlHeader':('PjlHeader','postscriptBody',
+        'POSTSCRIPT_START','DEFAULT_HEADER_LIMIT'),
+    'jobSpool':('JobSpool',),
+    'asyncPrintServer':('AsyncPrintServer','AsyncPrintCallbackFunctionType'),
+    'ghostscriptApp':('findGhostscript','getGhostscriptApp',
+        'setGhostscriptApp','GHOSTSCRIPT_CACHE_FILE'),
+    'ghostscriptPool':('GhostscriptPool','GhostscriptWorker',
+        'DONE_MARKER','ERROR_MARKER'),
+    'ghostscriptLib':('GhostscriptLib','findGhostscriptLib',
+        'getGhostscriptLib','GS_ARG_ENCODING_UTF8','GS_ERROR_QUIT',
+        'GS_ERROR_NEED_INPUT','RUN_STRING_CHUNK_SIZE'),
+    'postscriptStream':('PrintStream','PrintStreamFunctionType',
+        'GhostscriptStream'),
+    'parallelRender':('countPages','splitPages','renderParallel',
+        'DSC_SCAN_SIZE'),
+    'pageStream':('RenderedPage','renderPages','splitPngs',
+        'PAGE_SPLITTERS','PNG_SIGNATURE','splitPnms','parsePnmHeader',
+        'pnmHeader','rawPages','pixelArray'),
+    'dscIndex':('DscIndex','DscPage','MAX_DSC_LINE'),
+    'conversionCache':('ConversionCache',),
+    'batchConvert':('batchConvert','findInputs','isUpToDate','BatchResult',
+        'BatchItem','DEFAULT_PATTERNS'),
+    'printHost':('PrintHost',),
+    'preforkServer':('PreforkServer',),
+    'lpdServer':('LpdServer','LpdControlFile','LPD_PORT'),
+    'jobMetrics':('JobTiming','JobMetrics','MetricsHttpServer','Histogram',
+        'JobHookFunctionType','PrometheusSource','combinedPrometheusText',
+        'currentJob','markJob','jobContext',
+        'JOB_MARKS','JOB_SPANS','DEFAULT_METRICS_PORT'),
+    'jobLimits':('JobLimits','JobRejected','JobTimedOut','waitAsync'),
+    'printerLogging':('startLogging','stopLogging','defaultLogging',
+        'JobContextFilter','LOGGER_NAME','DEFAULT_LOG_FORMAT'),
+    'printerException':('PrinterException',),
+    'windowsPrinters':('WindowsPrinters','PrinterSetup','runCommand'),
+}
+_NAME_TO_SUBMODULE:typing.Dict[str,str]={
+    name:submodule
+    for submodule,names in _SUBMODULES.items()
+    for name in names}
+_NOT_CACHED={'GHOSTSCRIPT_APP'} # these can change, so always look them up
+
+__all__=sorted(_NAME_TO_SUBMODULE)
+
+
+def __getattr__(name:str)->typing.Any:
+    """
+    Import things from submodules the first time they are asked for
+    """
+    submodule=_NAME_TO_SUBMODULE.get(name)
+    if submodule is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value=getattr(importlib.import_module('.'+submodule,__name__),name)
+    if name not in _NOT_CACHED:
+        globals()[name]=value
+    return value
+
+
+def __dir__()->typing.List[str]:
+    return sorted(set(globals())|set(_NAME_TO_SUBMODULE))
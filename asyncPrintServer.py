@@ -0,0 +1,236 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+An asyncio flavor of PrintServer.
+
+Rather than a select() loop followed by blocking recv() calls, this
+accepts and reads every connection on a single event loop, so lots of
+short jobs can be in flight without a thread per job.
+"""
+import typing
+import time
+import asyncio
+import inspect
+import logging
+import contextvars
+import concurrent.futures
+
+from virtualPrinter.printServer import PrintServer,PrintCallbackDocType
+from virtualPrinter.pjlHeader import PjlHeader
+from virtualPrinter.jobSpool import JobSpool
+from virtualPrinter.dscIndex import DscIndex
+from virtualPrinter.jobMetrics import JobTiming,jobContext
+from virtualPrinter.jobLimits import JobRejected,waitAsync
+from virtualPrinter.printerLogging import defaultLogging
+
+logger=logging.getLogger(__name__)
+
+AsyncPrintCallbackFunctionType=typing.Callable[[
+    PrintCallbackDocType, # doc
+    typing.Optional[str], # title
+    typing.Optional[str], # author
+    typing.Optional[str] # filename
+    ],typing.Any # None, or an awaitable if it is an async def
+]
+
+
+class AsyncPrintServer(PrintServer):
+    """
+    Same idea (and same callback contract) as PrintServer,
+    but built on asyncio.start_server
+
+    printCallbackFn may be a regular function, in which case it is
+    run on an executor so it can't stall the event loop, or an
+    async def, in which case it is awaited on the event loop itself
+    (so it is up to it to push any blocking work off to an executor)
+    """
+
+    def __init__(self,
+        printerName:str='My Virtual Printer',
+        ip:str='127.0.0.1',port:typing.Union[None,int,str]=None,
+        autoInstallPrinter:bool=True,
+        printCallbackFn:typing.Optional[AsyncPrintCallbackFunctionType]=None,
+        maxWorkers:int=4,
+        listenBacklog:int=100):
+        """
+        See PrintServer.__init__ for most parameters.
+
+        maxWorkers is the size of the executor used for blocking work
+            (non-async callbacks, installing the printer, etc)
+            While the server is running, async callbacks are welcome
+            to use self.executor for their own blocking work too.
+        """
+        PrintServer.__init__(self,printerName,ip,port,autoInstallPrinter,
+            printCallbackFn,maxWorkers,listenBacklog)
+        self.executor:typing.Optional[
+            concurrent.futures.ThreadPoolExecutor]=None
+
+    def run(self)->None:
+        """
+        server mainloop
+
+        (blocks until keepGoing is set to False)
+        """
+        asyncio.run(self.serve())
+
+    async def serve(self)->None:
+        """
+        server mainloop as a coroutine, for when you already
+        have an event loop going
+        """
+        if self.running:
+            return
+        defaultLogging()
+        self.running=True
+        self.keepGoing=True
+        loop=asyncio.get_running_loop()
+        self.executor=concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.maxWorkers,thread_name_prefix='printJob')
+        try:
+            server=await asyncio.start_server(self._handleStream,
+                sock=self._openSocket(),backlog=self.listenBacklog,
+                limit=self.maxBuffersize)
+            ip,port=server.sockets[0].getsockname()[0:2]
+            self.address=(ip,port)
+            logger.info('Opening %s:%s',ip,port)
+            if self.autoInstallPrinter:
+                await loop.run_in_executor(self.executor,
+                    self._installPrinter,ip,port)
+            self._startMetricsServer()
+            async with server:
+                self.listening.set()
+                logger.debug('Listening for incoming print jobs...')
+                while self.keepGoing: # wake up now and then
+                    #                   so we can detect a change
+                    await asyncio.sleep(1.0)
+        finally:
+            self.listening.clear()
+            self._stopMetricsServer()
+            self.executor.shutdown(wait=True)
+            self.executor=None
+            self.running=False
+
+    async def _handleStream(self,
+        reader:asyncio.StreamReader,
+        writer:asyncio.StreamWriter
+        )->None:
+        """
+        Receive a single print job from a connection
+        and hand it off to printCallbackFn
+        """
+        # (connections are always accepted, but while the queue is
+        # full they are not read from, like PrintServer's listen backlog)
+        await waitAsync(self.limits.canAccept)
+        job=JobTiming(writer.get_extra_info('peername'))
+        self.metrics.jobAccepted(job)
+        self.limits.admit(job)
+        # (each connection is its own task, with its own context)
+        with jobContext(job):
+            try:
+                await self._receiveJobAsync(reader,job)
+            except JobRejected as e:
+                job.error=repr(e) # (already logged)
+            except Exception as e: # pylint: disable=broad-except
+                job.error=repr(e)
+                logger.exception('Print job failed')
+            finally:
+                writer.close()
+                self.limits.finish(job)
+                self.metrics.jobDone(job)
+                try:
+                    await writer.wait_closed()
+                except OSError: # (eg, they had already hung up)
+                    pass
+
+    async def _receiveJobAsync(self,
+        reader:asyncio.StreamReader,
+        job:JobTiming
+        )->None:
+        """
+        Receive the job data from a connection and call printCallbackFn
+
+        The job only waits for its turn (see JobLimits.maxConcurrentJobs)
+        once it has all been received, so a slow sender never holds on
+        to a turn while it is still sending.
+        """
+        logger.info('Incoming job from %s... spooling...',job.address)
+        header=PjlHeader(self.headerLimit)
+        dscIndex=DscIndex() # so nobody has to go looking for pages later
+        with JobSpool(self.spoolThreshold,self.spoolDir) as spool:
+            lastData=time.perf_counter()
+            while True:
+                if not self.limits.hasRoom(job):
+                    await waitAsync(lambda: self.limits.hasRoom(job))
+                    lastData=time.perf_counter() # (not their fault)
+                timeLeft=self.limits.timeLeft(job,lastData)
+                if timeLeft is not None and timeLeft<=0:
+                    self.limits.timeOut(job,lastData)
+                try:
+                    raw=await asyncio.wait_for(
+                        reader.read(self.maxBuffersize),timeLeft)
+                except asyncio.TimeoutError:
+                    self.limits.timeOut(job,lastData)
+                if not raw:
+                    self.limits.received(job)
+                    break
+                lastData=time.perf_counter()
+                job.addBytes(len(raw))
+                self.limits.addBytes(job,len(raw))
+                if not header.done and header.feed(raw):
+                    job.mark('headerParsed')
+                dscIndex.feed(raw)
+                spool.write(raw)
+            job.mark('lastByte')
+            if not header.done:
+                header.close()
+                job.mark('headerParsed')
+            dscIndex.close()
+            job.title=header.title
+            job.dscIndex=dscIndex
+            self.bytesReceived+=spool.size # only touched from the event loop
+            logger.info('Received %d bytes',spool.size)
+            await waitAsync(lambda: self.limits.tryStart(job))
+            job.mark('started')
+            if self.printCallbackFn is None:
+                # nothing to do with it, so save it out like PrintServer does
+                await asyncio.get_running_loop().run_in_executor(
+                    self.executor,self._saveJob,spool.getBuffer())
+                return
+            await self._callPrintCallback(spool.getBuffer(),
+                header.title,header.author,header.filename)
+            job.mark('callbackDone')
+
+    def _saveJob(self,data:memoryview)->None:
+        """
+        Save a job out to a file when there is no callback
+        """
+        with self._openJobFile() as f:
+            f.write(data)
+
+    async def _callPrintCallback(self,
+        doc:PrintCallbackDocType,
+        title:typing.Optional[str],
+        author:typing.Optional[str],
+        filename:typing.Optional[str]
+        )->None:
+        """
+        Call printCallbackFn the right way depending on whether
+        it is an async def or not
+        """
+        if self.printCallbackFn is None:
+            return
+        if inspect.iscoroutinefunction(self.printCallbackFn):
+            await self.printCallbackFn(doc,title,author,filename)
+            return
+        # a regular def can still hand back an awaitable
+        callback:typing.Any=self.printCallbackFn
+        loop=asyncio.get_running_loop()
+        # (run it in this job's context, so it can still see the job)
+        result=await loop.run_in_executor(self.executor,
+            contextvars.copy_context().run,callback,doc,title,author,filename)
+        if inspect.isawaitable(result):
+            await result
+
+
+if __name__=='__main__':
+    AsyncPrintServer(ip='127.0.0.1',port=9001).run()
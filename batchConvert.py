@@ -0,0 +1,267 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Convert lots of postscript files (eg, an archive of old print jobs)
+at once, on a pool of processes.
+
+Files whose output is already newer than they are get skipped,
+so an interrupted run can simply be started again.
+"""
+import typing
+import os
+import sys
+import glob
+import time
+import fnmatch
+import concurrent.futures
+
+from virtualPrinter.printer import Printer
+from virtualPrinter.printerException import PrinterException
+
+
+DEFAULT_PATTERNS=('*.ps','*.prn','*.eps')
+GLOB_CHARS='*?['
+
+# (inputFilename,outputFilename)
+BatchItem=typing.Tuple[str,str]
+
+
+class BatchResult:
+    """
+    How a batch conversion went
+    """
+
+    def __init__(self,total:int=0):
+        self.total:int=total
+        self.converted:int=0
+        self.skipped:int=0
+        self.failed:typing.List[typing.Tuple[str,str]]=[] # (file,error)
+        self.bytesIn:int=0
+        self.bytesOut:int=0
+        self.seconds:float=0.0
+
+    @property
+    def done(self)->int:
+        """
+        how many files have been dealt with so far (one way or another)
+        """
+        return self.converted+self.skipped+len(self.failed)
+
+    def summary(self)->str:
+        """
+        A human-readable summary, including the throughput
+        """
+        seconds=max(self.seconds,1e-9)
+        lines=[
+            f'{self.converted} converted, {self.skipped} skipped, '
+            f'{len(self.failed)} failed (of {self.total}) '
+            f'in {self.seconds:.1f}s',
+            f'{self.converted/seconds:.2f} files/s, '
+            f'{self.bytesIn/seconds/1e6:.2f} MB/s in, '
+            f'{self.bytesOut/seconds/1e6:.2f} MB/s out']
+        for filename,error in self.failed:
+            lines.append(f'FAILED: {filename}: {error}')
+        return '\n'.join(lines)
+
+
+def findInputs(
+    paths:typing.Iterable[str],
+    outputDir:str,
+    acceptsFormat:str='pdf',
+    patterns:typing.Iterable[str]=DEFAULT_PATTERNS
+    )->typing.List[BatchItem]:
+    """
+    Work out what to convert, and where each one goes
+
+    paths can be files, directories (searched recursively for
+        files matching patterns) or globs
+
+    Files found in a directory (or by a glob) keep their place under
+    it (or under the glob's first directory with no wildcards in it),
+    so same-named files in different subdirectories don't collide.
+
+    returns [(inputFilename,outputFilename)]
+
+    raises PrinterException if two files would still end up
+    with the same output filename
+    """
+    patterns=tuple(patterns)
+    items:typing.List[BatchItem]=[]
+    seen:typing.Set[str]=set()
+    outputs:typing.Dict[str,str]={} # normcase(output):input
+
+    def add(filename:str,relativeName:str)->None:
+        filename=os.path.abspath(filename)
+        if filename in seen:
+            return
+        seen.add(filename)
+        stem=os.path.splitext(relativeName)[0]
+        outputFilename=os.path.join(outputDir,stem+'.'+acceptsFormat)
+        key=os.path.normcase(os.path.abspath(outputFilename))
+        if key in outputs:
+            raise PrinterException(f'"{outputs[key]}" and "{filename}" '
+                f'would both be converted to "{outputFilename}"')
+        outputs[key]=filename
+        items.append((filename,outputFilename))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root,dirs,files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    if any(_matches(f,pattern) for pattern in patterns):
+                        filename=os.path.join(root,f)
+                        add(filename,os.path.relpath(filename,path))
+        elif any(c in path for c in GLOB_CHARS):
+            root=_globRoot(path)
+            for filename in sorted(glob.glob(path,recursive=True)):
+                if os.path.isfile(filename):
+                    add(filename,os.path.relpath(filename,root))
+        else:
+            add(path,os.path.basename(path))
+    return items
+
+
+def _globRoot(path:str)->str:
+    """
+    The directory a glob starts from
+    (eg, "archive/2019" for "archive/2019/*/*.ps")
+    """
+    parts=path.replace(os.sep,'/').split('/')
+    for i,part in enumerate(parts):
+        if any(c in part for c in GLOB_CHARS):
+            if i==0:
+                return '.'
+            return '/'.join(parts[0:i]) or '/'
+    return os.path.dirname(path) or '.'
+
+
+def _matches(filename:str,pattern:str)->bool:
+    """
+    Case-insensitive filename pattern match
+    (archived spool files are often in upper case)
+    """
+    return fnmatch.fnmatch(filename.lower(),pattern.lower())
+
+
+def isUpToDate(inputFilename:str,outputFilename:str)->bool:
+    """
+    Whether the output already exists and is newer than the input
+    """
+    try:
+        return os.stat(outputFilename).st_mtime>=\
+            os.stat(inputFilename).st_mtime
+    except OSError:
+        return False
+
+
+# each worker process has its own Printer
+_workerPrinter:typing.Optional[Printer]=None
+
+
+def _initWorker(
+    acceptsFormat:str,
+    acceptsColors:str,
+    gsEngine:str
+    )->None:
+    """
+    Set up a worker process
+    """
+    global _workerPrinter # pylint: disable=global-statement
+    _workerPrinter=Printer('Batch Converter',acceptsFormat,acceptsColors)
+    _workerPrinter.gsEngine=gsEngine
+
+
+def _convertOne(item:BatchItem)->typing.Tuple[int,int]:
+    """
+    Convert one file (runs in a worker process)
+
+    returns (bytesIn,bytesOut)
+    """
+    assert _workerPrinter is not None
+    inputFilename,outputFilename=item
+    data=_workerPrinter._convertDatasource(inputFilename,True)
+    if not data:
+        raise PrinterException('ghostscript produced no output')
+    os.makedirs(os.path.dirname(outputFilename) or '.',exist_ok=True)
+    # write under a temp name first, so an interrupted run never
+    # leaves behind a half-written file that looks up to date
+    tmpFilename=outputFilename+'.partial'
+    try:
+        with open(tmpFilename,'wb') as f:
+            f.write(data)
+        os.replace(tmpFilename,outputFilename)
+    except BaseException:
+        if os.path.exists(tmpFilename):
+            os.remove(tmpFilename)
+        raise
+    return os.path.getsize(inputFilename),len(data)
+
+
+def batchConvert(
+    items:typing.List[BatchItem],
+    acceptsFormat:str='pdf',
+    acceptsColors:str='rgba',
+    gsEngine:str='subprocess',
+    processes:typing.Optional[int]=None,
+    force:bool=False,
+    progress:typing.Optional[typing.TextIO]=sys.stderr
+    )->BatchResult:
+    """
+    Convert a bunch of files on a pool of processes
+
+    items is what to convert (see findInputs)
+
+    processes is how many at once (None means one per cpu)
+
+    force means convert even if the output is already up to date
+
+    progress is where to show how it is going (None for nowhere)
+    """
+    result=BatchResult(len(items))
+    start=time.perf_counter()
+    todo=[]
+    for item in items:
+        if not force and isUpToDate(*item):
+            result.skipped+=1
+        else:
+            todo.append(item)
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(processes,
+            initializer=_initWorker,
+            initargs=(acceptsFormat,acceptsColors,gsEngine)) as executor:
+            futures={executor.submit(_convertOne,item):item for item in todo}
+            for future in concurrent.futures.as_completed(futures):
+                inputFilename=futures[future][0]
+                try:
+                    bytesIn,bytesOut=future.result()
+                except Exception as e: # pylint: disable=broad-except
+                    result.failed.append((inputFilename,str(e).strip()))
+                else:
+                    result.converted+=1
+                    result.bytesIn+=bytesIn
+                    result.bytesOut+=bytesOut
+                result.seconds=time.perf_counter()-start
+                if progress is not None:
+                    _showProgress(progress,result,inputFilename)
+        if progress is not None:
+            progress.write('\n')
+    result.seconds=time.perf_counter()-start
+    return result
+
+
+def _showProgress(
+    progress:typing.TextIO,
+    result:BatchResult,
+    filename:str
+    )->None:
+    """
+    Show a one-line progress report
+    """
+    rate=result.converted/max(result.seconds,1e-9)
+    name=os.path.basename(filename)
+    if len(name)>30:
+        name='...'+name[-27:]
+    progress.write(
+        f'\r[{result.done}/{result.total}] {rate:.1f} files/s {name:<30}')
+    progress.flush()
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the virtual printer, so we can tell whether a
+change makes receiving, parsing, or converting jobs faster or slower.
+
+Run them with:
+    python -m virtualPrinter.benchmarks --help
+"""
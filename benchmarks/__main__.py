@@ -0,0 +1,9 @@
+"""
+Run the benchmarks from the command line
+"""
+import sys
+
+from virtualPrinter.benchmarks.runBenchmarks import main
+
+
+sys.exit(main(sys.argv[1:]))
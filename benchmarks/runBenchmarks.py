@@ -0,0 +1,360 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Benchmark receiving, parsing and converting print jobs.
+
+Synthetic jobs are sent to a PrintServer on the loopback interface
+by several clients at once, and the time each job spends in each
+stage is recorded:
+    receive .... from the client connecting until the whole job has
+                 arrived (and its PJL header has been parsed)
+    parse ...... parsing the PJL header by itself (not over the network)
+    convert .... converting the postscript (ghostscript, or a stub)
+    callback ... handing the converted job to printThis()
+    total ...... from the client connecting until printThis() is done
+
+The results are json, so runs can be saved and compared.
+"""
+import typing
+import os
+import sys
+import json
+import time
+import logging
+import queue
+import socket
+import argparse
+import platform
+import threading
+
+from virtualPrinter.printer import Printer,PostscriptData
+from virtualPrinter.printServer import PrintServer,PrintCallbackDocType
+from virtualPrinter.pjlHeader import PjlHeader,postscriptBody
+from virtualPrinter.parallelRender import countPages
+from virtualPrinter.ghostscriptApp import findGhostscript
+from virtualPrinter.printerLogging import startLogging
+from virtualPrinter.benchmarks.syntheticJobs import makeJobs
+from virtualPrinter.benchmarks.stageStats import StageStats
+
+
+STAGES=('receive','parse','convert','callback','total')
+CONVERTERS=('stub','subprocess','pool','libgs')
+
+
+class BenchmarkPrinter(Printer):
+    """
+    A Printer for benchmarking that throws away whatever it prints
+    """
+
+    def __init__(self,acceptsFormat:str='pdf'):
+        Printer.__init__(self,'Benchmark Printer',acceptsFormat)
+
+    def printThis(self,
+        doc:PrintCallbackDocType,
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        )->None:
+        """
+        Throw the printout away
+        """
+        _=doc,title,author,filename
+
+
+class StubPrinter(BenchmarkPrinter):
+    """
+    A benchmark Printer that doesn't need ghostscript
+
+    "Converting" just hands back the postscript, optionally after
+    pretending to work on each page for a while, so everything
+    around ghostscript can be benchmarked by itself.
+    """
+
+    def __init__(self,
+        acceptsFormat:str='pdf',
+        secondsPerPage:float=0.0):
+        BenchmarkPrinter.__init__(self,acceptsFormat)
+        self.secondsPerPage:float=secondsPerPage
+
+    def _postscriptToFormat(self,
+        data:PostscriptData,
+        gsDev:str='pdfwrite',
+        gsDevOptions:typing.Optional[typing.Iterable[str]]=None,
+        outputDebug:bool=True
+        )->bytes:
+        """
+        Pretend to convert the data
+        """
+        _=gsDev,gsDevOptions,outputDebug
+        if self.secondsPerPage>0:
+            time.sleep(self.secondsPerPage*(countPages(data) or 1))
+        if hasattr(data,'read'):
+            return data.read()
+        return bytes(postscriptBody(data))
+
+
+def createPrinter(
+    converter:str='stub',
+    acceptsFormat:str='pdf',
+    stubSecondsPerPage:float=0.0
+    )->Printer:
+    """
+    Create the printer to benchmark
+
+    converter is "stub" (no ghostscript needed), or the Printer.gsEngine
+        to use ("subprocess", "pool", or "libgs")
+    """
+    if converter not in CONVERTERS:
+        raise ValueError(f'Unknown converter "{converter}"')
+    if converter=='stub':
+        return StubPrinter(acceptsFormat,stubSecondsPerPage)
+    printer=BenchmarkPrinter(acceptsFormat)
+    printer.gsEngine=converter
+    return printer
+
+
+def benchmarkParse(
+    jobs:typing.List[typing.Tuple[str,bytes]],
+    chunkSize:int=65536
+    )->StageStats:
+    """
+    Time parsing the PJL header of each job, fed in the way
+    the PrintServer does (a chunk at a time)
+    """
+    stats=StageStats('parse')
+    for _,job in jobs:
+        view=memoryview(job)
+        start=time.perf_counter()
+        header=PjlHeader()
+        for i in range(0,len(view),chunkSize):
+            if header.feed(view[i:i+chunkSize]):
+                break
+        header.close()
+        stats.add(time.perf_counter()-start,len(job))
+    return stats
+
+
+class LoopbackBenchmark:
+    """
+    Send jobs to a PrintServer on the loopback interface and
+    time how long they spend in each stage
+    """
+
+    def __init__(self,
+        printer:Printer,
+        clients:int=4,
+        workers:int=4,
+        timeout:float=600.0):
+        """
+        printer is what converts and prints the jobs
+
+        clients is how many jobs are sent at once
+
+        workers is the PrintServer's maxWorkers
+
+        timeout is how long to wait for all the jobs to be done
+        """
+        self.printer:Printer=printer
+        self.clients:int=max(1,clients)
+        self.workers:int=max(1,workers)
+        self.timeout:float=timeout
+        self.stats:typing.Dict[str,StageStats]={
+            name:StageStats(name) for name in STAGES}
+        self.errors:typing.List[str]=[]
+        self._sent:typing.Dict[str,float]={} # title:when it was sent
+        self._done=0
+        self._doneCondition=threading.Condition()
+
+    def run(self,
+        jobs:typing.List[typing.Tuple[str,bytes]]
+        )->float:
+        """
+        Send all the jobs and wait for them to be printed
+
+        returns the wall-clock time it took
+        """
+        server=PrintServer(self.printer.name,'127.0.0.1',0,False,
+            self._printCallback,maxWorkers=self.workers)
+        serverThread=threading.Thread(target=server.run,daemon=True)
+        serverThread.start()
+        try:
+            if not server.listening.wait(self.timeout) \
+                or server.address is None:
+                raise TimeoutError('print server did not start')
+            todo:queue.Queue=queue.Queue()
+            for job in jobs:
+                todo.put(job)
+            start=time.perf_counter()
+            clientThreads=[threading.Thread(target=self._client,
+                args=(server.address,todo),daemon=True)
+                for _ in range(self.clients)]
+            for thread in clientThreads:
+                thread.start()
+            with self._doneCondition:
+                if not self._doneCondition.wait_for(
+                    lambda: self._done>=len(jobs),self.timeout):
+                    raise TimeoutError(
+                        f'only {self._done} of {len(jobs)} jobs finished')
+            wallSeconds=time.perf_counter()-start
+            for thread in clientThreads:
+                thread.join()
+        finally:
+            server.keepGoing=False
+            serverThread.join()
+        return wallSeconds
+
+    def _client(self,
+        address:typing.Tuple[str,int],
+        todo:queue.Queue
+        )->None:
+        """
+        Send jobs until there are none left (runs in its own thread)
+        """
+        while True:
+            try:
+                title,job=todo.get_nowait()
+            except queue.Empty:
+                return
+            self._sent[title]=time.perf_counter()
+            try:
+                with socket.create_connection(address) as sock:
+                    sock.sendall(job)
+                    sock.shutdown(socket.SHUT_WR)
+                    sock.recv(1) # wait for the server to hang up
+            except OSError as e:
+                self._jobDone(f'{title}: {e}')
+
+    def _printCallback(self,
+        doc:PrintCallbackDocType,
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        )->None:
+        """
+        Called by the PrintServer with each job
+        """
+        received=time.perf_counter()
+        error=None
+        try:
+            sent=self._sent[title or '']
+            size=len(doc)
+            self.stats['receive'].add(received-sent,size)
+            data=self.printer._convertDatasource(doc)
+            converted=time.perf_counter()
+            self.stats['convert'].add(converted-received,size)
+            self.printer._printConverted(data,title,author,filename)
+            printed=time.perf_counter()
+            self.stats['callback'].add(printed-converted,len(data))
+            self.stats['total'].add(printed-sent,size)
+        except Exception as e: # pylint: disable=broad-except
+            error=f'{title}: {e!r}'
+        self._jobDone(error)
+
+    def _jobDone(self,error:typing.Optional[str]=None)->None:
+        """
+        One more job is finished (one way or another)
+        """
+        with self._doneCondition:
+            if error is not None:
+                self.errors.append(error)
+            self._done+=1
+            self._doneCondition.notify_all()
+
+
+def runBenchmarks(
+    jobCount:int=50,
+    jobSize:int=1024*1024,
+    pageCount:int=10,
+    clients:int=4,
+    workers:int=4,
+    converter:str='stub',
+    acceptsFormat:str='pdf',
+    stubSecondsPerPage:float=0.0,
+    verbose:bool=False
+    )->typing.Dict[str,typing.Any]:
+    """
+    Run all the benchmarks
+
+    returns the results as something that can be saved as json
+    """
+    settings={
+        'jobCount':jobCount,
+        'jobSize':jobSize,
+        'pageCount':pageCount,
+        'clients':clients,
+        'workers':workers,
+        'converter':converter,
+        'acceptsFormat':acceptsFormat,
+        'stubSecondsPerPage':stubSecondsPerPage}
+    jobs=makeJobs(jobCount,jobSize,pageCount)
+    totalBytes=sum(len(job) for _,job in jobs)
+    printer=createPrinter(converter,acceptsFormat,stubSecondsPerPage)
+    benchmark=LoopbackBenchmark(printer,clients,workers)
+    # (the server logs every job, which is not what we are measuring)
+    startLogging(logging.INFO if verbose else logging.WARNING)
+    try:
+        wallSeconds=benchmark.run(jobs)
+    finally:
+        printer._closeGhostscriptPool()
+    benchmark.stats['parse']=benchmarkParse(jobs)
+    return {
+        'benchmark':'virtualPrinter',
+        'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment':{
+            'python':platform.python_version(),
+            'implementation':platform.python_implementation(),
+            'platform':platform.platform(),
+            'cpuCount':os.cpu_count(),
+            'ghostscript':findGhostscript() if converter!='stub' else None},
+        'settings':settings,
+        'wallSeconds':wallSeconds,
+        'bytesPerSecond':totalBytes/wallSeconds if wallSeconds else None,
+        'jobsPerSecond':len(jobs)/wallSeconds if wallSeconds else None,
+        'errors':benchmark.errors,
+        'stages':{
+            name:benchmark.stats[name].summary() for name in STAGES}}
+
+
+def main(args:typing.List[str])->int:
+    """
+    Run the benchmarks from the command line
+
+    returns the exit code
+    """
+    parser=argparse.ArgumentParser(prog='python -m virtualPrinter.benchmarks',
+        description='Benchmark receiving, parsing and converting print jobs')
+    parser.add_argument('--jobs',type=int,default=50,
+        help='how many jobs to send (default=50)')
+    parser.add_argument('--job-size',type=int,default=1024*1024,
+        help='size of each job in bytes (default=1MiB)')
+    parser.add_argument('--pages',type=int,default=10,
+        help='pages in each job (default=10)')
+    parser.add_argument('--clients',type=int,default=4,
+        help='how many clients send jobs at once (default=4)')
+    parser.add_argument('--workers',type=int,default=4,
+        help="the print server's maxWorkers (default=4)")
+    parser.add_argument('--converter',choices=CONVERTERS,default='stub',
+        help='stub (no ghostscript needed), or a ghostscript engine')
+    parser.add_argument('--format',choices=('pdf','png'),default='pdf',
+        help='what to convert to (default=pdf)')
+    parser.add_argument('--stub-seconds-per-page',type=float,default=0.0,
+        help='how long the stub converter pretends each page takes')
+    parser.add_argument('--output',
+        help='save the json results here (default=print them)')
+    parser.add_argument('--verbose',action='store_true',
+        help="show the print server's log")
+    options=parser.parse_args(args)
+    results=runBenchmarks(options.jobs,options.job_size,options.pages,
+        options.clients,options.workers,options.converter,options.format,
+        options.stub_seconds_per_page,options.verbose)
+    text=json.dumps(results,indent=2)
+    if options.output:
+        with open(options.output,'w',encoding='utf-8') as f:
+            f.write(text+'\n')
+    else:
+        print(text)
+    return 1 if results['errors'] else 0
+
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
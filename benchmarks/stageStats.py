@@ -0,0 +1,71 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Keep track of how long each stage of handling a job takes
+and boil it down to throughput and latency percentiles.
+"""
+import typing
+import math
+import threading
+
+
+PERCENTILES=(50,95,99)
+
+
+def percentile(sortedValues:typing.Sequence[float],p:float)->float:
+    """
+    Get the p'th percentile (nearest-rank) of some already-sorted values
+    """
+    if not sortedValues:
+        return 0.0
+    rank=max(1,math.ceil(p/100.0*len(sortedValues)))
+    return sortedValues[min(rank,len(sortedValues))-1]
+
+
+class StageStats:
+    """
+    Timings for one stage (eg, "receive") over many jobs
+
+    This is thread-safe, since jobs are handled on several threads.
+    """
+
+    def __init__(self,name:str):
+        self.name:str=name
+        self.durations:typing.List[float]=[] # seconds
+        self.bytes:int=0
+        self._lock=threading.Lock()
+
+    def add(self,seconds:float,numBytes:int=0)->None:
+        """
+        Record how long the stage took for one job
+        """
+        with self._lock:
+            self.durations.append(seconds)
+            self.bytes+=numBytes
+
+    def summary(self)->typing.Dict[str,typing.Any]:
+        """
+        Boil it all down to something that can be saved as json
+
+        The bytesPerSecond and jobsPerSecond here are for the stage
+        alone, one job at a time (ie, total bytes over total time
+        spent in the stage) so they are not affected by how many
+        jobs were going at once.
+        """
+        with self._lock:
+            durations=sorted(self.durations)
+            numBytes=self.bytes
+        seconds=sum(durations)
+        ret:typing.Dict[str,typing.Any]={
+            'count':len(durations),
+            'bytes':numBytes,
+            'seconds':seconds,
+            'bytesPerSecond':numBytes/seconds if seconds else None,
+            'jobsPerSecond':len(durations)/seconds if seconds else None,
+            'minMs':durations[0]*1000.0 if durations else None,
+            'meanMs':seconds*1000.0/len(durations) if durations else None,
+            'maxMs':durations[-1]*1000.0 if durations else None}
+        for p in PERCENTILES:
+            ret[f'p{p}Ms']=percentile(durations,p)*1000.0 \
+                if durations else None
+        return ret
@@ -0,0 +1,121 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Make up print jobs that look like what a windows print driver sends
+(a PJL header, followed by DSC-commented PostScript) of whatever
+size and page count a benchmark wants.
+"""
+import typing
+
+
+PJL_UEL=b'\x1b%-12345X' # universal exit language, starts every job
+
+
+def makePostscript(
+    jobSize:int=1024*1024,
+    pageCount:int=10,
+    title:str='benchmark'
+    )->bytes:
+    """
+    Make a PostScript document of (about) jobSize bytes
+    with pageCount pages
+
+    The pages are filled out with line drawing so that a
+    real ghostscript has some actual work to do.
+    """
+    pageCount=max(1,pageCount)
+    head=(
+        b'%!PS-Adobe-3.0\n'
+        b'%%Title: '+title.encode('utf-8')+b'\n'
+        b'%%Creator: virtualPrinter benchmarks\n'
+        b'%%Pages: '+str(pageCount).encode('ascii')+b'\n'
+        b'%%BoundingBox: 0 0 612 792\n'
+        b'%%EndComments\n'
+        b'%%BeginProlog\n'
+        b'/L { moveto lineto stroke } bind def\n'
+        b'%%EndProlog\n')
+    tail=b'%%Trailer\n%%EOF\n'
+    pages=[]
+    for i in range(1,pageCount+1):
+        n=str(i).encode('ascii')
+        pages.append((
+            b'%%Page: '+n+b' '+n+b'\n',
+            b'showpage\n'))
+    overhead=len(head)+len(tail)+sum(len(a)+len(b) for a,b in pages)
+    padding=max(0,jobSize-overhead)
+    out=bytearray(head)
+    for i,(pageStart,pageEnd) in enumerate(pages):
+        out+=pageStart
+        out+=_drawing(padding//pageCount+(1 if i<padding%pageCount else 0))
+        out+=pageEnd
+    out+=tail
+    return bytes(out)
+
+
+def _drawing(size:int)->bytes:
+    """
+    Make exactly size bytes of PostScript line drawing
+    """
+    out=bytearray()
+    i=0
+    while True:
+        line=b'%d %d %d %d L\n'%(
+            72+i*7%468,72+i*13%648,72+i*11%468,72+i*5%648)
+        if len(out)+len(line)>size:
+            break
+        out+=line
+        i+=1
+    remaining=size-len(out) # fill what's left with a comment
+    if remaining>1:
+        out+=b'%'+b' '*(remaining-2)+b'\n'
+    elif remaining==1:
+        out+=b'\n'
+    return bytes(out)
+
+
+def makePjlHeader(
+    title:str='benchmark',
+    author:str='benchmark'
+    )->bytes:
+    """
+    Make a PJL header like the one a windows print driver sends
+    """
+    return b''.join((
+        PJL_UEL,b'@PJL JOB NAME="',title.encode('utf-8'),b'"\r\n',
+        b'@PJL COMMENT "Username: ',author.encode('utf-8'),
+        b'; App Filename: ',title.encode('utf-8'),b'"\r\n',
+        b'@PJL SET RESOLUTION=600\r\n',
+        b'@PJL ENTER LANGUAGE=POSTSCRIPT\r\n'))
+
+
+def makeJob(
+    jobSize:int=1024*1024,
+    pageCount:int=10,
+    title:str='benchmark',
+    author:str='benchmark'
+    )->bytes:
+    """
+    Make a complete print job (PJL header and PostScript)
+    of (about) jobSize bytes with pageCount pages
+    """
+    header=makePjlHeader(title,author)
+    return header+makePostscript(jobSize-len(header),pageCount,title)
+
+
+def makeJobs(
+    jobCount:int,
+    jobSize:int=1024*1024,
+    pageCount:int=10,
+    author:str='benchmark'
+    )->typing.List[typing.Tuple[str,bytes]]:
+    """
+    Make a bunch of jobs, each with its own title
+    (so they can be told apart when they arrive)
+
+    returns [(title,job)]
+    """
+    jobs=[]
+    for i in range(jobCount):
+        title=f'benchmark job {i}'
+        jobs.append((title,makeJob(jobSize,pageCount,title,author)))
+    return jobs
@@ -0,0 +1,231 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Remember what documents converted to, so that printing the
+same thing again doesn't have to go through ghostscript again.
+"""
+import typing
+import os
+import hashlib
+import tempfile
+import threading
+import collections
+
+from virtualPrinter.pjlHeader import DEFAULT_HEADER_LIMIT,postscriptBody
+
+
+class ConversionCache:
+    """
+    Remember what documents converted to, so that printing the
+    same thing again doesn't have to go through ghostscript again.
+
+    Entries are keyed by a hash of the postscript itself (not the PJL
+    header, since that changes every time) plus everything that
+    affects the output.  Recently used entries are kept in memory,
+    and, if there is a cacheDir, everything is also kept on disk
+    so it survives a restart.
+    """
+
+    def __init__(self,
+        maxMemoryBytes:int=64*1024*1024,
+        cacheDir:typing.Optional[str]=None,
+        maxDiskBytes:int=1024*1024*1024):
+        """
+        maxMemoryBytes is how big the in-memory cache can get
+
+        cacheDir is where to keep the on-disk cache
+            (None means no on-disk cache)
+
+        maxDiskBytes is how big the on-disk cache can get
+        """
+        self.maxMemoryBytes:int=maxMemoryBytes
+        self.cacheDir:typing.Optional[str]=cacheDir
+        self.maxDiskBytes:int=maxDiskBytes
+        self.memoryHits:int=0
+        self.diskHits:int=0
+        self.misses:int=0
+        self._memory:typing.OrderedDict[str,bytes]=collections.OrderedDict()
+        self._memoryBytes:int=0
+        self._diskBytes:int=0
+        self._lock=threading.Lock()
+        if cacheDir is not None:
+            os.makedirs(cacheDir,exist_ok=True)
+            self._diskBytes=sum(size for _,size,_ in self._diskEntries())
+
+    @property
+    def hits(self)->int:
+        """
+        total number of cache hits
+        """
+        return self.memoryHits+self.diskHits
+
+    def stats(self)->typing.Dict[str,int]:
+        """
+        Get hit/miss statistics
+        """
+        with self._lock:
+            return {
+                'hits':self.hits,
+                'memoryHits':self.memoryHits,
+                'diskHits':self.diskHits,
+                'misses':self.misses,
+                'memoryEntries':len(self._memory),
+                'memoryBytes':self._memoryBytes,
+                'diskBytes':self._diskBytes}
+
+    def key(self,
+        data:typing.Any,
+        *settings:typing.Any
+        )->typing.Optional[str]:
+        """
+        Create a cache key for some postscript data
+        and whatever settings affect how it converts
+
+        data is a bytes-like object or a seekable binary file
+
+        returns None if the data cannot be cached
+            (eg, it is a pipe that can only be read once)
+        """
+        h=hashlib.sha256()
+        if hasattr(data,'read'):
+            try:
+                start=data.tell()
+                h.update(postscriptBody(data.read(DEFAULT_HEADER_LIMIT)))
+                for chunk in iter(lambda: data.read(1024*1024),b''):
+                    h.update(chunk)
+                data.seek(start)
+            except (OSError,ValueError): # io.UnsupportedOperation
+                return None
+        else:
+            h.update(postscriptBody(data))
+        h.update(repr(settings).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self,key:str)->typing.Optional[bytes]:
+        """
+        Look something up in the cache
+
+        returns None if it is not there
+        """
+        with self._lock:
+            value=self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memoryHits+=1
+                return value
+        value=self._diskGet(key)
+        with self._lock:
+            if value is None:
+                self.misses+=1
+                return None
+            self.diskHits+=1
+            self._memoryPut(key,value)
+        return value
+
+    def put(self,key:str,value:bytes)->None:
+        """
+        Add something to the cache
+        """
+        value=bytes(value)
+        with self._lock:
+            self._memoryPut(key,value)
+        self._diskPut(key,value)
+
+    def clear(self)->None:
+        """
+        Empty the cache (memory and disk)
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memoryBytes=0
+            for filename,_,_ in self._diskEntries():
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            self._diskBytes=0
+
+    def _memoryPut(self,key:str,value:bytes)->None:
+        """
+        Add to the in-memory cache, evicting the least recently
+        used entries to make room (must hold the lock)
+        """
+        if len(value)>self.maxMemoryBytes:
+            return
+        old=self._memory.pop(key,None)
+        if old is not None:
+            self._memoryBytes-=len(old)
+        self._memory[key]=value
+        self._memoryBytes+=len(value)
+        while self._memoryBytes>self.maxMemoryBytes:
+            _,evicted=self._memory.popitem(last=False)
+            self._memoryBytes-=len(evicted)
+
+    def _diskFilename(self,key:str)->str:
+        """
+        Where a key lives in the on-disk cache
+        """
+        assert self.cacheDir is not None
+        return os.path.join(self.cacheDir,key+'.cache')
+
+    def _diskEntries(self)->typing.List[typing.Tuple[str,int,float]]:
+        """
+        Everything in the on-disk cache as (filename,size,lastUsed)
+        """
+        entries=[]
+        if self.cacheDir is not None:
+            for f in os.listdir(self.cacheDir):
+                if f.endswith('.cache'):
+                    filename=os.path.join(self.cacheDir,f)
+                    try:
+                        st=os.stat(filename)
+                    except OSError:
+                        continue
+                    entries.append((filename,st.st_size,st.st_mtime))
+        return entries
+
+    def _diskGet(self,key:str)->typing.Optional[bytes]:
+        """
+        Look something up in the on-disk cache
+        """
+        if self.cacheDir is None:
+            return None
+        filename=self._diskFilename(key)
+        try:
+            with open(filename,'rb') as f:
+                value=f.read()
+            os.utime(filename) # mark it as recently used
+        except OSError:
+            return None
+        return value
+
+    def _diskPut(self,key:str,value:bytes)->None:
+        """
+        Add to the on-disk cache, evicting the least recently
+        used entries to make room
+        """
+        if self.cacheDir is None or len(value)>self.maxDiskBytes:
+            return
+        filename=self._diskFilename(key)
+        if os.path.exists(filename):
+            return
+        # write it under a temp name first so nobody
+        # ever sees a half-written entry
+        fd,tmpFilename=tempfile.mkstemp(dir=self.cacheDir,suffix='.tmp')
+        with os.fdopen(fd,'wb') as f:
+            f.write(value)
+        os.replace(tmpFilename,filename)
+        with self._lock:
+            self._diskBytes+=len(value)
+            if self._diskBytes<=self.maxDiskBytes:
+                return
+            entries=sorted(self._diskEntries(),key=lambda e: e[2])
+            self._diskBytes=sum(size for _,size,_ in entries)
+            for entryFilename,size,_ in entries:
+                if self._diskBytes<=self.maxDiskBytes:
+                    break
+                try:
+                    os.remove(entryFilename)
+                except OSError:
+                    continue
+                self._diskBytes-=size
@@ -0,0 +1,363 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Index where everything is in a PostScript document by way of its
+DSC (Document Structuring Conventions) comments, eg:
+    %!PS-Adobe-3.0
+    %%Pages: 2
+    %%BoundingBox: 0 0 612 792
+    %%EndComments
+    %%BeginProlog ... %%EndProlog
+    %%BeginSetup ... %%EndSetup
+    %%Page: 1 1
+    ...
+    %%Page: 2 2
+    ...
+    %%Trailer
+    %%EOF
+
+The index is built in one pass as the bytes come in, so afterwards
+the page count, or where any page is, is simply looked up rather
+than having ghostscript go through the whole document.
+
+See also:
+    Adobe Technical Note #5001, "PostScript Language Document
+    Structuring Conventions Specification"
+"""
+import typing
+import re
+
+
+MAX_DSC_LINE=1024 # (the spec says 255, but be generous)
+_CANDIDATE_RE=re.compile(rb'%[%!]') # finding these is fast
+_EOL_RE=re.compile(rb'[\r\n]')
+
+
+class DscPage:
+    """
+    Where one page is in the document
+    """
+
+    def __init__(self,label:str,ordinal:typing.Optional[int],start:int):
+        self.label:str=label
+        self.ordinal:typing.Optional[int]=ordinal
+        self.start:int=start # offset of its %%Page: line
+        self.end:typing.Optional[int]=None # offset just past it
+
+    def __repr__(self)->str:
+        return f'DscPage({self.label!r},{self.ordinal},'\
+            f'{self.start},{self.end})'
+
+
+class DscIndex:
+    """
+    Index where everything is in a PostScript document by way of
+    its DSC comments.
+
+    Simply feed() it the raw bytes as they come in, then close() it.
+    All offsets are from the start of whatever was fed in (so if it
+    was a whole print job, they include the PJL header).
+    Comments inside embedded documents (%%BeginDocument ...
+    %%EndDocument) are skipped, since they aren't our pages.
+    """
+
+    def __init__(self)->None:
+        self.size:int=0 # how many bytes have been fed in
+        self.done:bool=False
+        self.documentStart:typing.Optional[int]=None # the %!PS- line
+        self.declaredPages:typing.Optional[int]=None # from %%Pages:
+        self.boundingBox:typing.Optional[
+            typing.Tuple[float,float,float,float]]=None
+        self.headerEnd:typing.Optional[int]=None # after %%EndComments
+        self.prolog:typing.Optional[typing.Tuple[int,int]]=None
+        self.setup:typing.Optional[typing.Tuple[int,int]]=None
+        self.pages:typing.List[DscPage]=[]
+        self.trailerStart:typing.Optional[int]=None
+        self.eofOffset:typing.Optional[int]=None
+        self._prologStart:typing.Optional[int]=None
+        self._setupStart:typing.Optional[int]=None
+        self._nesting:int=0 # how deep in embedded documents we are
+        self._atLineStart:bool=True
+        self._pending=bytearray() # a comment line that isn't finished yet
+        self._pendingStart:int=0
+
+    @classmethod
+    def build(cls,data:typing.Union[bytes,bytearray,memoryview]
+        )->'DscIndex':
+        """
+        Index a whole document that is already in memory
+        """
+        index=cls()
+        index.feed(data)
+        index.close()
+        return index
+
+    def feed(self,data:typing.Union[bytes,bytearray,memoryview])->None:
+        """
+        Feed in the next chunk of the document
+        """
+        view=memoryview(data)
+        if not view:
+            return
+        pos=0
+        if self._pending:
+            # finish the comment we were in the middle of
+            if self._pending[-1]==13:
+                # it ended in a \r right at the end of the last chunk
+                # (so it is only now we know if that was a \r\n)
+                pos=1 if view[0]==10 else 0
+                self._comment(self._pendingStart,bytes(self._pending[0:-1]),
+                    self.size+pos)
+                self._pending=bytearray()
+            else:
+                eol=_EOL_RE.search(view)
+                if eol is None or self._endsInCr(view,eol.start()):
+                    if len(self._pending)+len(view)>MAX_DSC_LINE:
+                        self._pending=bytearray() # too long for a comment
+                    else:
+                        self._pending+=view
+                    self._atLineStart=view[-1] in (10,13)
+                    self.size+=len(view)
+                    return
+                self._pending+=view[0:eol.start()]
+                self._comment(self._pendingStart,bytes(self._pending),
+                    self.size+self._lineEnd(view,eol.start()))
+                self._pending=bytearray()
+                pos=eol.start()
+        for candidate in _CANDIDATE_RE.finditer(view,pos):
+            i=candidate.start()
+            if not self._isLineStart(view,i):
+                continue
+            eol=_EOL_RE.search(view,i)
+            if eol is None or self._endsInCr(view,eol.start()):
+                # the line is continued in the next chunk
+                if len(view)-i<=MAX_DSC_LINE:
+                    self._pending=bytearray(view[i:])
+                    self._pendingStart=self.size+i
+                break
+            if eol.start()-i<=MAX_DSC_LINE:
+                self._comment(self.size+i,bytes(view[i:eol.start()]),
+                    self.size+self._lineEnd(view,eol.start()))
+        else:
+            # a comment can start with a % right at the end of the chunk
+            # (too soon to tell if it is a %% or %!, so hang on to it)
+            last=len(view)-1
+            if view[last]==37 and last>=pos \
+                and self._isLineStart(view,last):
+                self._pending=bytearray(b'%')
+                self._pendingStart=self.size+last
+        self._atLineStart=view[-1] in (10,13)
+        self.size+=len(view)
+
+    def _isLineStart(self,view:memoryview,i:int)->bool:
+        """
+        Whether position i of this chunk is at the start of a line
+        """
+        if i==0:
+            return self._atLineStart
+        return view[i-1] in (10,13)
+
+    @staticmethod
+    def _endsInCr(view:memoryview,eol:int)->bool:
+        """
+        Whether a line ends in a \r that is the last thing in the chunk
+        (since a \n could be coming next)
+        """
+        return eol==len(view)-1 and view[eol]==13
+
+    @staticmethod
+    def _lineEnd(view:memoryview,eol:int)->int:
+        """
+        Get the offset of the start of the next line
+        (taking \r\n into account)
+        """
+        if view[eol]==13 and eol+1<len(view) and view[eol+1]==10:
+            return eol+2
+        return eol+1
+
+    def close(self)->None:
+        """
+        Call this when the whole document has been fed in
+        """
+        if self.done:
+            return
+        if self._pending: # last line had no newline (eg, "%%EOF")
+            line=bytes(self._pending)
+            if line.endswith(b'\r'):
+                line=line[0:-1]
+            self._comment(self._pendingStart,line,self.size)
+            self._pending=bytearray()
+        self._endPage(self.size)
+        self.done=True
+
+    def _endPage(self,offset:int)->None:
+        """
+        The current page (if any) ends at offset
+        """
+        if self.pages and self.pages[-1].end is None:
+            self.pages[-1].end=offset
+
+    def _comment(self,offset:int,line:bytes,lineEnd:int)->None:
+        """
+        Handle a single DSC comment line
+
+        offset is where the line starts, lineEnd is where the next one does
+        """
+        if not line.startswith((b'%%',b'%!')): # (eg, a "% plain comment")
+            return
+        text=line.decode('latin-1')
+        if text.startswith('%!'):
+            if self.documentStart is None and text.startswith('%!PS'):
+                self.documentStart=offset
+            return
+        keyword,_,value=text[2:].partition(':')
+        keyword=keyword.strip()
+        value=value.strip()
+        if keyword=='BeginDocument':
+            self._nesting+=1
+            return
+        if keyword=='EndDocument':
+            self._nesting=max(0,self._nesting-1)
+            return
+        if self._nesting>0:
+            return
+        inTrailer=self.trailerStart is not None
+        if keyword=='Pages':
+            # header value wins, unless it said (atend)
+            count=value.split()[0] if value else ''
+            if count.isdigit() and (self.declaredPages is None or inTrailer):
+                self.declaredPages=int(count)
+        elif keyword=='BoundingBox':
+            if self.boundingBox is None or inTrailer:
+                boundingBox=_parseBoundingBox(value)
+                if boundingBox is not None:
+                    self.boundingBox=boundingBox
+        elif keyword=='EndComments':
+            if self.headerEnd is None:
+                self.headerEnd=lineEnd
+        elif keyword=='BeginProlog':
+            self._prologStart=offset
+        elif keyword=='EndProlog':
+            start=self._prologStart
+            self.prolog=(offset if start is None else start,lineEnd)
+        elif keyword=='BeginSetup':
+            self._setupStart=offset
+        elif keyword=='EndSetup':
+            start=self._setupStart
+            self.setup=(offset if start is None else start,lineEnd)
+        elif keyword=='Page':
+            if inTrailer:
+                return
+            self._endPage(offset)
+            label,ordinal=_parsePageComment(value)
+            self.pages.append(DscPage(label,ordinal,offset))
+        elif keyword=='Trailer':
+            self._endPage(offset)
+            if self.trailerStart is None:
+                self.trailerStart=offset
+        elif keyword=='EOF':
+            self._endPage(offset)
+            if self.eofOffset is None:
+                self.eofOffset=offset
+
+    @property
+    def pageCount(self)->typing.Optional[int]:
+        """
+        How many pages the document has
+
+        returns None if it is not known
+        """
+        if self.declaredPages is not None:
+            return self.declaredPages
+        if self.pages:
+            return len(self.pages)
+        return None
+
+    @property
+    def canExtractPages(self)->bool:
+        """
+        Whether the document is well-behaved enough that pages
+        can be pulled out of it with extractPages()
+        """
+        if not self.done or not self.pages:
+            return False
+        if self.declaredPages is not None \
+            and self.declaredPages!=len(self.pages):
+            return False
+        previousEnd=0
+        for page in self.pages:
+            if page.end is None or page.start<previousEnd:
+                return False
+            previousEnd=page.end
+        return True
+
+    def pageOffsets(self,pageNumber:int)->typing.Tuple[int,int]:
+        """
+        Get (start,end) of a page
+
+        pageNumber starts at 1 and counts pages in the order they
+        appear in the document (not the %%Page: labels)
+        """
+        if not 1<=pageNumber<=len(self.pages) \
+            or self.pages[pageNumber-1].end is None:
+            raise IndexError(f'page {pageNumber} is not indexed')
+        page=self.pages[pageNumber-1]
+        assert page.end is not None
+        return page.start,page.end
+
+    def extractPages(self,
+        data:typing.Union[bytes,bytearray,memoryview],
+        firstPage:int,
+        lastPage:typing.Optional[int]=None
+        )->bytes:
+        """
+        Make a PostScript document out of just some of the pages
+        (everything before the first page, the pages, and the trailer)
+
+        data is the same bytes this index was built from
+
+        firstPage and lastPage start at 1 (see pageOffsets)
+            (lastPage=None means the same as firstPage)
+
+        raises ValueError if the document can't be split up like this
+        """
+        if lastPage is None:
+            lastPage=firstPage
+        if not self.canExtractPages:
+            raise ValueError('document does not have usable DSC page comments')
+        if not 1<=firstPage<=lastPage<=len(self.pages):
+            raise ValueError(
+                f'pages {firstPage}-{lastPage} not in 1-{len(self.pages)}')
+        view=memoryview(data)
+        lastEnd=self.pages[-1].end
+        assert lastEnd is not None
+        return b''.join((
+            view[self.documentStart or 0:self.pages[0].start],
+            view[self.pageOffsets(firstPage)[0]:
+                self.pageOffsets(lastPage)[1]],
+            view[lastEnd:]))
+
+
+def _parsePageComment(value:str)->typing.Tuple[str,typing.Optional[int]]:
+    """
+    Split up a "%%Page: label ordinal" comment
+    (the label can be a (string with spaces))
+    """
+    label,_,ordinal=value.rpartition(' ')
+    if not label: # only one thing there
+        label=ordinal
+    if ordinal.isdigit():
+        return label.strip(),int(ordinal)
+    return value,None
+
+
+def _parseBoundingBox(value:str
+    )->typing.Optional[typing.Tuple[float,float,float,float]]:
+    """
+    Parse "llx lly urx ury", or None if it isn't (eg, it is "(atend)")
+    """
+    try:
+        llx,lly,urx,ury=(float(v) for v in value.split())
+    except ValueError:
+        return None
+    return llx,lly,urx,ury
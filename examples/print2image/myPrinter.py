@@ -5,7 +5,7 @@ A virtual printer device that creates an image file as output
 """
 import typing
 import os
-from virtualPrinter import Printer,PrintCallbackDocType
+from virtualPrinter import Printer,PrintCallbackDocType,RenderedPage
 try:
     from PIL import Image
 except ImportError as e:
@@ -22,13 +22,16 @@ class MyPrinter(Printer):
 
     def __init__(self):
         Printer.__init__(self,'Print to Image',acceptsFormat='png')
+        self.pageByPage=True # we get printPages() rather than printThis()
 
-    def doc2pil(self,doc):
+    def doc2pil(self,doc:PrintCallbackDocType):
         """
         Convert the doc buffer to a PIL image
+
+        (only the first page, if there are several)
         """
-        from io import StringIO
-        f=StringIO(doc)
+        from io import BytesIO
+        f=BytesIO(doc)
         img=Image.open(f)
         return img
 
@@ -66,16 +69,18 @@ class MyPrinter(Printer):
             return val
         return None
 
-    def printThis(self,
-        doc:PrintCallbackDocType,
+    def printPages(self,
+        pages:typing.Iterator[RenderedPage],
         title:typing.Optional[str]=None,
         author:typing.Optional[str]=None,
         filename:typing.Optional[str]=None
         )->None:
         """
-        Called whenever something is being printed.
+        Called whenever something is being printed, with
+        each page as soon as it is rendered.
 
-        We'll save the input doc to a book or book format
+        We'll save the first page where the user says, and
+        any others next to it (foo.png, foo-2.png, foo-3.png...)
         """
         print("Printing:")
         print("\tTitle:",title)
@@ -83,13 +88,15 @@ class MyPrinter(Printer):
         print("\tFilename:",filename)
         val=self.doSaveAsDialog(filename)
         if val is not None:
-            print("Saving to:",val)
-            img=self.doc2pil(doc)
-            img.save(val)
+            base,ext=os.path.splitext(val)
+            for page in pages:
+                if page.pageNumber>1:
+                    val=f'{base}-{page.pageNumber}{ext}'
+                print("Saving to:",val)
+                page.toPil().save(val)
         else:
             print("No output filename.  So never mind then, I guess.")
 
-
 if __name__=='__main__':
     # Simply run the printer
     p=MyPrinter()
@@ -0,0 +1,162 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Find the ghostscript program.
+
+This only happens the first time it is actually needed (not when
+the library is imported) and the answer is remembered after that.
+
+Where it looks, in order:
+    1. whatever was given to setGhostscriptApp()
+    2. the GHOSTSCRIPT_APP environment variable
+    3. the cache file (if GHOSTSCRIPT_CACHE_FILE is set)
+    4. the PATH
+    5. (on windows) the newest version in Program Files
+"""
+import typing
+import os
+import shutil
+import logging
+import threading
+
+from virtualPrinter.printerException import PrinterException
+
+logger=logging.getLogger(__name__)
+
+
+GHOSTSCRIPT_CACHE_FILE:typing.Optional[str]=\
+    os.environ.get('GHOSTSCRIPT_CACHE_FILE')
+
+if os.name=='nt':
+    _APP_NAMES:typing.Tuple[str,...]=(
+        'gswin64c.exe','gswin32c.exe','gswin.exe','gs.exe')
+else:
+    _APP_NAMES=('gs',)
+
+_ghostscriptApp:typing.Optional[str]=None
+_ghostscriptAppSearched:bool=False
+_ghostscriptAppLock=threading.Lock()
+
+
+def setGhostscriptApp(app:typing.Optional[str])->None:
+    """
+    Override where ghostscript is
+
+    None means to forget it and go look again next time
+    """
+    global _ghostscriptApp,_ghostscriptAppSearched # pylint: disable=W0603
+    with _ghostscriptAppLock:
+        _ghostscriptApp=app
+        _ghostscriptAppSearched=app is not None
+
+
+def findGhostscript()->typing.Optional[str]:
+    """
+    Find the ghostscript program
+
+    returns None if it is not installed
+    """
+    global _ghostscriptApp,_ghostscriptAppSearched # pylint: disable=W0603
+    with _ghostscriptAppLock:
+        if not _ghostscriptAppSearched:
+            _ghostscriptApp=_searchForGhostscript()
+            _ghostscriptAppSearched=True
+            logger.info('GHOSTSCRIPT_APP=%s',_ghostscriptApp)
+        return _ghostscriptApp
+
+
+def getGhostscriptApp()->str:
+    """
+    Find the ghostscript program
+
+    raises PrinterException if it is not installed
+    """
+    app=findGhostscript()
+    if app is None:
+        errString="""ERR: Ghostscript not found!
+            You can get it from:
+                http://www.ghostscript.com"""
+        raise PrinterException(errString)
+    return app
+
+
+def _searchForGhostscript()->typing.Optional[str]:
+    """
+    Go look for ghostscript (the slow part)
+    """
+    app:typing.Optional[str]=os.environ.get('GHOSTSCRIPT_APP')
+    if app:
+        return app.strip('"')
+    app=_readCacheFile()
+    if app is not None:
+        return app
+    for appName in _APP_NAMES:
+        app=shutil.which(appName)
+        if app is not None:
+            break
+    if app is None and os.name=='nt':
+        app=_searchProgramFiles()
+    if app is not None:
+        _writeCacheFile(app)
+    return app
+
+
+def _searchProgramFiles()->typing.Optional[str]:
+    """
+    Find the newest ghostscript in Program Files
+    """
+    app=None
+    bestVersion:float=0.0
+    val:float
+    for programFiles in ('ProgramFiles','ProgramFiles(x86)'):
+        if programFiles not in os.environ:
+            continue
+        gsDir=os.environ[programFiles]+os.sep+'gs'
+        if not os.path.isdir(gsDir):
+            continue
+        # find the newest version
+        for f in os.listdir(gsDir):
+            path=gsDir+os.sep+f
+            if os.path.isdir(path) and f.startswith('gs'):
+                try:
+                    val=float(f[2:])
+                except ValueError:
+                    val=0.0
+                if bestVersion<val:
+                    for appName in _APP_NAMES:
+                        appName=path+os.sep+'bin'+os.sep+appName
+                        if os.path.isfile(appName):
+                            bestVersion=val
+                            app=appName
+                            break
+    return app
+
+
+def _readCacheFile()->typing.Optional[str]:
+    """
+    Get where ghostscript was last time, if we saved it
+    (and it is still there)
+    """
+    if not GHOSTSCRIPT_CACHE_FILE:
+        return None
+    try:
+        with open(GHOSTSCRIPT_CACHE_FILE,'r',encoding='utf-8') as f:
+            app=f.read().strip()
+    except OSError:
+        return None
+    if app and os.path.isfile(app):
+        return app
+    return None
+
+
+def _writeCacheFile(app:str)->None:
+    """
+    Remember where ghostscript is for next time
+    """
+    if not GHOSTSCRIPT_CACHE_FILE:
+        return
+    try:
+        with open(GHOSTSCRIPT_CACHE_FILE,'w',encoding='utf-8') as f:
+            f.write(app)
+    except OSError:
+        pass # oh well, we'll just have to look again next time
@@ -0,0 +1,221 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Run ghostscript in-process by way of its C api (libgs / gsdll)
+rather than starting up a separate program.
+
+See also:
+    https://ghostscript.com/doc/current/API.htm
+"""
+import typing
+import os
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.pjlHeader import DEFAULT_HEADER_LIMIT,postscriptBody
+
+logger=logging.getLogger(__name__)
+
+
+GS_ARG_ENCODING_UTF8=1
+GS_ERROR_QUIT=-101 # not really an error
+GS_ERROR_NEED_INPUT=-106 # not really an error either
+RUN_STRING_CHUNK_SIZE=65536 # gsapi_run_string_continue max is 64k
+
+if os.name=='nt':
+    _FUNCTYPE=ctypes.WINFUNCTYPE # type: ignore # gsapi is stdcall
+    _LIBRARY_NAMES:typing.Tuple[str,...]=('gsdll64','gsdll32')
+else:
+    _FUNCTYPE=ctypes.CFUNCTYPE
+    _LIBRARY_NAMES=('gs',)
+
+_StdioCallback=_FUNCTYPE(ctypes.c_int,
+    ctypes.c_void_p,ctypes.POINTER(ctypes.c_char),ctypes.c_int)
+
+
+class GhostscriptLib:
+    """
+    Run ghostscript in-process by way of its C api
+
+    Ghostscript is usually built so that there can only be one
+    instance at a time per process, so conversions are serialized.
+    (If you want parallelism, use the subprocess or pool engines.)
+    """
+
+    _lock=threading.Lock()
+
+    def __init__(self,libraryPath:typing.Optional[str]=None):
+        """
+        libraryPath is the libgs.so / gsdll64.dll to load
+            (None means go find it)
+
+        raises OSError if the library cannot be loaded
+        """
+        if libraryPath is None:
+            libraryPath=findGhostscriptLib()
+            if libraryPath is None:
+                raise OSError('ghostscript library (libgs) not found')
+        if os.name=='nt':
+            self._lib=ctypes.WinDLL(libraryPath) # type: ignore
+        else:
+            self._lib=ctypes.CDLL(libraryPath)
+        lib=self._lib
+        lib.gsapi_new_instance.argtypes=[
+            ctypes.POINTER(ctypes.c_void_p),ctypes.c_void_p]
+        lib.gsapi_delete_instance.argtypes=[ctypes.c_void_p]
+        lib.gsapi_delete_instance.restype=None
+        lib.gsapi_set_stdio.argtypes=[ctypes.c_void_p,
+            _StdioCallback,_StdioCallback,_StdioCallback]
+        lib.gsapi_set_arg_encoding.argtypes=[ctypes.c_void_p,ctypes.c_int]
+        lib.gsapi_init_with_args.argtypes=[ctypes.c_void_p,
+            ctypes.c_int,ctypes.POINTER(ctypes.c_char_p)]
+        lib.gsapi_run_string_begin.argtypes=[ctypes.c_void_p,
+            ctypes.c_int,ctypes.POINTER(ctypes.c_int)]
+        lib.gsapi_run_string_continue.argtypes=[ctypes.c_void_p,
+            ctypes.c_char_p,ctypes.c_uint,
+            ctypes.c_int,ctypes.POINTER(ctypes.c_int)]
+        lib.gsapi_run_string_end.argtypes=[ctypes.c_void_p,
+            ctypes.c_int,ctypes.POINTER(ctypes.c_int)]
+        lib.gsapi_exit.argtypes=[ctypes.c_void_p]
+
+    def convert(self,
+        data:typing.Any,
+        gsDev:str='pdfwrite',
+        gsDevOptions:typing.Optional[typing.Iterable[str]]=None
+        )->bytes:
+        """
+        Converts postscript data to whatever gsDev makes
+
+        data is a bytes-like object or a binary file
+        """
+        output=bytearray()
+        messages=bytearray()
+
+        def stdinFn(handle,buf,length)->int:
+            _=handle,buf,length
+            return 0 # we never read from stdin
+
+        def stdoutFn(handle,buf,length)->int:
+            _=handle
+            output.extend(memoryview(
+                (ctypes.c_char*length).from_address(
+                    ctypes.addressof(buf.contents))))
+            return length
+
+        def stderrFn(handle,buf,length)->int:
+            _=handle
+            messages.extend(ctypes.string_at(buf,length))
+            return length
+
+        # hang onto these so they don't get garbage collected mid-job
+        callbacks=(_StdioCallback(stdinFn),
+            _StdioCallback(stdoutFn),_StdioCallback(stderrFn))
+        args=['gs','-q','-dNOPAUSE','-dBATCH','-dSAFER','-sDEVICE='+gsDev]
+        if gsDevOptions is not None:
+            args.extend(gsDevOptions)
+        args.extend((r'-sstdout=%stderr','-sOutputFile=-'))
+        argv=(ctypes.c_char_p*len(args))(*[a.encode('utf-8') for a in args])
+        with self._lock:
+            instance=ctypes.c_void_p()
+            self._check(
+                self._lib.gsapi_new_instance(ctypes.byref(instance),None),
+                'gsapi_new_instance',messages)
+            try:
+                self._lib.gsapi_set_stdio(instance,*callbacks)
+                self._lib.gsapi_set_arg_encoding(instance,
+                    GS_ARG_ENCODING_UTF8)
+                self._check(self._lib.gsapi_init_with_args(
+                    instance,len(args),argv),'gsapi_init_with_args',messages)
+                self._runData(instance,data,messages)
+            finally:
+                self._lib.gsapi_exit(instance)
+                self._lib.gsapi_delete_instance(instance)
+        return bytes(output)
+
+    def _runData(self,
+        instance:ctypes.c_void_p,
+        data:typing.Any,
+        messages:bytearray)->None:
+        """
+        Push all the postscript through the interpreter
+        """
+        exitCode=ctypes.c_int(0)
+        self._check(self._lib.gsapi_run_string_begin(
+            instance,0,ctypes.byref(exitCode)),'gsapi_run_string',messages)
+        for chunk in _chunks(data):
+            self._check(self._lib.gsapi_run_string_continue(
+                instance,chunk,len(chunk),0,ctypes.byref(exitCode)),
+                'gsapi_run_string',messages)
+        self._check(self._lib.gsapi_run_string_end(
+            instance,0,ctypes.byref(exitCode)),'gsapi_run_string',messages)
+
+    def _check(self,code:int,what:str,messages:bytearray)->None:
+        """
+        Raise an exception if a gsapi call failed
+        """
+        if code<0 and code not in (GS_ERROR_QUIT,GS_ERROR_NEED_INPUT):
+            msg=f'{what} failed ({code}):\n'
+            msg+=messages.decode('utf-8',errors='replace')
+            raise PrinterException(msg)
+
+
+def _chunks(data:typing.Any)->typing.Iterator[bytes]:
+    """
+    Split the postscript part of a job up into pieces small enough
+    for gsapi_run_string_continue()
+    """
+    if hasattr(data,'read'):
+        chunk=bytes(postscriptBody(data.read(DEFAULT_HEADER_LIMIT)))
+        while chunk:
+            for i in range(0,len(chunk),RUN_STRING_CHUNK_SIZE):
+                yield chunk[i:i+RUN_STRING_CHUNK_SIZE]
+            chunk=data.read(RUN_STRING_CHUNK_SIZE)
+        return
+    view=postscriptBody(data)
+    for i in range(0,len(view),RUN_STRING_CHUNK_SIZE):
+        yield bytes(view[i:i+RUN_STRING_CHUNK_SIZE])
+
+
+_ghostscriptLib:typing.Optional[GhostscriptLib]=None
+_ghostscriptLibLoaded:bool=False
+_ghostscriptLibLock=threading.Lock()
+
+
+def findGhostscriptLib()->typing.Optional[str]:
+    """
+    Find the ghostscript shared library, if it is installed
+
+    The GHOSTSCRIPT_LIB environment variable can be used to point
+    straight at it.
+    """
+    path=os.environ.get('GHOSTSCRIPT_LIB')
+    if path:
+        return path
+    for name in _LIBRARY_NAMES:
+        path=ctypes.util.find_library(name)
+        if path is not None:
+            return path
+    return None
+
+
+def getGhostscriptLib()->typing.Optional[GhostscriptLib]:
+    """
+    Get the shared GhostscriptLib, or None if libgs is not available
+
+    (it only tries to load it once)
+    """
+    # pylint: disable=global-statement
+    global _ghostscriptLib,_ghostscriptLibLoaded
+    with _ghostscriptLibLock:
+        if not _ghostscriptLibLoaded:
+            _ghostscriptLibLoaded=True
+            try:
+                _ghostscriptLib=GhostscriptLib()
+            except (OSError,AttributeError) as e:
+                # not there, or not a ghostscript we understand
+                logger.warning('ghostscript library not usable (%s)',e)
+                _ghostscriptLib=None
+        return _ghostscriptLib
@@ -0,0 +1,307 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+A pool of long-lived ghostscript processes.
+
+Starting ghostscript (loading the interpreter, initializing fonts,
+etc) often takes longer than actually converting a small document,
+so rather than start a new one for every job, we keep a few of them
+sitting around, and feed them one job after another.
+"""
+import typing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import subprocess
+import collections
+
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.pjlHeader import DEFAULT_HEADER_LIMIT,postscriptBody
+
+
+DONE_MARKER=b'%%[virtualPrinter done]%%'
+ERROR_MARKER=b'%%[virtualPrinter error]%%'
+
+
+def _psString(s:str)->str:
+    """
+    Make a string safe for use as a PostScript (string)
+    """
+    s=s.replace(os.sep,'/') # ghostscript is fine with / on windows too
+    return '('+s.replace('\\','\\\\').replace('(','\\(').replace(')','\\)')+')'
+
+
+class GhostscriptWorker:
+    """
+    A single running ghostscript process, waiting for jobs
+    for a particular device and device options.
+    """
+
+    def __init__(self,
+        ghostscriptApp:str,
+        gsDev:str,
+        gsDevOptions:typing.Iterable[str],
+        workDir:str):
+        """
+        ghostscriptApp is the ghostscript executable to run
+
+        workDir is the directory where job files are swapped
+        with ghostscript (it is the only place it may read/write)
+        """
+        self.gsDev:str=gsDev
+        self.gsDevOptions:typing.Tuple[str,...]=tuple(gsDevOptions)
+        self.workDir:str=workDir
+        self.jobsDone:int=0
+        self._idleOutput=os.path.join(workDir,f'idle{id(self)}.out')
+        cmd=[ghostscriptApp,'-q','-dNOPAUSE',
+            '--permit-file-all='+workDir.replace(os.sep,'/')+'/',
+            '-sDEVICE='+gsDev]
+        cmd.extend(self.gsDevOptions)
+        cmd.extend(('-sOutputFile='+self._idleOutput,'-'))
+        # pylint: disable=consider-using-with
+        self._process=subprocess.Popen(cmd,
+            stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        self._stdoutLines:queue.Queue=queue.Queue()
+        self.stderr:typing.Deque[bytes]=collections.deque(maxlen=50)
+        threading.Thread(target=self._readStdout,daemon=True).start()
+        threading.Thread(target=self._readStderr,daemon=True).start()
+
+    def _readStdout(self)->None:
+        """
+        Keep stdout drained (runs in its own thread)
+        """
+        assert self._process.stdout is not None
+        for line in self._process.stdout:
+            self._stdoutLines.put(line)
+        self._stdoutLines.put(None) # eof
+
+    def _readStderr(self)->None:
+        """
+        Keep stderr drained (runs in its own thread)
+        """
+        assert self._process.stderr is not None
+        for line in self._process.stderr:
+            self.stderr.append(line)
+
+    @property
+    def alive(self)->bool:
+        """
+        whether the ghostscript process is still running
+        """
+        return self._process.poll() is None
+
+    def convert(self,inputFilename:str,outputFilename:str,
+        timeout:typing.Optional[float]=None)->None:
+        """
+        Convert a postscript file to an output file
+
+        if it takes longer than timeout seconds, the worker is killed
+        and a PrinterException is raised
+        """
+        # Run the job inside save/restore so one job cannot leave
+        # anything lying around for the next.  Switching OutputFile
+        # afterwards is what makes the device finish writing the file.
+        self.stderr.clear()
+        program='\n'.join((
+            '<< /OutputFile '+_psString(outputFilename)+' >> setpagedevice',
+            '/virtualPrinterSave save def',
+            '{ '+_psString(inputFilename)+' run } stopped',
+            '{ ('+ERROR_MARKER.decode('ascii')+'\\n) print flush } if',
+            'clear cleardictstack virtualPrinterSave restore',
+            '<< /OutputFile '+_psString(self._idleOutput)+' >> setpagedevice',
+            '('+DONE_MARKER.decode('ascii')+'\\n) print flush',
+            ''))
+        assert self._process.stdin is not None
+        try:
+            self._process.stdin.write(program.encode('utf-8'))
+            self._process.stdin.flush()
+        except OSError as e:
+            raise PrinterException('ghostscript worker died') from e
+        failed=False
+        while True:
+            try:
+                line=self._stdoutLines.get(timeout=timeout)
+            except queue.Empty as e:
+                self._process.kill() # it's hung, so no point being polite
+                self.close()
+                msg=f'ghostscript took more than {timeout} seconds'
+                raise PrinterException(msg) from e
+            if line is None:
+                msg='ghostscript worker died:\n'+self._stderrText()
+                raise PrinterException(msg)
+            if line.startswith(ERROR_MARKER):
+                failed=True
+            elif line.startswith(DONE_MARKER):
+                break
+        self.jobsDone+=1
+        if failed:
+            msg='ghostscript could not convert the job:\n'+self._stderrText()
+            raise PrinterException(msg)
+
+    def _stderrText(self)->str:
+        """
+        Whatever ghostscript complained about lately
+        """
+        return b''.join(self.stderr).decode('utf-8',errors='replace')
+
+    def close(self)->None:
+        """
+        Shut down the ghostscript process
+        """
+        if self.alive:
+            try:
+                assert self._process.stdin is not None
+                self._process.stdin.close()
+                self._process.wait(5.0)
+            except (OSError,subprocess.TimeoutExpired):
+                self._process.kill()
+                self._process.wait()
+        try:
+            os.remove(self._idleOutput)
+        except OSError:
+            pass
+
+
+class GhostscriptPool:
+    """
+    A pool of long-lived ghostscript processes.
+
+    There are up to poolSize workers for each device/options
+    combination.  Workers are replaced after maxJobsPerWorker jobs,
+    if they die, or if a job takes longer than timeout seconds.
+    """
+
+    def __init__(self,
+        ghostscriptApp:str,
+        poolSize:int=2,
+        maxJobsPerWorker:int=100,
+        timeout:typing.Optional[float]=300.0):
+        """
+        ghostscriptApp is the ghostscript executable to run
+        """
+        self.ghostscriptApp:str=ghostscriptApp.strip('"')
+        self.poolSize:int=max(1,poolSize)
+        self.maxJobsPerWorker:int=maxJobsPerWorker
+        self.timeout:typing.Optional[float]=timeout
+        self.workDir:str=tempfile.mkdtemp(prefix='virtualPrinter_gs_')
+        self._idle:typing.Dict[
+            typing.Tuple[str,typing.Tuple[str,...]],
+            typing.List[GhostscriptWorker]]={}
+        self._count:typing.Dict[
+            typing.Tuple[str,typing.Tuple[str,...]],int]={}
+        self._lock=threading.Condition()
+        self._closed:bool=False
+
+    def __del__(self):
+        self.close()
+
+    def _acquire(self,key:typing.Tuple[str,typing.Tuple[str,...]]
+        )->GhostscriptWorker:
+        """
+        Get an idle worker for the given device/options,
+        starting one if need be
+        """
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PrinterException('ghostscript pool is closed')
+                idle=self._idle.setdefault(key,[])
+                while idle:
+                    worker=idle.pop()
+                    if worker.alive:
+                        return worker
+                    worker.close()
+                    self._count[key]-=1
+                if self._count.get(key,0)<self.poolSize:
+                    self._count[key]=self._count.get(key,0)+1
+                    break
+                self._lock.wait()
+        try:
+            return GhostscriptWorker(self.ghostscriptApp,
+                key[0],key[1],self.workDir)
+        except Exception:
+            self._discard(key)
+            raise
+
+    def _release(self,key:typing.Tuple[str,typing.Tuple[str,...]],
+        worker:GhostscriptWorker)->None:
+        """
+        Give a worker back to the pool (or retire it)
+        """
+        if self._closed or not worker.alive \
+            or worker.jobsDone>=self.maxJobsPerWorker:
+            worker.close()
+            self._discard(key)
+            return
+        with self._lock:
+            self._idle[key].append(worker)
+            self._lock.notify()
+
+    def _discard(self,key:typing.Tuple[str,typing.Tuple[str,...]])->None:
+        """
+        Forget about a worker that is gone
+        """
+        with self._lock:
+            self._count[key]-=1
+            self._lock.notify()
+
+    def convert(self,
+        data:typing.Any,
+        gsDev:str='pdfwrite',
+        gsDevOptions:typing.Optional[typing.Iterable[str]]=None
+        )->bytes:
+        """
+        Converts postscript data to whatever gsDev makes
+
+        data is a bytes-like object or a binary file
+        """
+        key=(gsDev,tuple(gsDevOptions or ()))
+        fd,inputFilename=tempfile.mkstemp(suffix='.ps',dir=self.workDir)
+        outputFilename=inputFilename[:-3]+'.out'
+        try:
+            with os.fdopen(fd,'wb') as f:
+                _writePostscript(data,f)
+            worker=self._acquire(key)
+            try:
+                worker.convert(inputFilename,outputFilename,self.timeout)
+            finally:
+                self._release(key,worker)
+            with open(outputFilename,'rb') as f:
+                return f.read()
+        finally:
+            for filename in (inputFilename,outputFilename):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def close(self)->None:
+        """
+        Shut down all the workers
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed=True
+            workers=[w for idle in self._idle.values() for w in idle]
+            self._idle={}
+            self._lock.notify_all()
+        for worker in workers:
+            worker.close()
+        shutil.rmtree(self.workDir,ignore_errors=True)
+
+
+def _writePostscript(data:typing.Any,f:typing.BinaryIO)->None:
+    """
+    Write the postscript part of a print job to a file
+    (skipping over the PJL header, since we are not
+    handing it to ghostscript as the main input)
+    """
+    if hasattr(data,'read'):
+        f.write(postscriptBody(data.read(DEFAULT_HEADER_LIMIT)))
+        shutil.copyfileobj(data,f,1024*1024)
+        return
+    f.write(postscriptBody(data))
@@ -0,0 +1,323 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Limits on how much work a print server takes on at once.
+
+Without limits, a flood of big jobs gets accepted, buffered, and
+handed to ghostscript all at once until the machine runs out of
+memory.  With them:
+    * past maxConcurrentJobs, accepted jobs wait their turn
+    * past maxQueuedJobs waiting, no more connections are accepted
+      (they wait in the OS's listen backlog instead)
+    * past maxInFlightBytes, jobs stop being read from, so TCP flow
+      control makes the senders wait
+    * a job bigger than maxJobSize is rejected
+    * a sender that goes quiet for idleTimeout seconds, or takes
+      more than jobTimeout seconds to send the whole job, is cut off
+
+so that under overload, things simply slow down to what the
+machine can handle.
+"""
+import typing
+import time
+import logging
+import threading
+import collections
+
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.jobMetrics import JobTiming
+
+logger=logging.getLogger(__name__)
+
+
+class JobRejected(PrinterException):
+    """
+    A job went over a hard limit, so it is not being printed
+    """
+
+
+class JobTimedOut(JobRejected):
+    """
+    A sender took too long, so its job was cut off
+    """
+
+
+class JobLimits:
+    """
+    Limits on how much work a print server takes on at once
+    (see the top of jobLimits.py)
+
+    Any limit that is None means no limit.
+
+    Everything is thread-safe.  The methods that wait have a
+    non-blocking "try" version for use from an event loop.
+    """
+
+    def __init__(self,
+        maxConcurrentJobs:typing.Optional[int]=None,
+        maxQueuedJobs:typing.Optional[int]=None,
+        maxInFlightBytes:typing.Optional[int]=None,
+        maxJobSize:typing.Optional[int]=None,
+        idleTimeout:typing.Optional[float]=300.0,
+        jobTimeout:typing.Optional[float]=None):
+        """
+        maxConcurrentJobs is how many jobs can be received and
+            converted at the same time
+
+        maxQueuedJobs is how many accepted jobs can be waiting for
+            their turn before we stop accepting more
+
+        maxInFlightBytes is how many bytes all the jobs being
+            handled can add up to before we stop reading more
+            (the oldest job is always allowed to keep going,
+            so that something can always finish)
+
+        maxJobSize is how big one job can be before it is rejected
+
+        idleTimeout is how many seconds a sender can go without
+            sending anything before its job is cut off
+
+        jobTimeout is how many seconds a sender gets to send
+            the whole job, from when it connected
+        """
+        self.maxConcurrentJobs:typing.Optional[int]=maxConcurrentJobs
+        self.maxQueuedJobs:typing.Optional[int]=maxQueuedJobs
+        self.maxInFlightBytes:typing.Optional[int]=maxInFlightBytes
+        self.maxJobSize:typing.Optional[int]=maxJobSize
+        self.idleTimeout:typing.Optional[float]=idleTimeout
+        self.jobTimeout:typing.Optional[float]=jobTimeout
+        self.queuedJobs:int=0 # accepted, but not started yet
+        self.runningJobs:int=0
+        self.inFlightBytes:int=0
+        self.rejected:typing.Dict[str,int]={} # {reason:count}
+        self.timedOut:typing.Dict[str,int]={} # {reason:count}
+        # {jobId:bytes} for all the jobs we have, oldest first
+        self._jobBytes:typing.OrderedDict[int,int]=collections.OrderedDict()
+        self._running:typing.Set[int]=set()
+        # jobs that are still being received, oldest first
+        self._receiving:typing.OrderedDict[int,None]=\
+            collections.OrderedDict()
+        self._condition=threading.Condition()
+
+    def _canAccept(self)->bool:
+        """
+        Whether there is room in the queue (with the lock held)
+        """
+        return self.maxQueuedJobs is None \
+            or self.queuedJobs<self.maxQueuedJobs
+
+    def canAccept(self)->bool:
+        """
+        Whether there is room in the queue for another job
+        """
+        with self._condition:
+            return self._canAccept()
+
+    def waitToAccept(self,timeout:typing.Optional[float]=None)->bool:
+        """
+        Wait until there is room in the queue for another job
+
+        returns whether there is (False if it timed out)
+        """
+        with self._condition:
+            return self._condition.wait_for(self._canAccept,timeout)
+
+    def admit(self,job:JobTiming)->None:
+        """
+        Call this when a job has been accepted
+        """
+        with self._condition:
+            self.queuedJobs+=1
+            self._jobBytes[job.jobId]=0
+
+    def _canStart(self)->bool:
+        """
+        Whether another job can start (with the lock held)
+        """
+        return self.maxConcurrentJobs is None \
+            or self.runningJobs<self.maxConcurrentJobs
+
+    def _start(self,job:JobTiming)->None:
+        """
+        Start a job (with the lock held)
+        """
+        self.queuedJobs-=1
+        self.runningJobs+=1
+        self._running.add(job.jobId)
+        self._condition.notify_all() # there is room in the queue
+
+    def start(self,job:JobTiming)->None:
+        """
+        Wait for this job's turn to be handled
+        """
+        with self._condition:
+            self._condition.wait_for(self._canStart)
+            self._start(job)
+
+    def tryStart(self,job:JobTiming)->bool:
+        """
+        Start handling this job if it is its turn
+
+        returns whether it was
+        """
+        with self._condition:
+            if not self._canStart():
+                return False
+            self._start(job)
+            return True
+
+    def _hasRoom(self,job:JobTiming)->bool:
+        """
+        Whether a job can receive more (with the lock held)
+        """
+        if self.maxInFlightBytes is None \
+            or self.inFlightBytes<self.maxInFlightBytes:
+            return True
+        # the oldest job being received gets to keep going no matter
+        # what, otherwise half-received jobs could wait on each other
+        # forever
+        self._receiving.setdefault(job.jobId,None)
+        return next(iter(self._receiving))==job.jobId
+
+    def waitForRoom(self,job:JobTiming)->None:
+        """
+        Wait until there is room for this job to receive more
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._hasRoom(job))
+
+    def hasRoom(self,job:JobTiming)->bool:
+        """
+        Whether there is room for this job to receive more
+        """
+        with self._condition:
+            return self._hasRoom(job)
+
+    def addBytes(self,job:JobTiming,numBytes:int)->None:
+        """
+        Count bytes that have been received for a job
+
+        raises JobRejected if it is now too big
+        """
+        with self._condition:
+            jobBytes=self._jobBytes.get(job.jobId,0)+numBytes
+            self._jobBytes[job.jobId]=jobBytes
+            self.inFlightBytes+=numBytes
+        if self.maxJobSize is not None and jobBytes>self.maxJobSize:
+            self.reject(job,'too big',
+                f'job is over the {self.maxJobSize} byte limit')
+
+    def received(self,job:JobTiming)->None:
+        """
+        Call this when all of a job has been received
+        (its bytes are still in flight until finish())
+        """
+        with self._condition:
+            self._receiving.pop(job.jobId,None)
+            self._condition.notify_all()
+
+    def reject(self,
+        job:JobTiming,
+        reason:str,
+        message:str
+        )->typing.NoReturn:
+        """
+        Reject a job
+
+        reason is what it is counted under (eg, "too big")
+
+        raises JobRejected (always)
+        """
+        job.rejected=reason
+        with self._condition:
+            self.rejected[reason]=self.rejected.get(reason,0)+1
+        logger.warning('Rejecting job: %s',message)
+        raise JobRejected(message)
+
+    def _deadlines(self,
+        job:JobTiming,
+        lastData:float
+        )->typing.List[typing.Tuple[float,str]]:
+        """
+        Get [(when,reason)] for all the deadlines a job has
+
+        lastData is when (time.perf_counter()) data last arrived
+        """
+        deadlines=[]
+        if self.idleTimeout is not None:
+            deadlines.append((lastData+self.idleTimeout,'idle timeout'))
+        if self.jobTimeout is not None:
+            deadlines.append(
+                (job.marks['accepted']+self.jobTimeout,'job timeout'))
+        return deadlines
+
+    def timeLeft(self,job:JobTiming,lastData:float)->typing.Optional[float]:
+        """
+        How many seconds until a job being received hits a deadline
+
+        lastData is when (time.perf_counter()) data last arrived
+
+        returns None if it has no deadlines
+        """
+        deadlines=self._deadlines(job,lastData)
+        if not deadlines:
+            return None
+        return min(deadlines)[0]-time.perf_counter()
+
+    def timeOut(self,job:JobTiming,lastData:float)->typing.NoReturn:
+        """
+        Cut off a job that has hit a deadline (see timeLeft)
+
+        raises JobTimedOut (always)
+        """
+        deadlines=self._deadlines(job,lastData)
+        reason=min(deadlines)[1] if deadlines else 'timeout'
+        job.timedOut=reason
+        with self._condition:
+            self.timedOut[reason]=self.timedOut.get(reason,0)+1
+        message=f'{reason} after receiving {job.bytesReceived} bytes'
+        logger.warning('Cutting off job: %s',message)
+        raise JobTimedOut(message)
+
+    def finish(self,job:JobTiming)->None:
+        """
+        Call this when a job is finished (one way or another)
+        to free up everything it was using
+        """
+        with self._condition:
+            self.inFlightBytes-=self._jobBytes.pop(job.jobId,0)
+            self._receiving.pop(job.jobId,None)
+            if job.jobId in self._running:
+                self._running.discard(job.jobId)
+                self.runningJobs-=1
+            else: # never got started
+                self.queuedJobs-=1
+            self._condition.notify_all()
+
+    def snapshot(self)->typing.Dict[str,typing.Any]:
+        """
+        Get the current state as a plain dict (eg, to save as json)
+        """
+        with self._condition:
+            return {
+                'queuedJobs':self.queuedJobs,
+                'runningJobs':self.runningJobs,
+                'inFlightBytes':self.inFlightBytes,
+                'rejected':dict(self.rejected),
+                'timedOut':dict(self.timedOut)}
+
+
+async def waitAsync(
+    ready:typing.Callable[[],bool],
+    pollSeconds:float=0.01
+    )->None:
+    """
+    Wait (on an event loop) for one of the non-blocking
+    JobLimits methods to return True
+    """
+    import asyncio # (only the asyncio server needs it)
+    start=time.monotonic()
+    while not ready():
+        # back off a bit if it is taking a while
+        await asyncio.sleep(pollSeconds if time.monotonic()-start<1.0
+            else pollSeconds*10)
@@ -0,0 +1,510 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Keep track of where the time goes for every print job.
+
+Each job gets a JobTiming that collects timestamps as it goes
+(accepted, first byte, last byte, header parsed, conversion
+start/end, callback done).  When the job is finished, JobMetrics
+adds it to its counters and histograms and passes it along to
+any hooks.  The metrics can also be served, in Prometheus text
+format, on a loopback http port by a MetricsHttpServer.
+"""
+import typing
+import time
+import bisect
+import logging
+import itertools
+import threading
+import contextlib
+import contextvars
+if typing.TYPE_CHECKING:
+    # (only needed for annotations here.  http.server itself is
+    # imported when a MetricsHttpServer is started, since most
+    # servers never serve their metrics)
+    import http.server
+    from virtualPrinter.dscIndex import DscIndex
+
+# (when they happen, more or less in this order)
+JOB_MARKS=('accepted','started','firstByte','headerParsed','lastByte',
+    'conversionStart','conversionEnd','callbackDone','finished')
+
+# name:(start mark,end mark)
+JOB_SPANS:typing.Dict[str,typing.Tuple[str,str]]={
+    'queueWait':('accepted','started'),
+    'receive':('firstByte','lastByte'),
+    'headerParse':('firstByte','headerParsed'),
+    'conversion':('conversionStart','conversionEnd'),
+    'callback':('lastByte','callbackDone'),
+    'total':('accepted','finished')}
+
+SECONDS_BUCKETS=(0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,
+    1.0,2.5,5.0,10.0,30.0,60.0,120.0,300.0)
+BYTES_BUCKETS=tuple(1024*4**i for i in range(11)) # 1KiB..1GiB
+
+DEFAULT_METRICS_PORT=9464
+
+logger=logging.getLogger(__name__)
+
+
+class JobTiming:
+    """
+    Timestamps (from time.perf_counter()) for one print job
+    """
+
+    _nextJobId=itertools.count(1)
+
+    def __init__(self,address:typing.Any=None):
+        """
+        address is who sent the job
+
+        (the job counts as accepted as soon as this is created)
+        """
+        self.jobId:int=next(JobTiming._nextJobId)
+        self.address:typing.Any=address
+        self.startTime:float=time.time() # wall clock, for humans
+        self.marks:typing.Dict[str,float]={'accepted':time.perf_counter()}
+        self.bytesReceived:int=0
+        self.title:typing.Optional[str]=None
+        self.copies:int=1 # (if the sender says, eg over LPD)
+        self.error:typing.Optional[str]=None
+        # why it was turned away, if it was (see jobLimits.py)
+        self.rejected:typing.Optional[str]=None
+        # which deadline it missed, if it did (also see jobLimits.py)
+        self.timedOut:typing.Optional[str]=None
+        # where the pages are (filled in as the job arrives)
+        self.dscIndex:typing.Optional['DscIndex']=None
+
+    def mark(self,name:str)->None:
+        """
+        Note that something just happened
+        """
+        self.marks[name]=time.perf_counter()
+
+    def addBytes(self,numBytes:int)->None:
+        """
+        Note that more of the job has arrived
+        """
+        if 'firstByte' not in self.marks:
+            self.mark('firstByte')
+        self.bytesReceived+=numBytes
+
+    def span(self,name:str)->typing.Optional[float]:
+        """
+        Get how long one of the JOB_SPANS took, in seconds
+
+        returns None if it didn't happen (eg, no conversion)
+        """
+        start,end=JOB_SPANS[name]
+        if start not in self.marks or end not in self.marks:
+            return None
+        return self.marks[end]-self.marks[start]
+
+    def spans(self)->typing.Dict[str,typing.Optional[float]]:
+        """
+        Get how long all the JOB_SPANS took, in seconds
+        """
+        return {name:self.span(name) for name in JOB_SPANS}
+
+    def __repr__(self)->str:
+        spans=' '.join(f'{name}={seconds:.6f}'
+            for name,seconds in self.spans().items() if seconds is not None)
+        return f'JobTiming(job {self.jobId}, {self.bytesReceived} bytes, '\
+            f'{spans}, error={self.error!r})'
+
+
+_currentJob:'contextvars.ContextVar[typing.Optional[JobTiming]]'=\
+    contextvars.ContextVar('virtualPrinterJob',default=None)
+
+
+def currentJob()->typing.Optional[JobTiming]:
+    """
+    The JobTiming for the job being handled right now, if any
+    """
+    return _currentJob.get()
+
+
+def markJob(name:str)->None:
+    """
+    Mark something happening to the job being handled right now
+    (does nothing if we are not handling a job)
+    """
+    job=_currentJob.get()
+    if job is not None:
+        job.mark(name)
+
+
+@contextlib.contextmanager
+def jobContext(job:JobTiming)->typing.Iterator[JobTiming]:
+    """
+    Make job the current job for anything called in this context
+    (eg, so a Printer can mark when it starts and stops converting)
+    """
+    token=_currentJob.set(job)
+    try:
+        yield job
+    finally:
+        _currentJob.reset(token)
+
+
+class Histogram:
+    """
+    A Prometheus-style histogram
+    """
+
+    def __init__(self,buckets:typing.Iterable[float]):
+        """
+        buckets are the upper bounds to count things into
+        """
+        self.buckets:typing.List[float]=sorted(buckets)
+        self.counts:typing.List[int]=[0]*(len(self.buckets)+1) # +Inf
+        self.count:int=0
+        self.sum:float=0.0
+
+    def observe(self,value:float)->None:
+        """
+        Add a value (caller takes care of locking)
+        """
+        self.counts[bisect.bisect_left(self.buckets,value)]+=1
+        self.count+=1
+        self.sum+=value
+
+    def cumulativeCounts(self)->typing.List[typing.Tuple[float,int]]:
+        """
+        Get [(upperBound,how many are <= it)] including +Inf
+        """
+        ret=[]
+        total=0
+        for bound,n in zip(self.buckets+[float('inf')],self.counts):
+            total+=n
+            ret.append((bound,total))
+        return ret
+
+
+# attribute:(prometheus name,help,buckets,what it measures)
+#   where what it measures is one of the JOB_SPANS, or "size"
+_HistogramSpec=typing.Tuple[str,str,typing.Tuple[float,...],str]
+_HISTOGRAMS:typing.Dict[str,_HistogramSpec]={
+    'jobSizeBytes':('job_size_bytes','Size of print jobs',
+        BYTES_BUCKETS,'size'),
+    'queueWaitSeconds':('queue_wait_seconds',
+        'Time jobs waited for a worker after being accepted',
+        SECONDS_BUCKETS,'queueWait'),
+    'receiveSeconds':('receive_seconds',
+        'Time from the first byte of a job to the last',
+        SECONDS_BUCKETS,'receive'),
+    'headerParseSeconds':('header_parse_seconds',
+        'Time from the first byte of a job until its PJL header was parsed',
+        SECONDS_BUCKETS,'headerParse'),
+    'conversionSeconds':('conversion_seconds',
+        'Time spent converting jobs (ghostscript)',
+        SECONDS_BUCKETS,'conversion'),
+    'callbackSeconds':('callback_seconds',
+        'Time from the last byte of a job until its callback was done',
+        SECONDS_BUCKETS,'callback'),
+    'jobSeconds':('job_seconds',
+        'Time from accepting a job until it was completely handled',
+        SECONDS_BUCKETS,'total')}
+
+JobHookFunctionType=typing.Callable[[JobTiming],None]
+
+# (name,type,help,[sample lines])
+_MetricFamily=typing.Tuple[str,str,str,typing.List[str]]
+
+
+class JobMetrics:
+    """
+    Counters and histograms over all the jobs a server has handled
+
+    Hooks added with addHook() get called with the JobTiming
+    of every job when it is finished.
+    """
+
+    def __init__(self,
+        prefix:str='virtualprinter',
+        labels:typing.Optional[typing.Dict[str,str]]=None):
+        """
+        prefix goes in front of all the prometheus metric names
+
+        labels get added to all the prometheus metrics
+            (eg, {"printer":"My Printer"} to tell printers apart)
+        """
+        self.prefix:str=prefix
+        self.labels:typing.Dict[str,str]=dict(labels or {})
+        self.jobsAccepted:int=0
+        self.jobsCompleted:int=0
+        self.jobsFailed:int=0
+        self.jobsRejected:int=0 # turned away for going over a limit
+        self.jobsTimedOut:int=0 # cut off for taking too long to send
+        self.partialBytes:int=0 # received in jobs that were cut off
+        self.jobsInProgress:int=0
+        self.bytesReceived:int=0
+        self.histograms:typing.Dict[str,Histogram]={
+            name:Histogram(buckets)
+            for name,(_,_,buckets,_) in _HISTOGRAMS.items()}
+        self._hooks:typing.List[JobHookFunctionType]=[]
+        self._lock=threading.Lock()
+
+    def addHook(self,hook:JobHookFunctionType)->None:
+        """
+        Call hook(jobTiming) every time a job is finished
+
+        (it is called on whatever thread handled the job, so keep it quick)
+        """
+        with self._lock:
+            self._hooks=self._hooks+[hook]
+
+    def removeHook(self,hook:JobHookFunctionType)->None:
+        """
+        Stop calling a hook
+        """
+        with self._lock:
+            self._hooks=[h for h in self._hooks if h!=hook]
+
+    def jobAccepted(self,job:JobTiming)->None:
+        """
+        Call this when a new job has been accepted
+        """
+        _=job
+        with self._lock:
+            self.jobsAccepted+=1
+            self.jobsInProgress+=1
+
+    def jobDone(self,job:JobTiming)->None:
+        """
+        Call this when a job is finished (successfully or not)
+        """
+        job.mark('finished')
+        with self._lock:
+            self.jobsInProgress-=1
+            if job.timedOut is not None:
+                self.jobsTimedOut+=1
+                self.partialBytes+=job.bytesReceived
+            elif job.rejected is not None:
+                self.jobsRejected+=1
+                self.partialBytes+=job.bytesReceived
+            elif job.error is None:
+                self.jobsCompleted+=1
+            else:
+                self.jobsFailed+=1
+            self.bytesReceived+=job.bytesReceived
+            for name,(_,_,_,what) in _HISTOGRAMS.items():
+                if what=='size':
+                    value:typing.Optional[float]=job.bytesReceived
+                else:
+                    value=job.span(what)
+                if value is not None:
+                    self.histograms[name].observe(value)
+            hooks=self._hooks
+        for hook in hooks:
+            try:
+                hook(job)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('Job hook %r failed',hook)
+
+    def snapshot(self)->typing.Dict[str,typing.Any]:
+        """
+        Get everything as a plain dict (eg, to save as json)
+        """
+        with self._lock:
+            return {
+                'jobsAccepted':self.jobsAccepted,
+                'jobsCompleted':self.jobsCompleted,
+                'jobsFailed':self.jobsFailed,
+                'jobsRejected':self.jobsRejected,
+                'jobsTimedOut':self.jobsTimedOut,
+                'partialBytes':self.partialBytes,
+                'jobsInProgress':self.jobsInProgress,
+                'bytesReceived':self.bytesReceived,
+                'histograms':{name:{
+                    'count':h.count,
+                    'sum':h.sum,
+                    'buckets':h.cumulativeCounts()}
+                    for name,h in self.histograms.items()}}
+
+    def prometheusText(self)->str:
+        """
+        Get everything in Prometheus text exposition format
+        """
+        return combinedPrometheusText([self])
+
+    def _prometheusFamilies(self)->typing.List[_MetricFamily]:
+        """
+        Get every metric as (name,type,help,[sample lines])
+        """
+        families:typing.List[_MetricFamily]=[]
+        labels=_labelText(self.labels)
+
+        def simple(name:str,kind:str,helpText:str,value:float)->None:
+            name=f'{self.prefix}_{name}'
+            families.append((name,kind,helpText,[f'{name}{labels} {value}']))
+
+        with self._lock:
+            simple('jobs_accepted_total','counter',
+                'Print jobs accepted',self.jobsAccepted)
+            simple('jobs_completed_total','counter',
+                'Print jobs handled successfully',self.jobsCompleted)
+            simple('jobs_failed_total','counter',
+                'Print jobs that failed',self.jobsFailed)
+            simple('jobs_rejected_total','counter',
+                'Print jobs rejected for going over a limit',
+                self.jobsRejected)
+            simple('jobs_timed_out_total','counter',
+                'Print jobs cut off for taking too long to send',
+                self.jobsTimedOut)
+            simple('jobs_in_progress','gauge',
+                'Print jobs being handled right now',self.jobsInProgress)
+            simple('bytes_received_total','counter',
+                'Bytes received in finished print jobs',self.bytesReceived)
+            simple('partial_bytes_total','counter',
+                'Bytes received in print jobs that were cut off',
+                self.partialBytes)
+            for attr,(promName,helpText,_,_) in _HISTOGRAMS.items():
+                h=self.histograms[attr]
+                name=f'{self.prefix}_{promName}'
+                samples=[]
+                for bound,n in h.cumulativeCounts():
+                    le='+Inf' if bound==float('inf') else repr(float(bound))
+                    samples.append(f'{name}_bucket'
+                        f'{_labelText(self.labels,le=le)} {n}')
+                samples.append(f'{name}_sum{labels} {h.sum!r}')
+                samples.append(f'{name}_count{labels} {h.count}')
+                families.append((name,'histogram',helpText,samples))
+        return families
+
+
+def combinedPrometheusText(metrics:typing.Iterable[JobMetrics])->str:
+    """
+    Get several JobMetrics (eg, one per printer, told apart
+    by their labels) in Prometheus text exposition format
+    """
+    families:typing.Dict[str,_MetricFamily]={}
+    for m in metrics:
+        for name,kind,helpText,samples in m._prometheusFamilies():
+            if name in families:
+                families[name][3].extend(samples)
+            else:
+                families[name]=(name,kind,helpText,samples)
+    lines=[]
+    for name,kind,helpText,samples in families.values():
+        lines.append(f'# HELP {name} {helpText}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return '\n'.join(lines)+'\n'
+
+
+def _labelText(labels:typing.Dict[str,str],**moreLabels:str)->str:
+    """
+    Format labels the way prometheus wants them, eg {printer="pdf"}
+    """
+    allLabels=dict(labels,**moreLabels)
+    if not allLabels:
+        return ''
+    return '{'+','.join(
+        f'{k}="{_escapeLabel(str(v))}"' for k,v in allLabels.items())+'}'
+
+
+def _escapeLabel(value:str)->str:
+    """
+    Escape a prometheus label value
+    """
+    return value.replace('\\','\\\\').replace('"','\\"')\
+        .replace('\n','\\n')
+
+
+class PrometheusSource(typing.Protocol):
+    """
+    Anything that can give its metrics in Prometheus text format
+    (eg, a JobMetrics)
+    """
+
+    def prometheusText(self)->str:
+        """
+        Get the metrics in Prometheus text exposition format
+        """
+
+
+class MetricsHttpServer:
+    """
+    Serve JobMetrics in Prometheus text format (at /metrics)
+    on a background thread
+    """
+
+    def __init__(self,
+        metrics:PrometheusSource,
+        ip:str='127.0.0.1',
+        port:int=DEFAULT_METRICS_PORT):
+        """
+        It is best to leave ip on loopback and let whatever
+        scrapes it (or a reverse proxy) take care of the rest.
+
+        port=0 means any unused port (see address once started)
+        """
+        self.metrics:PrometheusSource=metrics
+        self.ip:str=ip
+        self.port:int=port
+        self.address:typing.Optional[typing.Tuple[str,int]]=None
+        self._httpServer:typing.Optional['http.server.HTTPServer']=None
+        self._thread:typing.Optional[threading.Thread]=None
+
+    def start(self)->None:
+        """
+        Start serving
+        """
+        if self._httpServer is not None:
+            return
+        import http.server # pylint: disable=import-outside-toplevel
+        metrics=self.metrics
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+            """
+            Answers GET /metrics
+            """
+
+            def do_GET(self)->None: # pylint: disable=invalid-name
+                """
+                Send the metrics
+                """
+                if self.path.split('?',1)[0] not in ('/','/metrics'):
+                    self.send_error(404)
+                    return
+                body=metrics.prometheusText().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                    'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,format:str,*args:typing.Any)->None:
+                # pylint: disable=redefined-builtin
+                _=format,args # don't spam the console with every scrape
+
+        self._httpServer=http.server.ThreadingHTTPServer(
+            (self.ip,self.port),MetricsRequestHandler)
+        self._httpServer.daemon_threads=True
+        self.address=self._httpServer.server_address[0:2] # type: ignore
+        self._thread=threading.Thread(target=self._httpServer.serve_forever,
+            name='metricsHttpServer',daemon=True)
+        self._thread.start()
+
+    def close(self)->None:
+        """
+        Stop serving
+        """
+        if self._httpServer is None:
+            return
+        self._httpServer.shutdown()
+        self._httpServer.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self._httpServer=None
+        self._thread=None
+        self.address=None
+
+    def __enter__(self)->'MetricsHttpServer':
+        self.start()
+        return self
+
+    def __exit__(self,*args:typing.Any)->None:
+        self.close()
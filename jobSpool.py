@@ -0,0 +1,142 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Somewhere to put a print job while it is being received.
+
+Small jobs stay in memory, but big ones get spooled out to a
+temp file which is then memory-mapped, so a burst of huge jobs
+doesn't run the machine out of ram.
+"""
+import typing
+import os
+import mmap
+import tempfile
+
+
+class JobSpool:
+    """
+    Somewhere to put a print job while it is being received.
+
+    Small jobs stay in memory, but once a job goes over
+    spoolThreshold bytes it moves to its own (uniquely named)
+    temp file.
+
+    Usage:
+        with JobSpool() as spool:
+            for chunk in whatever:
+                spool.write(chunk)
+            doSomething(spool.getBuffer())
+    """
+
+    def __init__(self,
+        spoolThreshold:typing.Optional[int]=16*1024*1024,
+        spoolDir:typing.Optional[str]=None):
+        """
+        spoolThreshold is how big a job can get before it goes to disk
+            (None means always keep it in memory)
+
+        spoolDir is where to put spool files
+            (None means the system temp directory)
+        """
+        self.spoolThreshold:typing.Optional[int]=spoolThreshold
+        self.spoolDir:typing.Optional[str]=spoolDir
+        self.filename:typing.Optional[str]=None
+        self.size:int=0
+        self._memory:typing.Optional[bytearray]=bytearray()
+        self._file:typing.Optional[typing.BinaryIO]=None
+        self._mmap:typing.Optional[mmap.mmap]=None
+        self._view:typing.Optional[memoryview]=None
+
+    def __enter__(self)->'JobSpool':
+        return self
+
+    def __exit__(self,*args)->None:
+        self.close()
+
+    def __len__(self)->int:
+        return self.size
+
+    @property
+    def onDisk(self)->bool:
+        """
+        whether the job got big enough to be spooled to disk
+        """
+        return self.filename is not None
+
+    def write(self,data:typing.Union[bytes,bytearray,memoryview])->int:
+        """
+        Add more data to the end of the job
+
+        returns how many bytes were written
+        """
+        n=len(data)
+        if self._memory is not None:
+            if self.spoolThreshold is None \
+                or self.size+n<=self.spoolThreshold:
+                self._memory+=data
+                self.size+=n
+                return n
+            self._spoolToDisk()
+        if self._file is None:
+            raise ValueError('write to a closed JobSpool')
+        self._file.write(data)
+        self.size+=n
+        return n
+
+    def _spoolToDisk(self)->None:
+        """
+        Move what we have so far out of memory into a spool file
+        """
+        fd,self.filename=tempfile.mkstemp(
+            prefix='virtualPrinter_',suffix='.spool',dir=self.spoolDir)
+        self._file=os.fdopen(fd,'w+b',buffering=1024*1024)
+        if self._memory:
+            self._file.write(self._memory)
+        self._memory=None
+
+    def getBuffer(self)->memoryview:
+        """
+        Get the whole job as a read-only buffer
+
+        If it is on disk, this is a memory map of the spool file,
+        so it does not cost any extra ram.  It is only good until
+        close() is called.
+        """
+        if self._view is not None:
+            return self._view
+        if self._memory is not None:
+            self._view=memoryview(self._memory).toreadonly()
+        elif self._file is not None:
+            self._file.flush()
+            self._mmap=mmap.mmap(self._file.fileno(),0,
+                access=mmap.ACCESS_READ)
+            self._view=memoryview(self._mmap)
+        else:
+            raise ValueError('getBuffer() of a closed JobSpool')
+        return self._view
+
+    def close(self)->None:
+        """
+        Free the memory and/or delete the spool file
+        """
+        if self._view is not None:
+            self._view.release()
+            self._view=None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # somebody is still holding onto a view of it.
+                # The map goes away when they let go of it.
+                pass
+            self._mmap=None
+        if self._file is not None:
+            self._file.close()
+            self._file=None
+        if self.filename is not None:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                # (windows won't delete a file that is still mapped)
+                pass
+        self._memory=None
@@ -0,0 +1,557 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+An LPD (RFC 1179, "line printer daemon") flavor of PrintServer.
+
+Rather than one job per connection with the meta info scraped out of
+the PJL header, an LPD sender says what it is sending up front:
+    \\x02queue\\n               receive a job (then any number of...)
+        \\x02count cfA001host\\n + control file + \\x00
+        \\x03count dfA001host\\n + data file + \\x00
+and the control file has the job name, user, host, copies, and
+which data files to print, so nothing has to be dug out of the
+document itself.  A sender can keep sending jobs over the same
+connection, so batches don't pay for a new connection every time.
+
+It shares everything else (the select loop that accepts connections,
+metrics, limits, spooling) with PrintServer, so it can listen right
+alongside a raw one (see PrintServer.alsoServe).  Each connection is
+handled on a thread of its own, so LPD senders never hold up raw jobs.
+"""
+import typing
+import time
+import socket
+import logging
+import threading
+import concurrent.futures
+import selectors
+
+from virtualPrinter.printServer import PrintServer,PrintCallbackFunctionType
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.jobLimits import JobRejected
+from virtualPrinter.jobSpool import JobSpool
+from virtualPrinter.dscIndex import DscIndex
+from virtualPrinter.jobMetrics import JobTiming,jobContext
+
+logger=logging.getLogger(__name__)
+
+LPD_PORT=515
+ACK=b'\x00'
+NACK=b'\x01'
+# control file lines that mean "print this data file" (one per copy)
+PRINT_COMMANDS='cdfglnoprtv'
+
+
+class LpdControlFile:
+    """
+    The parsed control file of an LPD job
+
+    Lines are a one letter command followed by its operand, eg:
+        Hmyhost
+        Pkurt
+        JMy Document
+        ldfA001myhost
+        ldfA001myhost
+        NMy Document.pdf
+    """
+
+    def __init__(self,data:typing.Union[bytes,bytearray,memoryview]=b''):
+        self.host:typing.Optional[str]=None # H
+        self.user:typing.Optional[str]=None # P
+        self.jobName:typing.Optional[str]=None # J
+        self.bannerTitle:typing.Optional[str]=None # T (title for pr)
+        self.sourceFilename:typing.Optional[str]=None # N
+        self.jobClass:typing.Optional[str]=None # C
+        # [(format letter,data file name)] in the order given
+        self.prints:typing.List[typing.Tuple[str,str]]=[]
+        self._copies:typing.Optional[int]=None # K (an LPRng extension)
+        self.parse(data)
+
+    def parse(self,data:typing.Union[bytes,bytearray,memoryview])->None:
+        """
+        Parse (more of) a control file
+        """
+        text=bytes(data).decode('utf-8',errors='replace')
+        for line in text.splitlines():
+            if not line:
+                continue
+            command,operand=line[0],line[1:]
+            if command=='H':
+                self.host=operand
+            elif command=='P':
+                self.user=operand
+            elif command=='J':
+                self.jobName=operand
+            elif command=='T':
+                self.bannerTitle=operand
+            elif command=='N':
+                if self.sourceFilename is None:
+                    self.sourceFilename=operand
+            elif command=='C':
+                self.jobClass=operand
+            elif command=='K':
+                try:
+                    self._copies=max(1,int(operand))
+                except ValueError:
+                    pass
+            elif command in PRINT_COMMANDS:
+                self.prints.append((command,operand))
+            # (everything else is banners, mail, unlink, etc)
+
+    @property
+    def dataFiles(self)->typing.List[str]:
+        """
+        The names of the data files to print (each one once)
+        """
+        return list(dict.fromkeys(name for _,name in self.prints))
+
+    @property
+    def copies(self)->int:
+        """
+        How many copies were asked for
+
+        (normally, a data file is listed once per copy)
+        """
+        if self._copies is not None:
+            return self._copies
+        dataFiles=self.dataFiles
+        if not dataFiles:
+            return 1
+        return sum(1 for _,name in self.prints if name==dataFiles[0])
+
+    @property
+    def title(self)->typing.Optional[str]:
+        """
+        What the job is called
+        """
+        return self.jobName or self.bannerTitle or self.sourceFilename
+
+    @property
+    def author(self)->typing.Optional[str]:
+        """
+        Who sent it
+        """
+        return self.user
+
+    @property
+    def filename(self)->typing.Optional[str]:
+        """
+        What file it came from
+        """
+        return self.sourceFilename
+
+
+class _LpdJob:
+    """
+    One job being received over an LPD connection
+    (a control file, plus the data files it names, that can
+    come in any order)
+    """
+
+    def __init__(self,job:JobTiming):
+        self.job:JobTiming=job
+        self.control:typing.Optional[LpdControlFile]=None
+        self.dataFiles:typing.Dict[str,JobSpool]={}
+        self.dscIndexes:typing.Dict[str,DscIndex]={}
+
+    @property
+    def complete(self)->bool:
+        """
+        Whether the control file, and every data file it wants
+        printed, have arrived
+        """
+        return self.control is not None and all(
+            name in self.dataFiles for name in self.control.dataFiles)
+
+    def close(self)->None:
+        """
+        Get rid of all the data files
+        """
+        for spool in self.dataFiles.values():
+            spool.close()
+        self.dataFiles={}
+
+
+class _LpdConnection:
+    """
+    Reads the LPD protocol off of one (blocking) connection, held to
+    the server's limits
+    """
+
+    def __init__(self,conn:socket.socket,server:'LpdServer'):
+        self.conn:socket.socket=conn
+        self.server:'LpdServer'=server
+        self.pending=bytearray() # received but not used yet
+        self.lastData:float=time.perf_counter()
+        self._view=memoryview(bytearray(server.buffersize))
+
+    def _recv(self,job:typing.Optional[JobTiming]=None)->memoryview:
+        """
+        Receive whatever is there (waiting if need be)
+
+        If there is a job, the wait is held to its deadlines,
+        otherwise only to the idleTimeout.
+
+        returns an empty memoryview when the sender is done
+        """
+        limits=self.server.limits
+        timeLeft:typing.Optional[float]
+        if job is not None:
+            if not limits.hasRoom(job):
+                # (not reading makes TCP tell the sender to wait)
+                limits.waitForRoom(job)
+                self.lastData=time.perf_counter() # (not their fault)
+            timeLeft=limits.timeLeft(job,self.lastData)
+        elif limits.idleTimeout is not None:
+            timeLeft=self.lastData+limits.idleTimeout-time.perf_counter()
+        else:
+            timeLeft=None
+        try:
+            if timeLeft is not None and timeLeft<=0:
+                raise socket.timeout()
+            self.conn.settimeout(timeLeft)
+            n=self.conn.recv_into(self._view)
+        except socket.timeout:
+            if job is not None:
+                limits.timeOut(job,self.lastData)
+            raise PrinterException('LPD sender went quiet') from None
+        if n:
+            self.lastData=time.perf_counter()
+            with self.server._bytesReceivedLock:
+                self.server.bytesReceived+=n
+        return self._view[0:n]
+
+    def readLine(self)->typing.Optional[bytes]:
+        """
+        Read one command line (without the \\n)
+
+        returns None if the sender is done
+        """
+        while True:
+            i=self.pending.find(b'\n')
+            if i>=0:
+                line=bytes(self.pending[0:i])
+                del self.pending[0:i+1]
+                return line
+            if len(self.pending)>self.server.headerLimit:
+                raise PrinterException('LPD command line is too long')
+            chunk=self._recv()
+            if not chunk:
+                if self.pending:
+                    raise PrinterException('LPD sender hung up mid-command')
+                return None
+            self.pending+=chunk
+
+    def readFile(self,
+        count:int,
+        write:typing.Callable[[memoryview],typing.Any],
+        job:JobTiming
+        )->None:
+        """
+        Read count bytes of a file (and the \\x00 after it),
+        handing them to write() as they come in
+
+        (this holds the reading to job's limits and deadlines, but it
+        is up to write() to count the bytes against the job)
+        """
+        remaining=count+1
+        while remaining>0:
+            if self.pending:
+                chunk=memoryview(bytes(self.pending[0:remaining]))
+                del self.pending[0:len(chunk)]
+            else:
+                chunk=self._recv(job)
+                if not chunk:
+                    raise PrinterException('LPD sender hung up mid-file')
+                if len(chunk)>remaining: # (the next command came too)
+                    self.pending+=chunk[remaining:]
+                    chunk=chunk[0:remaining]
+            remaining-=len(chunk)
+            if remaining==0: # (last byte is the \x00, not file)
+                if chunk[-1]!=0:
+                    raise PrinterException('LPD file was not \\x00 ended')
+                chunk=chunk[0:-1]
+            if chunk:
+                write(chunk)
+
+    def send(self,data:bytes)->None:
+        """
+        Send a reply to the sender
+        """
+        self.conn.settimeout(self.server.limits.idleTimeout)
+        self.conn.sendall(data)
+
+
+class LpdServer(PrintServer):
+    """
+    Same idea (and same callback contract) as PrintServer,
+    but speaking LPD (see the top of lpdServer.py)
+
+    Each job is handed to printCallbackFn once for every data file in
+    it, with the title, author and filename from its control file.
+    (How many copies were asked for is on currentJob().copies)
+
+    Only the data files count as the job's bytes (for its metrics,
+    and for JobLimits.maxJobSize), so they mean the same as they do
+    for a raw job: how big the document that was sent is.  The
+    control file is held to headerLimit instead.
+
+    Every connection is handled by a thread of its own (not the
+    select loop, and not the shared workers), since it can carry any
+    number of jobs, and can sit there idle between them.  So an LPD
+    sender never holds up the raw jobs being served alongside it.
+    (That means printCallbackFn can be called from those threads
+    even when maxWorkers=1)
+    """
+
+    def __init__(self,
+        printerName:str='My Virtual Printer',
+        ip:str='127.0.0.1',port:typing.Union[None,int,str]=LPD_PORT,
+        printCallbackFn:typing.Optional[PrintCallbackFunctionType]=None,
+        maxWorkers:int=1,
+        queue:typing.Optional[str]=None,
+        maxConnections:int=16):
+        """
+        See PrintServer.__init__ for most parameters.
+
+        port is normally 515, which usually needs admin/root to use
+
+        queue is the printer name that senders must ask for
+            (None means to take jobs for any name)
+
+        maxConnections is how many LPD connections are handled at the
+            same time (more wait their turn)
+
+        (LPD printers are not installed in the OS, so there is no
+        autoInstallPrinter)
+        """
+        PrintServer.__init__(self,printerName,ip,port,False,
+            printCallbackFn,maxWorkers)
+        self.queue:typing.Optional[str]=queue
+        self.maxConnections:int=max(1,maxConnections)
+        self._connectionThreads:typing.Optional[
+            concurrent.futures.ThreadPoolExecutor]=None
+        self._connections:typing.Set[socket.socket]=set()
+        self._connectionsLock=threading.Lock()
+
+    def _accept(self,
+        sock:socket.socket,
+        executor:typing.Optional[concurrent.futures.Executor],
+        selector:typing.Optional[selectors.BaseSelector]=None
+        )->None:
+        """
+        Accept a connection that is waiting on sock, and hand it
+        to a connection thread (never the loop, or the shared workers)
+        """
+        _=executor,selector # (see the class docs)
+        try:
+            conn,addr=sock.accept()
+        except OSError as e: # (eg, it hung up before we got to it)
+            logger.warning('Accepting an LPD connection failed: %r',e)
+            return
+        if self._connectionThreads is None:
+            self._connectionThreads=concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.maxConnections,thread_name_prefix='lpd')
+        with self._connectionsLock:
+            self._connections.add(conn)
+        self._connectionThreads.submit(self._handleLpdConnection,conn,addr)
+
+    def _stopListening(self,sock:socket.socket)->None:
+        """
+        Undo _listen(), and hang up on everybody still connected
+        """
+        PrintServer._stopListening(self,sock)
+        with self._connectionsLock:
+            for conn in self._connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if self._connectionThreads is not None:
+            self._connectionThreads.shutdown(wait=True)
+            self._connectionThreads=None
+
+    def _handleLpdConnection(self,conn:socket.socket,addr:typing.Any)->None:
+        """
+        Handle an LPD connection (this is what runs on a connection
+        thread, so it must never let an exception escape)
+        """
+        try:
+            reader=_LpdConnection(conn,self)
+            line=reader.readLine()
+            if not line:
+                return
+            command=line[0]
+            operands=line[1:].decode('utf-8',errors='replace').split()
+            queue=operands[0] if operands else ''
+            if command==2:
+                if self.queue is not None and queue!=self.queue:
+                    logger.warning('%s asked for unknown queue "%s"',
+                        addr,queue)
+                    reader.send(NACK)
+                    return
+                reader.send(ACK)
+                self._receiveJobs(reader,addr)
+            elif command in (3,4):
+                reader.send(self._queueState(queue).encode('utf-8'))
+            # (1 is "print waiting jobs", and 5 is "remove jobs", but
+            # jobs print as soon as they arrive, so neither has
+            # anything to do)
+        except Exception as e: # pylint: disable=broad-except
+            logger.error('LPD connection from %s failed: %r',addr,e)
+        finally:
+            with self._connectionsLock:
+                self._connections.discard(conn)
+            conn.close()
+
+    def _queueState(self,queue:str)->str:
+        """
+        What to say when asked for the queue state
+        """
+        state=self.limits.snapshot()
+        return f'{queue or self.printerName}: '\
+            f'{state["runningJobs"]} printing, '\
+            f'{state["queuedJobs"]} waiting\n'
+
+    def _receiveJobs(self,reader:_LpdConnection,addr:typing.Any)->None:
+        """
+        Receive jobs (as many as the sender likes) over a connection,
+        printing each one as soon as all of it is in
+        """
+        jobs:typing.Dict[str,_LpdJob]={} # {job number+host:job}
+        try:
+            while True:
+                line=reader.readLine()
+                if line is None: # sender is done
+                    break
+                subcommand=line[0] if line else 0
+                if subcommand==1: # abort
+                    for aborted in jobs.values():
+                        self._abandonJob(aborted,'aborted by sender')
+                    jobs={}
+                    reader.send(ACK)
+                    continue
+                if subcommand not in (2,3):
+                    reader.send(NACK)
+                    break
+                try:
+                    countText,name=line[1:].decode('utf-8').split(' ',1)
+                    count=int(countText)
+                except ValueError:
+                    reader.send(NACK)
+                    break
+                if subcommand==2 and count>self.headerLimit:
+                    reader.send(NACK)
+                    break
+                # cfA001host and dfA001host are both for job "001host"
+                key=name[3:]
+                lpdJob=jobs.get(key)
+                if lpdJob is None:
+                    lpdJob=self._startJob(addr)
+                    jobs[key]=lpdJob
+                with jobContext(lpdJob.job):
+                    reader.send(ACK)
+                    self._receiveFile(reader,lpdJob,subcommand,name,count)
+                    reader.send(ACK)
+                    if lpdJob.complete:
+                        del jobs[key]
+                        self._printJob(lpdJob)
+        except JobRejected as e: # (already logged)
+            for lpdJob in jobs.values():
+                self._abandonJob(lpdJob,repr(e))
+            jobs={}
+        finally:
+            for lpdJob in jobs.values():
+                self._abandonJob(lpdJob,'connection closed mid-job')
+
+    def _startJob(self,addr:typing.Any)->_LpdJob:
+        """
+        Start receiving a new job
+
+        (it only waits for its turn once it has all arrived, see
+        _printJob(), so a slow sender never holds on to a turn)
+        """
+        job=JobTiming(addr)
+        self.metrics.jobAccepted(job)
+        self.limits.admit(job)
+        with jobContext(job):
+            logger.info('Incoming LPD job from %s... spooling...',addr)
+        return _LpdJob(job)
+
+    def _receiveFile(self,
+        reader:_LpdConnection,
+        lpdJob:_LpdJob,
+        subcommand:int,
+        name:str,
+        count:int
+        )->None:
+        """
+        Receive a control file (subcommand 2) or data file (3)
+        """
+        job=lpdJob.job
+        if subcommand==2:
+            control=bytearray()
+            reader.readFile(count,control.extend,job)
+            lpdJob.control=LpdControlFile(control)
+            job.title=lpdJob.control.title
+            job.copies=lpdJob.control.copies
+            job.mark('headerParsed')
+            return
+        spool=JobSpool(self.spoolThreshold,self.spoolDir)
+        dscIndex=DscIndex() # so nobody has to go looking for pages later
+        lpdJob.dataFiles[name]=spool
+
+        def write(chunk:memoryview)->None:
+            job.addBytes(len(chunk))
+            self.limits.addBytes(job,len(chunk))
+            dscIndex.feed(chunk)
+            spool.write(chunk)
+        reader.readFile(count,write,job)
+        dscIndex.close()
+        lpdJob.dscIndexes[name]=dscIndex
+
+    def _printJob(self,lpdJob:_LpdJob)->None:
+        """
+        Hand a job that has all arrived off to printCallbackFn
+        """
+        job=lpdJob.job
+        control=lpdJob.control
+        assert control is not None
+        job.mark('lastByte')
+        self.limits.received(job)
+        try:
+            logger.info('Received %d bytes',job.bytesReceived)
+            self.limits.start(job) # (waits for its turn)
+            job.mark('started')
+            for name in control.dataFiles:
+                spool=lpdJob.dataFiles[name]
+                if self.printCallbackFn is None:
+                    with self._openJobFile() as f:
+                        f.write(spool.getBuffer())
+                    logger.info('Saved job to "%s"',f.name)
+                    continue
+                job.dscIndex=lpdJob.dscIndexes.get(name)
+                self.printCallbackFn(spool.getBuffer(),
+                    control.title,control.author,control.filename)
+            job.mark('callbackDone')
+        except Exception as e: # pylint: disable=broad-except
+            job.error=repr(e)
+            logger.exception('Print job failed')
+        finally:
+            lpdJob.close()
+            self.limits.finish(job)
+            self.metrics.jobDone(job)
+
+    def _abandonJob(self,lpdJob:_LpdJob,reason:str)->None:
+        """
+        Give up on a job that never all arrived
+        """
+        job=lpdJob.job
+        with jobContext(job):
+            if job.error is None:
+                job.error=reason
+            if job.rejected is None and job.timedOut is None:
+                logger.warning('Dropping LPD job: %s',reason)
+        lpdJob.close()
+        self.limits.finish(job)
+        self.metrics.jobDone(job)
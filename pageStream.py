@@ -0,0 +1,348 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Get rendered pages one at a time, as ghostscript finishes them.
+
+When ghostscript renders to a raster format on stdout, all the pages
+simply come out one after another (eg, a png, then another png...).
+This splits them back up as they arrive, so the first page can be
+used while the rest are still rendering, and only one page has to
+be in memory at a time.
+
+The "raw" format is uncompressed pixels (ghostscript's pgmraw and
+ppmraw devices), which can be handed over as numpy arrays (or, without
+numpy, memoryviews) that point straight into ghostscript's output,
+rather than being compressed into a png only to be decompressed again.
+"""
+import typing
+import io
+import logging
+import threading
+import subprocess
+
+from virtualPrinter.printerException import PrinterException
+
+logger=logging.getLogger(__name__)
+
+PNG_SIGNATURE=b'\x89PNG\r\n\x1a\n'
+PNM_CHANNELS={b'P5':1,b'P6':3} # (the ones with 8-bit samples)
+PNM_MAX_HEADER=1024
+# {fileFormat:file extension}, where they are not the same
+EXTENSIONS={'raw':'pnm'}
+
+# (width,height,channels,where the pixels start)
+PnmHeader=typing.Tuple[int,int,int,int]
+
+
+class RenderedPage:
+    """
+    One rendered page
+    """
+
+    def __init__(self,pageNumber:int,data:bytearray,fileFormat:str):
+        """
+        pageNumber starts at 1
+
+        data is the page in fileFormat (eg, "png")
+        """
+        self.pageNumber:int=pageNumber
+        self.data:bytearray=data
+        self.fileFormat:str=fileFormat
+
+    def __len__(self)->int:
+        return len(self.data)
+
+    def __repr__(self)->str:
+        return f'RenderedPage({self.pageNumber},{self.fileFormat},'\
+            f'{len(self.data)} bytes)'
+
+    @property
+    def extension(self)->str:
+        """
+        File extension to save the page with
+        """
+        return EXTENSIONS.get(self.fileFormat,self.fileFormat)
+
+    @property
+    def shape(self)->typing.Tuple[int,int,int]:
+        """
+        (height,width,channels) of a raw page
+        """
+        width,height,channels,_=self._pnmHeader()
+        return height,width,channels
+
+    @property
+    def pixels(self)->typing.Any:
+        """
+        The pixels of a raw page, without copying them
+        (see pixelArray())
+        """
+        width,height,channels,offset=self._pnmHeader()
+        return pixelArray(self.data,offset,width,height,channels)
+
+    def _pnmHeader(self)->PnmHeader:
+        """
+        Get the header of a raw page
+        """
+        if self.fileFormat!='raw':
+            raise PrinterException(
+                f'Only raw pages have pixels, not "{self.fileFormat}"')
+        return parsePnmHeader(self.data)
+
+    def toPil(self)->typing.Any:
+        """
+        Get the page as a PIL image
+
+        (requires pillow)
+        """
+        from PIL import Image # type: ignore
+        return Image.open(io.BytesIO(self.data))
+
+
+def splitPngs(f:typing.IO[bytes])->typing.Iterator[bytearray]:
+    """
+    Split a stream of png files that are one after another
+    back up into separate files, as they arrive
+    """
+    while True:
+        signature=f.read(len(PNG_SIGNATURE))
+        if not signature:
+            return
+        if signature!=PNG_SIGNATURE:
+            raise PrinterException('Rendered page is not a png')
+        page=bytearray(signature)
+        while True:
+            # each chunk is length, type, data, crc
+            chunkHeader=f.read(8)
+            if len(chunkHeader)<8:
+                raise PrinterException('Rendered png was cut short')
+            length=int.from_bytes(chunkHeader[0:4],'big')
+            page+=chunkHeader
+            rest=f.read(length+4)
+            if len(rest)<length+4:
+                raise PrinterException('Rendered png was cut short')
+            page+=rest
+            if chunkHeader[4:8]==b'IEND':
+                break
+        yield page
+
+
+def parsePnmHeader(
+    data:typing.Union[bytes,bytearray,memoryview],
+    offset:int=0
+    )->PnmHeader:
+    """
+    Parse the header of a binary pgm or ppm image, eg:
+        P6
+        # Image generated by Ghostscript
+        1700 2200
+        255
+
+    offset is where the image starts in data
+
+    returns (width,height,channels,where the pixels start)
+
+    raises PrinterException if it isn't one (or isn't 8-bit)
+    """
+    channels=PNM_CHANNELS.get(bytes(data[offset:offset+2]))
+    if channels is None:
+        raise PrinterException('Rendered page is not a binary pgm or ppm')
+    header=bytes(data[offset:offset+PNM_MAX_HEADER])
+    values:typing.List[int]=[]
+    i=2
+    while len(values)<3:
+        if i>=len(header):
+            raise PrinterException('Rendered pgm or ppm header is bad')
+        c=header[i]
+        if c==ord('#'): # a comment, to the end of the line
+            while i<len(header) and header[i] not in b'\r\n':
+                i+=1
+        elif header[i:i+1].isspace():
+            i+=1
+        else:
+            start=i
+            while i<len(header) and header[i:i+1].isdigit():
+                i+=1
+            # (a number right at the end may not all be there yet)
+            if i==start or i>=len(header):
+                raise PrinterException('Rendered pgm or ppm header is bad')
+            values.append(int(header[start:i]))
+    width,height,maxValue=values
+    if maxValue>255:
+        raise PrinterException('Only 8-bit pgm and ppm are supported')
+    # (the pixels start after one more whitespace)
+    return width,height,channels,offset+i+1
+
+
+def pnmHeader(width:int,height:int,channels:int)->bytes:
+    """
+    Make the header to go in front of raw pixels to save them
+    as a pgm (channels=1) or ppm (channels=3) image
+    """
+    magic={1:'P5',3:'P6'}.get(channels)
+    if magic is None:
+        raise PrinterException(f'Cannot save {channels} channel pixels')
+    return f'{magic}\n{width} {height}\n255\n'.encode('ascii')
+
+
+def splitPnms(f:typing.IO[bytes])->typing.Iterator[bytearray]:
+    """
+    Split a stream of binary pgm or ppm images that are one after
+    another back up into separate images, as they arrive
+    """
+    while True:
+        page=bytearray(f.read(2))
+        if not page:
+            return
+        # read until the header is all there (it is only a few bytes)
+        while True:
+            try:
+                width,height,channels,offset=parsePnmHeader(page)
+            except PrinterException:
+                if len(page)>=PNM_MAX_HEADER:
+                    raise
+                c=f.read(1)
+                if not c:
+                    raise
+                page+=c
+                continue
+            if offset<=len(page):
+                break
+            page+=f.read(offset-len(page))
+        size=offset+width*height*channels
+        page+=f.read(size-len(page))
+        if len(page)<size:
+            raise PrinterException('Rendered page was cut short')
+        yield page
+
+
+def rawPages(data:typing.Union[bytes,bytearray,memoryview]
+    )->typing.List[typing.Any]:
+    """
+    Get the pixels of every page in a raw document (a bunch of
+    binary pgm or ppm images one after another) without copying
+    them (see pixelArray())
+    """
+    pages=[]
+    offset=0
+    while offset<len(data):
+        width,height,channels,pixelOffset=parsePnmHeader(data,offset)
+        pages.append(pixelArray(data,pixelOffset,width,height,channels))
+        offset=pixelOffset+width*height*channels
+    return pages
+
+
+def pixelArray(
+    data:typing.Union[bytes,bytearray,memoryview],
+    offset:int,
+    width:int,
+    height:int,
+    channels:int
+    )->typing.Any:
+    """
+    Make an array of pixels that points straight into data
+    (no copying)
+
+    If numpy is installed, it is a numpy array of uint8, otherwise
+    it is a memoryview.  Either way, it is indexed [y,x] for grey,
+    or [y,x,channel] for color.
+
+    (the array is only good as long as data is)
+    """
+    shape=(height,width) if channels==1 else (height,width,channels)
+    size=width*height*channels
+    if len(data)<offset+size:
+        raise PrinterException('Rendered page was cut short')
+    try:
+        import numpy # type: ignore
+    except ImportError:
+        return memoryview(data)[offset:offset+size].cast('B',shape)
+    return numpy.frombuffer(data,numpy.uint8,size,offset).reshape(shape)
+
+
+# {fileFormat:function to split a stream of pages up}
+PAGE_SPLITTERS:typing.Dict[str,
+    typing.Callable[[typing.IO[bytes]],typing.Iterator[bytearray]]]={
+    'png':splitPngs,
+    'raw':splitPnms}
+
+
+def renderPages(
+    cmd:typing.List[str],
+    data:typing.Any,
+    fileFormat:str,
+    stdinFile:bool=False
+    )->typing.Iterator[RenderedPage]:
+    """
+    Run ghostscript, and yield each page as soon as it is done
+
+    cmd is a ghostscript command line that reads postscript on stdin
+        and writes pages in fileFormat to stdout
+
+    data is the postscript (a bytes-like object, or, if stdinFile,
+        an open file to be read directly by ghostscript)
+
+    If the generator is closed early, ghostscript is killed.
+
+    raises PrinterException if ghostscript fails
+    """
+    splitter=PAGE_SPLITTERS.get(fileFormat)
+    if splitter is None:
+        raise PrinterException(
+            f'Cannot render "{fileFormat}" one page at a time')
+    logger.debug('%s',' '.join(cmd))
+    with subprocess.Popen(cmd,
+        stdin=data if stdinFile else subprocess.PIPE,
+        stdout=subprocess.PIPE,stderr=subprocess.PIPE) as po:
+        assert po.stdout is not None and po.stderr is not None
+        messages=bytearray()
+        threads=[threading.Thread(target=_drain,
+            args=(po.stderr,messages),daemon=True)]
+        if not stdinFile:
+            # (feed it from another thread, so that it can't get stuck
+            # waiting for us to read pages while we wait for it to read)
+            threads.append(threading.Thread(target=_feed,
+                args=(po.stdin,data),daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            for pageNumber,page in enumerate(splitter(po.stdout),1):
+                yield RenderedPage(pageNumber,page,fileFormat)
+            po.wait()
+        finally:
+            if po.poll() is None: # given up on before the end
+                po.kill()
+                po.wait()
+            for thread in threads:
+                thread.join()
+        # note: stdout also goes to stderr because of -sstdout=%stderr
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('ghostscript said:\n%s',
+                messages.decode('utf-8',errors='replace'))
+        if po.returncode!=0:
+            said=messages.decode('utf-8',errors='replace').strip()
+            raise PrinterException(
+                f'ghostscript failed with exit code {po.returncode}: {said}')
+
+
+def _feed(f:typing.Any,data:typing.Any)->None:
+    """
+    Write all the data to ghostscript's stdin, then close it
+    """
+    try:
+        f.write(data)
+    except (BrokenPipeError,ValueError): # ghostscript quit (or was killed)
+        pass
+    finally:
+        try:
+            f.close()
+        except BrokenPipeError:
+            pass
+
+
+def _drain(f:typing.IO[bytes],messages:bytearray)->None:
+    """
+    Collect everything ghostscript says on stderr
+    """
+    for line in f:
+        messages+=line
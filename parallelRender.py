@@ -0,0 +1,163 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Render a long document on several cpu cores at once by splitting it
+into page ranges and giving each range its own ghostscript.
+"""
+import typing
+import os
+import re
+import mmap
+import shutil
+import tempfile
+import subprocess
+import concurrent.futures
+
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.pjlHeader import postscriptBody,DEFAULT_HEADER_LIMIT
+from virtualPrinter.dscIndex import DscIndex
+
+
+DSC_SCAN_SIZE=65536 # how far from each end to look for %%Pages:
+_PAGES_RE=re.compile(rb'^%%Pages:[ \t]*(\S+)',re.MULTILINE)
+
+
+def countPages(data:typing.Any)->typing.Optional[int]:
+    """
+    Get the page count from a postscript document's DSC comments
+    (%%Pages: near the start or, if it says (atend), near the end)
+
+    data is a bytes-like object or a real file
+
+    returns None if it is not known
+    """
+    if hasattr(data,'fileno'):
+        try:
+            with mmap.mmap(data.fileno(),0,access=mmap.ACCESS_READ) as m:
+                return countPages(m)
+        except (OSError,ValueError): # not something we can map
+            return None
+    view=memoryview(data)
+    for chunk in (view[0:DSC_SCAN_SIZE],view[-DSC_SCAN_SIZE:]):
+        matches=_PAGES_RE.findall(bytes(chunk))
+        for value in reversed(matches): # (atend) value comes last
+            if value.isdigit():
+                return int(value)
+    return None
+
+
+def splitPages(pageCount:int,parts:int)->typing.List[typing.Tuple[int,int]]:
+    """
+    Split pages 1..pageCount into (up to) parts contiguous
+    (firstPage,lastPage) ranges, as evenly as possible
+    """
+    parts=max(1,min(parts,pageCount))
+    ranges=[]
+    firstPage=1
+    for i in range(parts):
+        n=pageCount//parts+(1 if i<pageCount%parts else 0)
+        ranges.append((firstPage,firstPage+n-1))
+        firstPage+=n
+    return ranges
+
+
+def renderParallel(
+    data:typing.Any,
+    cmd:typing.List[str],
+    pageCount:int,
+    workers:typing.Optional[int]=None,
+    dscIndex:typing.Optional[DscIndex]=None
+    )->bytes:
+    """
+    Render a document by page ranges, on several ghostscripts at once
+
+    data is a bytes-like object or a real file
+
+    cmd is a ghostscript command line that reads postscript from
+        stdin and writes to stdout (see Printer._gsCommand)
+
+    workers is how many ghostscripts at once (None means one per cpu)
+
+    dscIndex, if it was built from data and can find the pages,
+        lets each ghostscript be given only its own pages, rather
+        than every one of them having to wade through the whole
+        document to get to them
+
+    returns the output of all the ranges, in page order
+    """
+    if workers is None:
+        workers=os.cpu_count() or 1
+    ranges=splitPages(pageCount,workers)
+    if dscIndex is not None and dscIndex.canExtractPages \
+        and len(dscIndex.pages)==pageCount and not hasattr(data,'read'):
+        view=memoryview(data)
+        if dscIndex.size==len(view):
+            index=dscIndex
+            with concurrent.futures.ThreadPoolExecutor(len(ranges)) \
+                as executor:
+                results=executor.map(lambda r: _renderPages(
+                    index.extractPages(view,r[0],r[1]),cmd,r[0],r[1]),
+                    ranges)
+                return b''.join(results)
+    # every ghostscript needs to read the whole document,
+    # so it goes into a file they can all open
+    fd,filename=tempfile.mkstemp(prefix='virtualPrinter_',suffix='.ps')
+    try:
+        with os.fdopen(fd,'wb') as f:
+            if hasattr(data,'read'):
+                # (any PJL header is in the first bit, so skip it
+                # there and copy the rest as-is)
+                f.write(postscriptBody(data.read(DEFAULT_HEADER_LIMIT)))
+                shutil.copyfileobj(data,f,1024*1024)
+            else:
+                f.write(postscriptBody(data))
+        with concurrent.futures.ThreadPoolExecutor(len(ranges)) as executor:
+            results=executor.map(
+                lambda r: _renderRange(filename,cmd,r[0],r[1]),ranges)
+            return b''.join(results)
+    finally:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def _renderRange(filename:str,cmd:typing.List[str],
+    firstPage:int,lastPage:int)->bytes:
+    """
+    Render one range of pages with its own ghostscript
+    """
+    cmd=cmd[0:-1]+[f'-dFirstPage={firstPage}',f'-dLastPage={lastPage}',
+        cmd[-1]]
+    with open(filename,'rb') as f:
+        with subprocess.Popen(cmd,
+            stdin=f,stderr=subprocess.PIPE,
+            stdout=subprocess.PIPE) as po:
+            data,gsStdoutStderr=po.communicate()
+    _checkResult(po.returncode,gsStdoutStderr,firstPage,lastPage)
+    return data
+
+
+def _renderPages(postscript:bytes,cmd:typing.List[str],
+    firstPage:int,lastPage:int)->bytes:
+    """
+    Render a document that has already been cut down to just
+    some of the pages (see DscIndex.extractPages)
+    """
+    with subprocess.Popen(cmd,
+        stdin=subprocess.PIPE,stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE) as po:
+        data,gsStdoutStderr=po.communicate(postscript)
+    _checkResult(po.returncode,gsStdoutStderr,firstPage,lastPage)
+    return data
+
+
+def _checkResult(returncode:int,gsStdoutStderr:bytes,
+    firstPage:int,lastPage:int)->None:
+    """
+    Raise an exception if ghostscript failed on some pages
+    """
+    if returncode!=0:
+        msg=f'ghostscript failed on pages {firstPage}-{lastPage}:\n'
+        msg+=gsStdoutStderr.decode('utf-8',errors='replace')
+        raise PrinterException(msg)
@@ -0,0 +1,193 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Incrementally parse the PJL (Printer Job Language) header
+that windows print drivers stick in front of the PostScript.
+
+It looks something like:
+    <ESC>%-12345X@PJL JOB NAME="My Document"
+    @PJL COMMENT "Username: kurt; App Filename: My Document; ..."
+    @PJL SET RESOLUTION=600
+    @PJL ENTER LANGUAGE=POSTSCRIPT
+    %!PS-Adobe-3.0
+    ...
+"""
+import typing
+import os
+
+
+POSTSCRIPT_START=b'%!PS-'
+DEFAULT_HEADER_LIMIT=65536
+
+
+class PjlHeader:
+    """
+    Incrementally parse the PJL header of a print job.
+
+    Simply feed() it the raw bytes as they come in.  It only ever looks
+    at the header (stopping at the %!PS- boundary or after headerLimit
+    bytes, whichever comes first) so it costs the same no matter how
+    big the document is.
+    """
+
+    def __init__(self,headerLimit:int=DEFAULT_HEADER_LIMIT):
+        """
+        headerLimit is the most bytes to scan looking for the
+        start of the PostScript before giving up
+        """
+        self.headerLimit:int=headerLimit
+        self.done:bool=False
+        self.postscriptOffset:typing.Optional[int]=None
+        self.jobName:typing.Optional[str]=None
+        self.comments:typing.Dict[str,str]={}
+        self.options:typing.Dict[str,str]={} # from @PJL SET
+        self.language:typing.Optional[str]=None # from @PJL ENTER LANGUAGE
+        self.lines:typing.List[str]=[]
+        self._scanned:int=0 # bytes of the job already looked at
+        self._pending=bytearray() # bytes of an incomplete line
+
+    def feed(self,data:typing.Union[bytes,bytearray,memoryview])->bool:
+        """
+        Feed in the next chunk of the print job
+
+        returns done (meaning it needs no more data)
+        """
+        if self.done:
+            return True
+        # never hold on to more than headerLimit (+ enough to spot
+        # a %!PS- that starts right at the limit)
+        remaining=self.headerLimit+len(POSTSCRIPT_START)-self._scanned
+        data=memoryview(data)[0:max(0,remaining)]
+        pendingStart=self._scanned-len(self._pending)
+        self._pending+=data
+        self._scanned+=len(data)
+        i=self._pending.find(POSTSCRIPT_START)
+        if i>=0:
+            self._parseLines(self._pending[0:i])
+            self.postscriptOffset=pendingStart+i
+            self._finish()
+        else:
+            i=self._pending.rfind(b'\n')
+            if i>=0:
+                self._parseLines(self._pending[0:i])
+                del self._pending[0:i+1]
+            if self._scanned>=self.headerLimit+len(POSTSCRIPT_START):
+                # there's a limit to how hard we'll look!
+                self._parseLines(self._pending)
+                self._finish()
+        return self.done
+
+    def close(self)->None:
+        """
+        Call this when the job is over, to parse any leftovers
+        """
+        if not self.done:
+            self._parseLines(self._pending)
+            self._finish()
+
+    def _finish(self)->None:
+        """
+        Stop parsing and let go of the buffer
+        """
+        self.done=True
+        self._pending=bytearray()
+
+    def _parseLines(self,data:typing.Union[bytes,bytearray])->None:
+        """
+        Parse complete lines of the header
+        """
+        text=bytes(data).decode('utf-8',errors='ignore')
+        for line in text.split('\n'):
+            line=line.strip()
+            i=line.find('@PJL')
+            if i<0:
+                continue
+            line=line[i:] # skip any <ESC>%-12345X in front
+            self.lines.append(line)
+            command=line[4:].strip()
+            upperCommand=command.upper()
+            if upperCommand.startswith('JOB'):
+                i=upperCommand.find('NAME=')
+                if i>=0:
+                    self.jobName=_unquote(command[i+5:])
+            elif upperCommand.startswith('COMMENT'):
+                params=_unquote(command[7:]).split(';')
+                for param in params:
+                    kv=param.split(':',1)
+                    if len(kv)>1:
+                        self.comments[kv[0].strip().lower()]=kv[1].strip()
+            elif upperCommand.startswith('SET'):
+                kv=command[3:].split('=',1)
+                if len(kv)>1:
+                    self.options[kv[0].strip().upper()]=_unquote(kv[1])
+            elif upperCommand.startswith('ENTER'):
+                kv=command.split('=',1)
+                if len(kv)>1:
+                    self.language=kv[1].strip().upper()
+
+    @property
+    def author(self)->typing.Optional[str]:
+        """
+        who printed it
+        """
+        return self.comments.get('username')
+
+    @property
+    def filename(self)->typing.Optional[str]:
+        """
+        the file that was printed (if it exists on this machine)
+        """
+        return self._titleAndFilename()[1]
+
+    @property
+    def title(self)->typing.Optional[str]:
+        """
+        the title of what was printed
+        """
+        return self._titleAndFilename()[0]
+
+    def _titleAndFilename(self
+        )->typing.Tuple[typing.Optional[str],typing.Optional[str]]:
+        """
+        Work out the title and filename of the job
+        from the JOB NAME and "App Filename" comment
+        """
+        title=None
+        filename=None
+        if self.jobName is not None:
+            if os.path.isfile(self.jobName):
+                filename=self.jobName
+            else:
+                title=self.jobName
+        appFilename=self.comments.get('app filename')
+        if appFilename is not None and title is None:
+            if os.path.isfile(appFilename):
+                filename=appFilename
+            else:
+                title=appFilename
+        if title is None and filename is not None:
+            title=filename.rsplit(os.sep,1)[-1].split('.',1)[0]
+        return title,filename
+
+
+def postscriptBody(data:typing.Union[bytes,bytearray,memoryview]
+    )->memoryview:
+    """
+    Get a (zero-copy) view of just the postscript part of a print job,
+    skipping over any PJL header
+    """
+    view=memoryview(data)
+    header=PjlHeader()
+    header.feed(view[0:header.headerLimit])
+    return view[header.postscriptOffset or 0:]
+
+
+def _unquote(s:str)->str:
+    """
+    Take the value out of a PJL quoted string
+    (if it is quoted)
+    """
+    s=s.strip()
+    if s.startswith('"'):
+        s=s[1:].rsplit('"',1)[0]
+    return s
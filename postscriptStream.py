@@ -0,0 +1,145 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Stream a print job into ghostscript while it is still arriving,
+rather than waiting for the whole thing first.
+"""
+import typing
+import threading
+import subprocess
+
+from virtualPrinter.printerException import PrinterException
+
+
+class PrintStream(typing.Protocol):
+    """
+    What PrintServer wants back from a printStreamFn
+
+    It writes the postscript into it as the job comes in,
+    then calls close() when the job is done (or abort() if
+    something went wrong)
+    """
+
+    def write(self,data:typing.Union[bytes,bytearray,memoryview])->typing.Any:
+        """
+        Add more of the job
+        """
+
+    def close(self)->None:
+        """
+        The job is complete
+        """
+
+    def abort(self)->None:
+        """
+        The job is not going to be completed
+        """
+
+
+PrintStreamFunctionType=typing.Callable[[
+    typing.Optional[str], # title
+    typing.Optional[str], # author
+    typing.Optional[str] # filename
+    ],PrintStream
+]
+
+
+class GhostscriptStream:
+    """
+    A running ghostscript process that is converting
+    postscript as fast as it is being written to it.
+
+    Its output is drained on a background thread the whole time,
+    so receiving and rendering overlap.  When close() is called,
+    onFinished is called with the complete output.
+    """
+
+    def __init__(self,
+        cmd:typing.List[str],
+        onFinished:typing.Callable[[bytearray],None]):
+        """
+        cmd is a ghostscript command line that reads from stdin
+            and writes to stdout
+
+        onFinished gets called with the converted data when done
+        """
+        self.onFinished:typing.Callable[[bytearray],None]=onFinished
+        self.output=bytearray()
+        self.messages=bytearray()
+        # pylint: disable=consider-using-with
+        self._process=subprocess.Popen(cmd,
+            stdin=subprocess.PIPE,stderr=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+        self._threads=[
+            threading.Thread(target=self._drain,
+                args=(self._process.stdout,self.output),daemon=True),
+            threading.Thread(target=self._drain,
+                args=(self._process.stderr,self.messages),daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    @staticmethod
+    def _drain(pipe:typing.Any,into:bytearray)->None:
+        """
+        Keep a pipe drained (runs in its own thread)
+        """
+        while True:
+            data=pipe.read1(1024*1024)
+            if not data:
+                break
+            into+=data
+
+    def write(self,data:typing.Union[bytes,bytearray,memoryview])->int:
+        """
+        Feed more postscript to ghostscript
+
+        (this blocks if ghostscript is falling behind, which
+        in turn slows down the sender)
+        """
+        assert self._process.stdin is not None
+        try:
+            self._process.stdin.write(data)
+        except OSError as e:
+            self.abort()
+            msg='ghostscript quit early:\n'
+            msg+=self.messages.decode('utf-8',errors='replace')
+            raise PrinterException(msg) from e
+        return len(data)
+
+    def _finish(self)->int:
+        """
+        Wait for ghostscript to finish up
+
+        returns its exit code
+        """
+        assert self._process.stdin is not None
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        returncode=self._process.wait()
+        for thread in self._threads:
+            thread.join()
+        return returncode
+
+    def close(self)->None:
+        """
+        The job is all here, so let ghostscript finish up,
+        and then call onFinished()
+
+        raises PrinterException if ghostscript failed
+        """
+        returncode=self._finish()
+        if returncode!=0:
+            said=self.messages.decode('utf-8',errors='replace').strip()
+            raise PrinterException(
+                f'ghostscript failed with exit code {returncode}: {said}')
+        self.onFinished(self.output)
+
+    def abort(self)->None:
+        """
+        Give up on the job
+        """
+        if self._process.poll() is None:
+            self._process.kill()
+        self._finish()
@@ -0,0 +1,211 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Serve one printer from several processes at once.
+
+Receiving jobs (parsing PJL headers, shuffling buffers around) is
+python code, so one PrintServer process can only keep one core busy
+no matter how many threads it has.  Instead, a PreforkServer starts
+a number of worker processes, each running its own PrintServer on
+the same ip:port with SO_REUSEPORT, and the OS shares incoming
+connections out between them.  Workers that die get started again.
+
+This needs SO_REUSEPORT and fork(), so it is for Linux
+(other systems can use Printer.run() or a PrintHost).
+"""
+import typing
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import multiprocessing
+import multiprocessing.process
+
+from virtualPrinter.printer import Printer
+from virtualPrinter.printServer import PrintServer
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.printerLogging import defaultLogging,stopLogging
+
+logger=logging.getLogger(__name__)
+
+
+class PreforkServer:
+    """
+    Serve one printer from several processes at once
+    (see the top of preforkServer.py)
+
+    Usage:
+        PreforkServer(MyPrinter('PDF'),port=9001,processes=8).run()
+    """
+
+    def __init__(self,
+        printer:Printer,
+        host:str='127.0.0.1',
+        port:typing.Union[None,int,str]=None,
+        autoInstallPrinter:bool=True,
+        processes:typing.Optional[int]=None,
+        maxWorkers:int=1,
+        restartDelay:float=1.0,
+        drainTimeout:float=20.0):
+        """
+        printer is what handles the jobs (every worker process gets
+            its own copy of it)
+
+        host, port and autoInstallPrinter are the same as for
+            Printer.run(), except that the printer is only installed
+            once, by us, not by every worker
+
+        processes is how many worker processes (None = one per cpu)
+
+        maxWorkers is how many jobs each process handles at once
+            (see PrintServer)
+
+        restartDelay is how long to wait before starting a worker
+            again after it dies (so one that dies straight away
+            doesn't eat the whole machine)
+
+        drainTimeout is how long a stopping worker keeps receiving
+            jobs that are already coming in (it should be well under
+            the 30s workers get to stop before they are killed)
+
+        If printer.metricsPort is set, worker number i serves its
+        metrics on metricsPort+i.
+        """
+        if not hasattr(socket,'SO_REUSEPORT'):
+            raise PrinterException(
+                f'SO_REUSEPORT is not supported on {sys.platform}')
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise PrinterException(
+                f'fork() is not supported on {sys.platform}')
+        self.printer:Printer=printer
+        self.host:str=host
+        if port is None:
+            port=0 # meaning, "any unused port"
+        self.port:int=int(port)
+        self.autoInstallPrinter:bool=autoInstallPrinter
+        self.processes:int=max(1,processes or os.cpu_count() or 1)
+        self.maxWorkers:int=max(1,maxWorkers)
+        self.restartDelay:float=restartDelay
+        self.drainTimeout:float=drainTimeout
+        self.running:bool=False
+        self.keepGoing:bool=False
+        self.restarts:int=0 # how many times workers have been restarted
+        # the (ip,port) actually being listened on (eg, when port=0)
+        self.address:typing.Optional[typing.Tuple[str,int]]=None
+        self.workers:typing.List[
+            typing.Optional[multiprocessing.process.BaseProcess]]=[]
+        self._context=multiprocessing.get_context('fork')
+
+    def run(self)->None:
+        """
+        supervisor mainloop (runs until keepGoing=False)
+        """
+        if self.running:
+            return
+        defaultLogging()
+        self.running=True
+        self.keepGoing=True
+        # hold on to the port (port=0 picks one for everybody),
+        # but never listen on it, so the OS never hands us connections
+        reserved=self._reservePort()
+        installer:typing.Optional[PrintServer]=None
+        try:
+            ip,port=reserved.getsockname()
+            self.address=(ip,port)
+            logger.info('Serving %s:%s from %d processes',
+                ip,port,self.processes)
+            if self.autoInstallPrinter:
+                installer=PrintServer(self.printer.name,ip,port,False)
+                installer.keepPrinterInstalled=\
+                    self.printer.keepPrinterInstalled
+                installer._installPrinter(ip,port)
+            self.workers=[None]*self.processes
+            diedAt:typing.List[typing.Optional[float]]=[None]*self.processes
+            while self.keepGoing:
+                for i,worker in enumerate(self.workers):
+                    if worker is not None and not worker.is_alive():
+                        worker.join()
+                        logger.warning(
+                            'Worker %d (pid %s) died with exit code %s',
+                            i,worker.pid,worker.exitcode)
+                        self.workers[i]=worker=None
+                        diedAt[i]=time.monotonic()
+                        self.restarts+=1
+                    if worker is None:
+                        died=diedAt[i]
+                        if died is None \
+                            or time.monotonic()-died>=self.restartDelay:
+                            self.workers[i]=self._startWorker(i)
+                time.sleep(0.1)
+        finally:
+            self._stopWorkers()
+            if installer is not None:
+                installer._uninstallPrinter()
+            reserved.close()
+            self.running=False
+
+    def _reservePort(self)->socket.socket:
+        """
+        Bind (but do not listen on) the ip:port all the workers will use
+        """
+        sock=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
+        sock.bind((self.host,self.port))
+        return sock
+
+    def _startWorker(self,index:int)->multiprocessing.process.BaseProcess:
+        """
+        Start worker process number index
+        """
+        assert self.address is not None
+        worker=self._context.Process(
+            target=self._workerMain,args=(index,self.address[1]),
+            name=f'printWorker{index}',daemon=True)
+        worker.start()
+        logger.debug('Started worker %d (pid %s)',index,worker.pid)
+        return worker
+
+    def _workerMain(self,index:int,port:int)->None:
+        """
+        What a worker process runs
+        """
+        printer=self.printer
+        if printer.metricsPort is not None:
+            printer.metricsPort+=index
+        server=printer._createServer(self.host,port,False,self.maxWorkers)
+        for s in [server]+server.alsoServe:
+            s.reusePort=True
+        server.drainTimeout=self.drainTimeout
+        printer._server=server
+
+        def stop(signum:int,frame:typing.Any)->None:
+            _=signum,frame
+            server.keepGoing=False
+        signal.signal(signal.SIGTERM,stop)
+        signal.signal(signal.SIGINT,signal.SIG_IGN) # the supervisor says
+        try:
+            server.run()
+        finally:
+            printer._server=None
+            printer._closeGhostscriptPool()
+            stopLogging() # (atexit doesn't happen in a forked process)
+
+    def _stopWorkers(self,timeout:float=30.0)->None:
+        """
+        Ask all the workers to stop, and wait for them to finish
+        whatever jobs they are working on
+        """
+        workers=[w for w in self.workers if w is not None]
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate() # (SIGTERM, see _workerMain)
+        deadline=time.monotonic()+timeout
+        for worker in workers:
+            worker.join(max(0.0,deadline-time.monotonic()))
+            if worker.is_alive():
+                logger.warning('Worker %s did not stop, killing it',worker.pid)
+                worker.kill()
+                worker.join()
+        self.workers=[]
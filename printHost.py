@@ -0,0 +1,204 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Serve a whole bunch of virtual printers from one process.
+
+Rather than every Printer.run() having its own loop (and so every
+queue needing its own process), a PrintHost accepts and receives jobs
+for all of its printers in one loop, and they share the worker threads, the
+ghostscript workers, and the conversion cache.  Each printer keeps
+its own metrics, so they can still be told apart.
+"""
+import typing
+import socket
+import logging
+import concurrent.futures
+
+from virtualPrinter.printer import Printer
+from virtualPrinter.printServer import PrintServer,_serveForever
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.ghostscriptApp import getGhostscriptApp
+from virtualPrinter.ghostscriptPool import GhostscriptPool
+from virtualPrinter.conversionCache import ConversionCache
+from virtualPrinter.jobMetrics import MetricsHttpServer,combinedPrometheusText
+from virtualPrinter.printerLogging import defaultLogging
+
+logger=logging.getLogger(__name__)
+
+
+class PrintHost:
+    """
+    Serve a whole bunch of virtual printers from one process.
+
+    Usage:
+        host=PrintHost(maxWorkers=8)
+        host.addPrinter(MyPdfPrinter('PDF'),port=9001)
+        host.addPrinter(MyPngPrinter('PNG'),port=9002)
+        host.run()
+    """
+
+    def __init__(self,
+        maxWorkers:int=4,
+        metricsPort:typing.Optional[int]=None,
+        conversionCache:typing.Optional[ConversionCache]=None,
+        gsPoolSize:int=2,
+        gsPoolMaxJobsPerWorker:int=100,
+        gsTimeout:typing.Optional[float]=300.0):
+        """
+        maxWorkers is how many jobs (for all the printers together)
+            can be received and converted at the same time
+
+        metricsPort, if given, serves the metrics for all the printers
+            (labeled with the printer name) in Prometheus text format
+            at http://127.0.0.1:metricsPort/metrics while running
+
+        conversionCache, if given, is shared by all the printers
+            (printers that already have their own keep it)
+
+        gsPoolSize, gsPoolMaxJobsPerWorker and gsTimeout are for the
+            ghostscript workers shared by printers with gsEngine="pool"
+        """
+        self.maxWorkers:int=max(1,maxWorkers)
+        self.metricsPort:typing.Optional[int]=metricsPort
+        self.conversionCache:typing.Optional[ConversionCache]=conversionCache
+        self.gsPoolSize:int=gsPoolSize
+        self.gsPoolMaxJobsPerWorker:int=gsPoolMaxJobsPerWorker
+        self.gsTimeout:typing.Optional[float]=gsTimeout
+        self.printers:typing.Dict[str,Printer]={}
+        self.servers:typing.Dict[str,PrintServer]={}
+        self.running:bool=False
+        self.keepGoing:bool=False
+        self._gsPool:typing.Optional[GhostscriptPool]=None
+        self._metricsServer:typing.Optional[MetricsHttpServer]=None
+
+    def addPrinter(self,
+        printer:Printer,
+        host:str='127.0.0.1',
+        port:typing.Union[None,int,str]=None,
+        autoInstallPrinter:bool=True
+        )->PrintServer:
+        """
+        Add a printer to be served on host:port
+        (same as the arguments to Printer.run())
+
+        Must be done before run()
+
+        returns the PrintServer that will feed it
+        """
+        if self.running:
+            raise PrinterException('Cannot add printers while running')
+        if printer.name in self.printers:
+            raise PrinterException(
+                f'There is already a printer named "{printer.name}"')
+        # the printer's metrics are served by us, labeled with its name
+        printer.metrics.labels.setdefault('printer',printer.name)
+        server=printer._createServer(host,port,autoInstallPrinter,
+            self.maxWorkers)
+        server.metricsPort=None
+        if printer.conversionCache is None:
+            printer.conversionCache=self.conversionCache
+        self.printers[printer.name]=printer
+        self.servers[printer.name]=server
+        return server
+
+    def _getGhostscriptPool(self)->GhostscriptPool:
+        """
+        Get the ghostscript workers shared by all the printers
+        """
+        if self._gsPool is None:
+            self._gsPool=GhostscriptPool(getGhostscriptApp(),
+                self.gsPoolSize,self.gsPoolMaxJobsPerWorker,self.gsTimeout)
+        return self._gsPool
+
+    def run(self)->None:
+        """
+        host mainloop (serves all the printers until keepGoing=False)
+        """
+        if self.running:
+            return
+        if not self.servers:
+            raise PrinterException('No printers to serve')
+        defaultLogging()
+        self.running=True
+        self.keepGoing=True
+        socks:typing.Dict[socket.socket,PrintServer]={}
+        executor=concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.maxWorkers,thread_name_prefix='printJob')
+        try:
+            for name,server in self.servers.items():
+                printer=self.printers[name]
+                if printer.gsEngine=='pool':
+                    printer._gsPool=self._getGhostscriptPool()
+                printer._server=server
+                for s in [server]+server.alsoServe:
+                    s.running=True
+                    s.keepGoing=True
+                    socks[s._listen(False)]=s
+            self._installPrinters(list(socks.values()),executor)
+            self._startMetricsServer()
+            logger.info('Serving %d printers',len(socks))
+            _serveForever(socks,executor,lambda: self.keepGoing)
+        finally:
+            executor.shutdown(wait=True)
+            for sock,server in socks.items():
+                server.keepGoing=False
+                server._stopListening(sock)
+            self._stopMetricsServer()
+            for printer in self.printers.values():
+                printer._server=None
+                if printer._gsPool is self._gsPool:
+                    printer._gsPool=None
+            if self._gsPool is not None:
+                self._gsPool.close()
+                self._gsPool=None
+            self.running=False
+
+    def _installPrinters(self,
+        servers:typing.List[PrintServer],
+        executor:concurrent.futures.Executor
+        )->None:
+        """
+        Install the printers for all the servers that want it,
+        all at the same time (since each one is slow, and they
+        have nothing to do with each other)
+        """
+        def install(server:PrintServer)->None:
+            assert server.address is not None
+            server._installPrinter(*server.address)
+        servers=[s for s in servers if s.autoInstallPrinter]
+        list(executor.map(install,servers))
+
+    def _startMetricsServer(self)->None:
+        """
+        Start serving metrics over http, if there is a metricsPort
+        """
+        if self.metricsPort is None or self._metricsServer is not None:
+            return
+        self._metricsServer=MetricsHttpServer(
+            self,'127.0.0.1',self.metricsPort)
+        self._metricsServer.start()
+        logger.info('Serving metrics on %s',self._metricsServer.address)
+
+    def _stopMetricsServer(self)->None:
+        """
+        Stop serving metrics over http
+        """
+        if self._metricsServer is not None:
+            self._metricsServer.close()
+            self._metricsServer=None
+
+    def stats(self)->typing.Dict[str,typing.Dict[str,typing.Any]]:
+        """
+        Get the metrics for each printer as plain dicts
+            {printerName:JobMetrics.snapshot()}
+        """
+        return {name:printer.metrics.snapshot()
+            for name,printer in self.printers.items()}
+
+    def prometheusText(self)->str:
+        """
+        Get the metrics for all the printers (labeled with the
+        printer name) in Prometheus text exposition format
+        """
+        return combinedPrometheusText(
+            printer.metrics for printer in self.printers.values())
@@ -8,13 +8,31 @@ Instead, we simply set up a loopback ip and act like a network printer.
 """
 import typing
 import os
+import sys
 import time
 import socket
 import atexit
-import select
+import logging
+import tempfile
+import functools
+import selectors
+import threading
+import concurrent.futures
 
 from virtualPrinter.windowsPrinters import WindowsPrinters
+from virtualPrinter.printerException import PrinterException
+from virtualPrinter.jobLimits import JobLimits,JobRejected,JobTimedOut
+from virtualPrinter.pjlHeader import PjlHeader
+from virtualPrinter.jobSpool import JobSpool
+from virtualPrinter.dscIndex import DscIndex
+from virtualPrinter.postscriptStream import PrintStream,PrintStreamFunctionType
+from virtualPrinter.jobMetrics import (
+    JobTiming,JobMetrics,MetricsHttpServer,jobContext)
+from virtualPrinter.printerLogging import defaultLogging
 
+logger=logging.getLogger(__name__)
+
+# normally a bytes-like object (eg, a memoryview) of the raw print job
 PrintCallbackDocType=typing.Any
 
 PrintCallbackFunctionType=typing.Callable[[
@@ -25,6 +43,27 @@ PrintCallbackFunctionType=typing.Callable[[
     ],None
 ]
 
+class _ReceivingJob:
+    """
+    A job that the select loop is part way through receiving
+    """
+
+    def __init__(self,
+        conn:socket.socket,
+        job:JobTiming,
+        headerLimit:int,
+        spool:JobSpool):
+        self.conn:socket.socket=conn
+        self.job:JobTiming=job
+        self.header:PjlHeader=PjlHeader(headerLimit)
+        self.dscIndex:DscIndex=DscIndex()
+        self.spool:JobSpool=spool
+        self.lastData:float=time.perf_counter()
+        self.paused:bool=False # (for going over the in-flight limit)
+        # what the select loop calls when there is something to receive
+        self.onReadable:typing.Callable[[],None]=lambda: None
+
+
 class PrintServer:
     """
     We could use RedMon to redirect a port to a program, but the idea of
@@ -37,7 +76,20 @@ class PrintServer:
         printerName:str='My Virtual Printer',
         ip:str='127.0.0.1',port:typing.Union[None,int,str]=None,
         autoInstallPrinter:bool=True,
-        printCallbackFn:typing.Optional[PrintCallbackFunctionType]=None):
+        printCallbackFn:typing.Optional[PrintCallbackFunctionType]=None,
+        maxWorkers:int=1,
+        listenBacklog:int=16,
+        buffersize:int=65536,
+        maxBuffersize:int=1048576,
+        socketReceiveBufferSize:typing.Optional[int]=None,
+        headerLimit:int=65536,
+        spoolThreshold:typing.Optional[int]=16*1024*1024,
+        spoolDir:typing.Optional[str]=None,
+        printStreamFn:typing.Optional[PrintStreamFunctionType]=None,
+        metrics:typing.Optional[JobMetrics]=None,
+        metricsPort:typing.Optional[int]=None,
+        reusePort:bool=False,
+        limits:typing.Optional[JobLimits]=None):
         """
         You can do an ip other than 127.0.0.1 (localhost), but really
         a better way is to install the printer and use windows sharing.
@@ -50,21 +102,108 @@ class PrintServer:
         (currently only supports Windows)
 
         printCallbackFn is a function to be called with received print data
+            (as a bytes-like object, PJL header and all, that is only
+            good until the callback returns)
             if it is None, then will save it out to a file.
+
+        maxWorkers is how many print jobs can be handed to
+            printCallbackFn at the same time.  If it is 1, jobs are
+            handled one at a time on the thread that called run().
+            If it is more, each job gets its own worker thread, so
+            printCallbackFn must be ok with being called concurrently.
+            (Either way, jobs are received side by side by a select
+            loop, so a slow sender never holds up anybody else.
+            Except when streaming, then each job is received by
+            its worker.)
+
+        listenBacklog is how many not-yet-accepted connections the OS
+            will queue up before refusing new ones
+
+        buffersize is the size of the first recv() of a job.  Whenever
+            the sender fills it up, it doubles (up to maxBuffersize)
+            so that big jobs take few syscalls but small ones don't
+            waste memory
+
+        socketReceiveBufferSize sets SO_RCVBUF on the socket
+            (None means to leave it up to the OS)
+
+        headerLimit is how far into a job to look for the PJL header
+            before giving up on finding any meta info
+
+        spoolThreshold is how big a job can get in memory before it is
+            spooled to a temp file in spoolDir instead.  Spooled jobs
+            are memory mapped when handed to printCallbackFn.
+            (None means always keep jobs in memory)
+
+        printStreamFn is an alternative to printCallbackFn for when you
+            want the job as it arrives rather than all at once.
+            As soon as the PJL header has been read, it gets called with
+            (title,author,filename) and returns a PrintStream object.
+            The postscript is then written into that as it comes in.
+
+        metrics collects timings for every job (see jobMetrics.py)
+            (None means make a new JobMetrics)
+
+        metricsPort, if given, serves the metrics in Prometheus text
+            format at http://127.0.0.1:metricsPort/metrics while running
+
+        reusePort sets SO_REUSEPORT so that several processes can listen
+            on the same ip:port, and the OS shares the connections out
+            between them (see preforkServer.py)
+
+        limits caps how many jobs (and bytes) are taken on at once,
+            and how big a job can be (see jobLimits.py)
+            (None means no limits)
         """
         self.ip:str=ip
         if port is None:
             port=0 # meaning, "any unused port"
         self.port:int=int(port)
-        self.buffersize:int=20  # Normally 1024, but we want fast response
+        self.buffersize:int=max(1,buffersize)
+        self.maxBuffersize:int=max(self.buffersize,maxBuffersize)
+        self.socketReceiveBufferSize:typing.Optional[int]=\
+            socketReceiveBufferSize
+        self.headerLimit:int=headerLimit
+        self.spoolThreshold:typing.Optional[int]=spoolThreshold
+        self.spoolDir:typing.Optional[str]=spoolDir
+        self.printStreamFn:typing.Optional[
+            PrintStreamFunctionType]=printStreamFn
+        self.bytesReceived:int=0 # total, over all jobs
+        self._bytesReceivedLock=threading.Lock()
+        if metrics is None:
+            metrics=JobMetrics()
+        self.metrics:JobMetrics=metrics
+        self.metricsPort:typing.Optional[int]=metricsPort
+        self._metricsServer:typing.Optional[MetricsHttpServer]=None
         self.autoInstallPrinter:bool=autoInstallPrinter
         self.printerName:str=printerName
         self.running:bool=False
         self.keepGoing:bool=False
+        # the (ip,port) actually being listened on (eg, when port=0)
+        self.address:typing.Optional[typing.Tuple[str,int]]=None
+        self.listening=threading.Event() # set once jobs can be sent
         self.osPrinterManager:typing.Optional[WindowsPrinters]=None
+        # leave the printer installed when we stop, so that starting
+        # again finds it already set up and has nothing to do
+        self.keepPrinterInstalled:bool=False
+        # once stopped, how long to keep receiving jobs that are already
+        # coming in (rather than cutting them off right away)
+        self.drainTimeout:float=0.0
         self.printerPortName:typing.Optional[str]=None
         self.printCallbackFn:typing.Optional[
             PrintCallbackFunctionType]=printCallbackFn
+        self.maxWorkers:int=max(1,maxWorkers)
+        self.listenBacklog:int=max(1,listenBacklog)
+        # jobs the select loop is receiving (only touched by that thread)
+        self._receiving:typing.List[_ReceivingJob]=[]
+        self._recvBuffer:typing.Optional[memoryview]=None
+        self.reusePort:bool=reusePort
+        if limits is None:
+            limits=JobLimits()
+        self.limits:JobLimits=limits
+        # other servers (eg, an LpdServer) to listen alongside this one,
+        # sharing its loop and workers
+        self.alsoServe:typing.List[PrintServer]=[]
 
     def __del__(self):
         """
@@ -82,22 +221,23 @@ class PrintServer:
         atexit.register(self.__del__) # ensure that __del__ always
         #                               gets called when the program exits
         if os.name=='nt':
-            self.osPrinterManager=WindowsPrinters()
+            if self.osPrinterManager is None: # (may be given one to use)
+                self.osPrinterManager=WindowsPrinters()
             self.printerPortName=self.printerName+' Port'
             makeDefault=False
             comment='Virtual printer created in Python'
             self.osPrinterManager.addPrinter(self.printerName,ip,port,
                 self.printerPortName,makeDefault,comment)
         else:
-            print('WARN: Auto install not implemented for os {os.name}')
+            logger.warning('Auto install not implemented for os %s',os.name)
 
     def _uninstallPrinter(self)->None:
         """
         remove the printer
         """
-        if self.osPrinterManager:
-            self.osPrinterManager.removePrinter(self.printerName)
-            self.osPrinterManager.removePort(self.printerPortName)
+        if self.osPrinterManager and not self.keepPrinterInstalled:
+            self.osPrinterManager.removePrinterAndPort(self.printerName,
+                self.printerPortName or '')
 
     def run(self)->None:
         """
@@ -105,113 +245,568 @@ class PrintServer:
         """
         if self.running:
             return
+        defaultLogging()
         self.running=True
         self.keepGoing=True
-        sock=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.bind((self.ip,self.port))
+        socks:typing.Dict[socket.socket,PrintServer]={}
+        executor:typing.Optional[concurrent.futures.ThreadPoolExecutor]=None
+        if self.maxWorkers>1:
+            executor=concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.maxWorkers,thread_name_prefix='printJob')
+        try:
+            for server in [self]+self.alsoServe:
+                server.running=True
+                server.keepGoing=True
+                socks[server._listen()]=server
+            logger.debug('Listening for incoming print jobs...')
+            _serveForever(socks,executor,lambda: self.keepGoing,
+                self.drainTimeout)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            for sock,server in socks.items():
+                server.keepGoing=False
+                server._stopListening(sock)
+
+    def _listen(self,installPrinter:bool=True)->socket.socket:
+        """
+        Open the server socket, install the printer, and start listening
+
+        (this is separate from run() so that a PrintHost can do it
+        for a whole bunch of servers and then serve them all at once)
+
+        installPrinter=False leaves installing the printer
+        (if autoInstallPrinter) up to the caller
+        """
+        sock=self._openSocket()
         ip,port=sock.getsockname()
-        print(f'Opening {ip}:{port}')
-        if self.autoInstallPrinter:
+        self.address=(ip,port)
+        logger.info('Opening %s:%s',ip,port)
+        if self.autoInstallPrinter and installPrinter:
             self._installPrinter(ip,port)
         #sock.setblocking(0)
-        sock.listen(1)
-        newWay=True
-        buf:typing.List[str]
-        while self.keepGoing:
-            print('\nListening for incoming print job...')
-            while self.keepGoing: # let select() yield some time to this thread
-                #                   so we can detect ctrl+c and keep change
-                inputready,outputready,exceptready= \
-                    select.select([sock],[],[],1.0)
-                _=outputready
-                _=exceptready
-                if sock in inputready:
-                    break
-            if not self.keepGoing:
-                continue
-            print('Incoming job... spooling...')
+        sock.listen(self.listenBacklog)
+        self._startMetricsServer()
+        self.listening.set()
+        return sock
+
+    def _accept(self,
+        sock:socket.socket,
+        executor:typing.Optional[concurrent.futures.Executor],
+        selector:typing.Optional[selectors.BaseSelector]=None
+        )->None:
+        """
+        Accept a connection that is waiting on sock
+
+        If there is a selector, the job is received by the select loop
+        (so a slow sender only ties up a socket, not a worker) and then
+        handed off to the executor.  Otherwise (or when streaming,
+        since writing to ghostscript can block) the whole thing is
+        handled either right here, or on the executor.
+        """
+        try:
             conn,addr=sock.accept()
-            _=addr # not used for now
-            #        could be interesting for remote prints tho
-            if self.printCallbackFn is None:
-                with open('I_printed_this.ps','wb') as f:
-                    while True:
-                        raw=conn.recv(self.buffersize)
-                        if not raw:
-                            break
-                        f.write(raw)
-                        f.flush()
-            elif newWay:
-                buf=[]
-                while True:
-                    raw=conn.recv(self.buffersize)
-                    if not raw:
-                        break
-                    data=raw.decode('utf-8',errors='ignore')
-                    buf.append(data)
-                combinedBuf=''.join(buf)
-                # get whatever meta info we can
-                author=None
-                title=None
-                filename=None
-                header='@'+combinedBuf.split('%!PS-',1)[0].split('@',1)[1]
-                #print header
-                for line in header.split('\n'):
-                    line=line.strip()
-                    if line.startswith('@PJL JOB NAME='):
-                        n=line.split('"',1)[1].rsplit('"',1)[0]
-                        if os.path.isfile(n):
-                            filename=n
-                        else:
-                            title=n
-                    elif line.startswith('@PJL COMMENT'):
-                        params=line.split('"',1)[1].rsplit('"',1)[0].split(';')
-                        for param in params:
-                            kv=param.split(':',1)
-                            if len(kv)>1:
-                                kv[0]=kv[0].strip().lower()
-                                kv[1]=kv[1].strip()
-                                if kv[0]=='username':
-                                    author=kv[1]
-                                elif kv[0]=='app filename':
-                                    if title is None:
-                                        if os.path.isfile(kv[1]):
-                                            filename=kv[1]
-                                        else:
-                                            title=kv[1]
-                if title is None and filename is not None:
-                    title=filename.rsplit(os.sep,1)[-1].split('.',1)[0]
-                self.printCallbackFn(buf,title,author,filename)
+        except OSError as e:
+            # (eg, they hung up before we got to them, or we are out
+            # of file handles) that is no reason to stop serving
+            logger.warning('Accepting a connection failed: %r',e)
+            return
+        job=JobTiming(addr)
+        self.metrics.jobAccepted(job)
+        self.limits.admit(job)
+        if selector is not None and self.printStreamFn is None:
+            with jobContext(job):
+                logger.info('Incoming job from %s... spooling...',addr)
+            conn.setblocking(False)
+            receiving=_ReceivingJob(conn,job,self.headerLimit,
+                JobSpool(self.spoolThreshold,self.spoolDir))
+            receiving.onReadable=functools.partial(
+                self._receiveSome,receiving,selector,executor)
+            self._receiving.append(receiving)
+            selector.register(conn,selectors.EVENT_READ,receiving.onReadable)
+        elif executor is None:
+            self._handleConnection(conn,addr,job)
+        else:
+            executor.submit(self._handleConnection,conn,addr,job)
+
+    def _updateListening(self,
+        sock:socket.socket,
+        selector:selectors.BaseSelector,
+        executor:typing.Optional[concurrent.futures.Executor]
+        )->None:
+        """
+        Only select() on the server socket while we are not too
+        busy to take on more (see jobLimits.py), so that otherwise
+        new connections wait in the listen backlog
+        """
+        listening=sock in selector.get_map()
+        if self.limits.canAccept():
+            if not listening:
+                selector.register(sock,selectors.EVENT_READ,
+                    functools.partial(self._accept,sock,executor,selector))
+        elif listening:
+            selector.unregister(sock)
+
+    def _receiveSome(self,
+        receiving:_ReceivingJob,
+        selector:selectors.BaseSelector,
+        executor:typing.Optional[concurrent.futures.Executor]
+        )->None:
+        """
+        Called by the select loop when there is something to receive
+        """
+        job=receiving.job
+        if not self.limits.hasRoom(job):
+            # (not reading makes TCP tell the sender to wait)
+            receiving.paused=True
+            selector.unregister(receiving.conn)
+            return
+        with jobContext(job):
+            if self._recvBuffer is None:
+                # (one buffer will do, since everything is copied
+                # out of it right away)
+                self._recvBuffer=memoryview(bytearray(self.maxBuffersize))
+            try:
+                n=receiving.conn.recv_into(self._recvBuffer)
+                if n:
+                    chunk=self._recvBuffer[0:n]
+                    with self._bytesReceivedLock:
+                        self.bytesReceived+=n
+                    job.addBytes(n)
+                    self.limits.addBytes(job,n)
+                    receiving.lastData=time.perf_counter()
+                    if not receiving.header.done \
+                        and receiving.header.feed(chunk):
+                        job.mark('headerParsed')
+                    receiving.dscIndex.feed(chunk)
+                    receiving.spool.write(chunk)
+                    return
+            except (BlockingIOError,InterruptedError):
+                return
+            except Exception as e: # pylint: disable=broad-except
+                self._abortReceiving(receiving,selector,e)
+                return
+            # that's all of it
+            selector.unregister(receiving.conn)
+            self._receiving.remove(receiving)
+            self.limits.received(job)
+            job.mark('lastByte')
+            if not receiving.header.done:
+                receiving.header.close()
+                job.mark('headerParsed')
+            receiving.dscIndex.close()
+            job.title=receiving.header.title
+            job.dscIndex=receiving.dscIndex
+            if executor is None:
+                self._finishJob(receiving)
             else:
-                buf=[]
-                printjobHeader=[]
-                fillingBuf=False
-                while True:
-                    raw=conn.recv(self.buffersize)
-                    if not raw:
-                        break
-                    data=raw.decode('utf-8',errors='ignore')
-                    if not fillingBuf:
-                        i=data.find('%!PS-')
-                        if i<0:
-                            printjobHeader.append(data)
-                        elif i==0:
-                            buf.append(data)
-                            fillingBuf=True
-                        else:
-                            printjobHeader.append(data[0:i])
-                            buf.append(data[i:])
-                            fillingBuf=True
-                    else:
-                        buf.append(data)
-                if buf:
-                    self.printCallbackFn(''.join(buf),None,None,None)
-            conn.close()
-            time.sleep(0.1)
+                executor.submit(self._finishJob,receiving)
+
+    def _serviceReceiving(self,selector:selectors.BaseSelector)->float:
+        """
+        Called by the select loop every time around to cut off
+        jobs that have hit a deadline, and to stop (or start again)
+        reading jobs depending on how many bytes are in flight
+
+        returns how long until the next deadline
+        """
+        nextDeadline=1.0
+        for receiving in list(self._receiving):
+            job=receiving.job
+            room=self.limits.hasRoom(job)
+            if receiving.paused:
+                # (it isn't their fault we aren't reading)
+                receiving.lastData=time.perf_counter()
+                if room:
+                    receiving.paused=False
+                    selector.register(receiving.conn,selectors.EVENT_READ,
+                        receiving.onReadable)
+                continue
+            timeLeft=self.limits.timeLeft(job,receiving.lastData)
+            if timeLeft is not None and timeLeft<=0:
+                with jobContext(job):
+                    try:
+                        self.limits.timeOut(job,receiving.lastData)
+                    except JobTimedOut as e:
+                        self._abortReceiving(receiving,selector,e)
+                continue
+            if timeLeft is not None:
+                nextDeadline=min(nextDeadline,timeLeft)
+            if not room:
+                # (not reading makes TCP tell the sender to wait)
+                receiving.paused=True
+                selector.unregister(receiving.conn)
+        return nextDeadline
+
+    def _abortReceiving(self,
+        receiving:_ReceivingJob,
+        selector:selectors.BaseSelector,
+        error:BaseException
+        )->None:
+        """
+        Give up on receiving a job
+        """
+        job=receiving.job
+        job.error=repr(error)
+        if not isinstance(error,JobRejected): # (those are already logged)
+            logger.error('Print job failed: %r',error)
+        if not receiving.paused:
+            selector.unregister(receiving.conn)
+        self._receiving.remove(receiving)
+        receiving.spool.close()
+        receiving.conn.close()
+        self.limits.finish(job)
+        self.metrics.jobDone(job)
+
+    def _finishJob(self,receiving:_ReceivingJob)->None:
+        """
+        Hand off a job the select loop has received to printCallbackFn
+        (this is what runs on a worker, so it must never let an
+        exception escape)
+        """
+        job=receiving.job
+        with jobContext(job):
+            try:
+                self.limits.start(job) # (waits for its turn)
+                job.mark('started')
+                logger.info('Received %d bytes',receiving.spool.size)
+                header=receiving.header
+                if self.printCallbackFn is None:
+                    with self._openJobFile() as f:
+                        f.write(receiving.spool.getBuffer())
+                    logger.info('Saved job to "%s"',f.name)
+                else:
+                    self.printCallbackFn(receiving.spool.getBuffer(),
+                        header.title,header.author,header.filename)
+                    job.mark('callbackDone')
+            except Exception as e: # pylint: disable=broad-except
+                job.error=repr(e)
+                logger.exception('Print job failed')
+            finally:
+                receiving.spool.close()
+                receiving.conn.close()
+                self.limits.finish(job)
+                self.metrics.jobDone(job)
+
+    def _stopListening(self,sock:socket.socket)->None:
+        """
+        Undo _listen()
+        """
+        self.listening.clear()
+        self._stopMetricsServer()
+        sock.close()
+        self.running=False
+
+    def _openSocket(self)->socket.socket:
+        """
+        Create the server socket and bind it to our ip:port
+        (but do not start listening yet)
+        """
+        sock=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.reusePort:
+            if not hasattr(socket,'SO_REUSEPORT'):
+                sock.close()
+                raise PrinterException(
+                    f'SO_REUSEPORT is not supported on {sys.platform}')
+            sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
+        if self.socketReceiveBufferSize is not None:
+            # must be set before listen() for the tcp window to use it.
+            # Accepted connections inherit it.
+            sock.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,
+                self.socketReceiveBufferSize)
+        sock.bind((self.ip,self.port))
+        return sock
+
+    def _startMetricsServer(self)->None:
+        """
+        Start serving metrics over http, if there is a metricsPort
+        """
+        if self.metricsPort is None or self._metricsServer is not None:
+            return
+        self._metricsServer=MetricsHttpServer(
+            self.metrics,'127.0.0.1',self.metricsPort)
+        self._metricsServer.start()
+        logger.info('Serving metrics on %s',self._metricsServer.address)
+
+    def _stopMetricsServer(self)->None:
+        """
+        Stop serving metrics over http
+        """
+        if self._metricsServer is not None:
+            self._metricsServer.close()
+            self._metricsServer=None
+
+    def _recvChunks(self,
+        conn:socket.socket,
+        job:typing.Optional[JobTiming]=None
+        )->typing.Iterator[memoryview]:
+        """
+        Receive everything from a connection, one chunk at a time
+
+        If there is a job, it is held to self.limits (that is, this
+        stops reading while there are too many bytes in flight,
+        raises JobRejected if the job gets too big, and raises
+        JobTimedOut if the sender takes too long)
+
+        Rather than allocating a new bytes object for every recv(),
+        this uses recv_into() a re-usable buffer, so the memoryview
+        that is yielded is only good until the next one is requested.
+        (Use it, or copy it, but don't keep it!)
+        """
+        size=self.buffersize
+        view=memoryview(bytearray(size))
+        lastData=time.perf_counter()
+        while True:
+            if job is not None:
+                if not self.limits.hasRoom(job):
+                    # (not reading makes TCP tell the sender to wait)
+                    self.limits.waitForRoom(job)
+                    lastData=time.perf_counter() # (not their fault)
+                timeLeft=self.limits.timeLeft(job,lastData)
+                if timeLeft is not None and timeLeft<=0:
+                    self.limits.timeOut(job,lastData)
+                conn.settimeout(timeLeft)
+            try:
+                n=conn.recv_into(view)
+            except socket.timeout:
+                if job is None:
+                    raise
+                self.limits.timeOut(job,lastData)
+            if not n:
+                if job is not None:
+                    self.limits.received(job)
+                break
+            lastData=time.perf_counter()
+            with self._bytesReceivedLock:
+                self.bytesReceived+=n
+            if job is not None:
+                self.limits.addBytes(job,n)
+            yield view[0:n]
+            if n==size and size<self.maxBuffersize:
+                # sender is keeping up with us, so take bigger bites
+                size=min(size*2,self.maxBuffersize)
+                view=memoryview(bytearray(size))
+
+    def _handleConnection(self,
+        conn:socket.socket,
+        addr:typing.Any,
+        job:typing.Optional[JobTiming]=None
+        )->None:
+        """
+        Receive a single print job from an accepted connection
+        and hand it off to printCallbackFn
+
+        This is what runs on a worker when maxWorkers>1, so it
+        must never let an exception escape (or it gets silently
+        swallowed by the executor)
+        """
+        if job is None:
+            job=JobTiming(addr)
+            self.metrics.jobAccepted(job)
+            self.limits.admit(job)
+        self.limits.start(job) # (waits for its turn)
+        job.mark('started')
+        with jobContext(job):
+            try:
+                logger.info('Incoming job from %s... spooling...',addr)
+                self._receiveJob(conn,addr,job)
+            except JobRejected as e:
+                job.error=repr(e) # (already logged)
+            except Exception as e: # pylint: disable=broad-except
+                job.error=repr(e)
+                logger.exception('Print job failed')
+            finally:
+                conn.close()
+                self.limits.finish(job)
+                self.metrics.jobDone(job)
+
+    def _receiveJob(self,
+        conn:socket.socket,
+        addr:typing.Any,
+        job:JobTiming
+        )->None:
+        """
+        Receive the job data from a connection and call printCallbackFn
+        """
+        _=addr # not used for now
+        #        could be interesting for remote prints tho
+        if self.printStreamFn is not None:
+            self._streamJob(conn,self.printStreamFn,job)
+            return
+        if self.printCallbackFn is None:
+            with self._openJobFile() as f:
+                for chunk in self._recvChunks(conn,job):
+                    job.addBytes(len(chunk))
+                    f.write(chunk)
+            job.mark('lastByte')
+            logger.info('Received %d bytes into "%s"',
+                job.bytesReceived,f.name)
+            return
+        # the raw bytes go straight into a spool that is handed
+        # to the callback as-is (never decoded, never copied again)
+        header=PjlHeader(self.headerLimit)
+        dscIndex=DscIndex() # so nobody has to go looking for pages later
+        with JobSpool(self.spoolThreshold,self.spoolDir) as spool:
+            for chunk in self._recvChunks(conn,job):
+                job.addBytes(len(chunk))
+                if not header.done and header.feed(chunk):
+                    job.mark('headerParsed')
+                dscIndex.feed(chunk)
+                spool.write(chunk)
+            job.mark('lastByte')
+            if not header.done:
+                header.close()
+                job.mark('headerParsed')
+            dscIndex.close()
+            job.title=header.title
+            job.dscIndex=dscIndex
+            logger.info('Received %d bytes',spool.size)
+            self.printCallbackFn(spool.getBuffer(),
+                header.title,header.author,header.filename)
+            job.mark('callbackDone')
+
+    def _streamJob(self,
+        conn:socket.socket,
+        printStreamFn:PrintStreamFunctionType,
+        job:JobTiming
+        )->None:
+        """
+        Receive a job from a connection, writing it into a PrintStream
+        as it comes in (rather than collecting the whole thing first)
+        """
+        header=PjlHeader(self.headerLimit)
+        pending=bytearray() # what we have before the header is parsed
+        stream:typing.Optional[PrintStream]=None
+        try:
+            for chunk in self._recvChunks(conn,job):
+                job.addBytes(len(chunk))
+                if stream is not None:
+                    stream.write(chunk)
+                    continue
+                pending+=chunk
+                if header.feed(chunk):
+                    job.mark('headerParsed')
+                    job.title=header.title
+                    stream=self._openPrintStream(
+                        printStreamFn,header,pending)
+                    pending=bytearray()
+            if stream is None: # job was shorter than the header limit
+                header.close()
+                job.mark('headerParsed')
+                job.title=header.title
+                stream=self._openPrintStream(printStreamFn,header,pending)
+            job.mark('lastByte')
+            logger.info('Received %d bytes',job.bytesReceived)
+        except BaseException:
+            if stream is not None:
+                stream.abort()
+            raise
+        stream.close()
+        job.mark('callbackDone')
+
+    def _openPrintStream(self,
+        printStreamFn:PrintStreamFunctionType,
+        header:PjlHeader,
+        pending:bytearray
+        )->PrintStream:
+        """
+        Start up a PrintStream once we know the header, and give it
+        whatever postscript has already arrived
+        """
+        stream=printStreamFn(header.title,header.author,header.filename)
+        try:
+            with memoryview(pending) as view:
+                stream.write(view[header.postscriptOffset or 0:])
+        except BaseException:
+            stream.abort()
+            raise
+        return stream
+
+    def _openJobFile(self)->typing.BinaryIO:
+        """
+        When there is no printCallbackFn, jobs get saved out to
+        (uniquely named) files in the current directory
+        """
+        fd,filename=tempfile.mkstemp(
+            prefix='I_printed_this_',suffix='.ps',dir='.')
+        os.close(fd)
+        return open(filename,'wb') # pylint: disable=consider-using-with
+
+
+def _serveForever(
+    listeners:typing.Dict[socket.socket,PrintServer],
+    executor:typing.Optional[concurrent.futures.Executor],
+    keepGoing:typing.Callable[[],bool],
+    drainTimeout:float=0.0
+    )->None:
+    """
+    The select loop that accepts and receives jobs for one or more
+    PrintServers, handing them off to the executor once they are in
+    (PrintServer.run() and PrintHost.run() both use this)
+
+    listeners is {listening socket:the PrintServer it is for}
+
+    keepGoing is checked at least once a second
+
+    Once keepGoing() is False, the listening sockets are closed (so
+    nothing new comes in) and jobs that are still being received get
+    up to drainTimeout seconds to finish before they are cut off.
+    """
+    selector=selectors.DefaultSelector()
+    try:
+        while keepGoing():
+            timeout=1.0 # so we can notice keepGoing and ctrl+c
+            for sock,server in listeners.items():
+                server._updateListening(sock,selector,executor)
+                timeout=min(timeout,server._serviceReceiving(selector))
+            timeout=max(timeout,0.0)
+            if not selector.get_map():
+                # (on windows, select() can't wait on nothing)
+                time.sleep(timeout)
+                continue
+            for key,_ in selector.select(timeout):
+                key.data()
+        if drainTimeout>0:
+            _drain(listeners,selector,drainTimeout)
+    finally:
+        for server in listeners.values():
+            for receiving in list(server._receiving):
+                with jobContext(receiving.job):
+                    server._abortReceiving(receiving,selector,
+                        PrinterException('server stopped'))
+        selector.close()
+
+
+def _drain(
+    listeners:typing.Dict[socket.socket,PrintServer],
+    selector:selectors.BaseSelector,
+    drainTimeout:float
+    )->None:
+    """
+    Stop listening, and finish receiving whatever is already coming in
+    (see _serveForever)
+    """
+    for sock in listeners:
+        if sock in selector.get_map():
+            selector.unregister(sock)
+        sock.close()
+    deadline=time.monotonic()+drainTimeout
+    while any(server._receiving for server in listeners.values()):
+        timeout=deadline-time.monotonic()
+        if timeout<=0:
+            logger.warning('Gave up waiting for jobs to finish coming in')
+            return
+        for server in listeners.values():
+            timeout=min(timeout,server._serviceReceiving(selector))
+        timeout=max(timeout,0.0)
+        if not selector.get_map():
+            time.sleep(timeout)
+            continue
+        for key,_ in selector.select(timeout):
+            key.data()
 
 
 if __name__=='__main__':
-    import sys
     port=9001
     ip='127.0.0.1'
     runit=True
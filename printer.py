@@ -8,51 +8,42 @@ Ready to run it with run()
 """
 import typing
 import os
+import io
 import sys
+import mmap
+import asyncio
+import inspect
+import logging
+import threading
+import contextlib
+import contextvars
 import subprocess
 
-from virtualPrinter.printServer import PrintCallbackDocType
+from virtualPrinter.printServer import PrintCallbackDocType,PrintServer
 from virtualPrinter.printerException import PrinterException
+from virtualPrinter.ghostscriptApp import findGhostscript,getGhostscriptApp
+from virtualPrinter.jobMetrics import JobMetrics,markJob,currentJob
+from virtualPrinter.jobLimits import JobLimits
+if typing.TYPE_CHECKING:
+    # (these are only imported once whatever uses them is turned on,
+    # eg gsEngine='pool', streaming, parallelPages or pageByPage)
+    from virtualPrinter.ghostscriptPool import GhostscriptPool
+    from virtualPrinter.postscriptStream import GhostscriptStream
+    from virtualPrinter.conversionCache import ConversionCache
+    from virtualPrinter.dscIndex import DscIndex
+    from virtualPrinter.pageStream import RenderedPage
 
+logger=logging.getLogger(__name__)
 
-# get the location of ghostscript
-if os.name=='nt':
-    GHOSTSCRIPT_APP=None
-    for gsDir in (
-        os.environ['ProgramFiles']+os.sep+'gs',
-        os.environ['ProgramFiles(x86)']+os.sep+'gs'
-        ):
-        if os.path.isdir(gsDir):
-            # find the newest version
-            bestVersion:float=0.0
-            val:float
-            for f in os.listdir(gsDir):
-                path=gsDir+os.sep+f
-                if os.path.isdir(path) and f.startswith('gs'):
-                    try:
-                        val=float(f[2:])
-                    except ValueError:
-                        val=0.0
-                    if bestVersion<val:
-                        for appName in (
-                            'gswin64c.exe',
-                            'gswin32c.exe',
-                            'gswin.exe',
-                            'gs.exe'
-                            ):
-                            appName=gsDir+os.sep+f+os.sep+'bin'+os.sep+appName
-                            if os.path.isfile(appName):
-                                bestVersion=val
-                                GHOSTSCRIPT_APP='"'+appName+'"'
-                                break
-    if GHOSTSCRIPT_APP is None:
-        errString="""ERR: Ghostscript not found!
-            You can get it from:
-                http://www.ghostscript.com"""
-        raise PrinterException(errString)
-else: # assume we can find it
-    GHOSTSCRIPT_APP='gs'
-print(f'GHOSTSCRIPT_APP={GHOSTSCRIPT_APP}')
+
+def __getattr__(name:str)->typing.Any:
+    """
+    GHOSTSCRIPT_APP used to be looked up when this module was imported.
+    Now it is looked up the first time somebody wants it.
+    """
+    if name=='GHOSTSCRIPT_APP':
+        return findGhostscript()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # find a good shell_escape routine
@@ -68,6 +59,21 @@ except ImportError:
     shell_escape=pipes.quote
 
 
+PostscriptData=typing.Union[
+    bytes,bytearray,memoryview,mmap.mmap,typing.BinaryIO]
+
+
+def _fileno(f:typing.Any)->typing.Optional[int]:
+    """
+    Get the os-level file number of a file-like object, or None
+    if it doesn't have one (like io.BytesIO, or bytes)
+    """
+    try:
+        return f.fileno()
+    except (AttributeError,OSError,ValueError): # io.UnsupportedOperation
+        return None
+
+
 class Printer:
     """
     You can derive from this class to create your own printer!
@@ -86,25 +92,65 @@ class Printer:
         name - the name of the printer to be installed
 
         acceptsFormat - the format that the printThis() method accepts
-        Available formats are "pdf", or "png" (default=png)
+        Available formats are "pdf", "png", or "raw" (default=png)
+        ("raw" hands printThis() a list of pages of uncompressed
+        pixels, see pageStream.pixelArray())
 
         acceptsColors - the color format that the printThis() method accepts
         (if relevent to acceptsFormat)
         Available colors are "grey", "rgb", or "rgba" (default=rgba)
         """
-        from virtualPrinter.printServer import PrintServer
         self._server:typing.Optional[PrintServer]=None
         self.name:str=name
         self.acceptsFormat:str=acceptsFormat
         self.acceptsColors:str=acceptsColors
         self.bgColor:str='#ffffff' # not sure how necessary this is
+        # how to run ghostscript:
+        #   "subprocess" - start a new ghostscript for every job
+        #   "pool" - keep gsPoolSize ghostscripts running and reuse them
+        #   "libgs" - run ghostscript in this process through its C api
+        #             (falls back to "subprocess" if there is no libgs)
+        self.gsEngine:str='subprocess'
+        self.gsPoolSize:int=2
+        self.gsPoolMaxJobsPerWorker:int=100
+        self.gsTimeout:typing.Optional[float]=300.0
+        self._gsPool:typing.Optional['GhostscriptPool']=None
+        # start converting jobs while they are still being received
+        # (only with gsEngine="subprocess")
+        self.streaming:bool=False
+        # render long raster (eg, png) jobs in page ranges on
+        # renderWorkers ghostscripts at once (None = one per cpu)
+        # (only with gsEngine="subprocess")
+        self.parallelPages:bool=False
+        self.renderWorkers:typing.Optional[int]=None
+        # for raster (eg, png) formats, call printPages() with each page
+        # as soon as it is rendered, rather than printThis() with all of
+        # them at once (always uses a ghostscript subprocess)
+        self.pageByPage:bool=False
+        # if set, reprinting the same document skips ghostscript
+        self.conversionCache:typing.Optional['ConversionCache']=None
+        # timings for every job received (add hooks to it to see them)
+        # and, if metricsPort is set, serve them for prometheus
+        self.metrics:JobMetrics=JobMetrics()
+        self.metricsPort:typing.Optional[int]=None
+        # caps on how much work is taken on at once (see jobLimits.py)
+        self.limits:typing.Optional[JobLimits]=None
+        # if set, also take LPD jobs on this port (the standard one is
+        # 515) alongside the raw ones, from the same loop and workers
+        # (see lpdServer.py)
+        self.lpdPort:typing.Optional[int]=None
+        self.lpdQueue:typing.Optional[str]=None
+        # leave the printer installed in the OS when the server stops
+        # (so the next start doesn't have to set it up all over again)
+        self.keepPrinterInstalled:bool=False
+        self._gsPoolLock=threading.Lock()
 
     def printThis(self,
         doc:PrintCallbackDocType,
         title:typing.Optional[str]=None,
         author:typing.Optional[str]=None,
         filename:typing.Optional[str]=None
-        )->None:
+        )->typing.Optional[typing.Awaitable[None]]:
         """
         you probably want to override this
 
@@ -112,6 +158,10 @@ class Printer:
 
         defaults to saving a file
 
+        this may also be an async def, in which case the conversion
+        work is done on an executor and this is awaited on the
+        event loop (see runAsync())
+
         TODO: keep track of filename?
         """
         _=filename # For now, don't care
@@ -119,13 +169,77 @@ class Printer:
             title='printed'
         if author is not None:
             title=title+' - '+author
+        if self.acceptsFormat=='raw':
+            from virtualPrinter.pageStream import pnmHeader
+            # doc is [pixels] so save each page as a pgm/ppm image
+            for pageNumber,pixels in enumerate(doc,1):
+                height,width=pixels.shape[0:2]
+                channels=pixels.shape[2] if len(pixels.shape)>2 else 1
+                pageFilename=f'{title}-{pageNumber}.pnm'
+                with open(shell_escape(pageFilename),'wb') as f:
+                    f.write(pnmHeader(width,height,channels))
+                    f.write(pixels)
+            return None
         with open(shell_escape(title+'.'+self.acceptsFormat),'wb') as f:
             f.write(doc)
+        return None
+
+    def printPages(self,
+        pages:typing.Iterator['RenderedPage'],
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        )->None:
+        """
+        override this instead of printThis() when pageByPage=True
+
+        called when something is being printed, with the pages
+        as they are rendered (so the first page is here while
+        the rest are still being worked on)
+
+        pages must be used (or given up on) before this returns
+
+        defaults to saving a file for each page
+        """
+        _=filename # For now, don't care
+        if title is None:
+            title='printed'
+        if author is not None:
+            title=title+' - '+author
+        for page in pages:
+            pageFilename=f'{title}-{page.pageNumber}.{page.extension}'
+            with open(shell_escape(pageFilename),'wb') as f:
+                f.write(page.data)
+
+    def renderPages(self,
+        datasource:PrintCallbackDocType,
+        datasourceIsFilename:bool=False
+        )->typing.Iterator['RenderedPage']:
+        """
+        Render postscript to the raster format printThis() accepts,
+        and yield each page as soon as ghostscript finishes it
+
+        (see printPostscript() for what datasource can be)
+
+        Only one page is in memory at a time.  If you stop early,
+        ghostscript gets stopped too.
+        """
+        from virtualPrinter.pageStream import renderPages as renderPageStream
+        gsDev,gsDevOptions=self._gsDevice()
+        markJob('conversionStart')
+        try:
+            with self._openDatasource(datasource,datasourceIsFilename) as data:
+                yield from renderPageStream(
+                    self._gsCommand(gsDev,gsDevOptions),
+                    data,self.acceptsFormat,_fileno(data) is not None)
+        finally:
+            markJob('conversionEnd')
 
     def run(self,
         host:str='127.0.0.1',
         port:typing.Union[None,int,str]=None,
-        autoInstallPrinter:bool=True
+        autoInstallPrinter:bool=True,
+        maxWorkers:int=1
         )->None:
         """
         normally all the default values are exactly what you need!
@@ -133,13 +247,95 @@ class Printer:
         autoInstallPrinter is used to install the printer in the OS
         (currently only supports Windows)
         startServer is required for this
+
+        maxWorkers is how many jobs can be converted at the same time
+        (printThis() may then be called from several threads at once)
         """
-        from virtualPrinter.printServer import PrintServer
-        self._server=PrintServer(
-            self.name,host,port,autoInstallPrinter,self._printServerCallback)
+        self._server=self._createServer(host,port,autoInstallPrinter,
+            maxWorkers)
         self._server.run()
         del self._server # delete it so it gets un-registered
         self._server=None
+        self._closeGhostscriptPool()
+
+    def _createServer(self,
+        host:str='127.0.0.1',
+        port:typing.Union[None,int,str]=None,
+        autoInstallPrinter:bool=True,
+        maxWorkers:int=1
+        )->PrintServer:
+        """
+        Create the PrintServer that feeds jobs to this printer
+        (but do not start it)
+        """
+        server=PrintServer(
+            self.name,host,port,autoInstallPrinter,self._printServerCallback,
+            maxWorkers=maxWorkers,
+            metrics=self.metrics,metricsPort=self.metricsPort,
+            limits=self.limits)
+        if self.streaming and self.gsEngine=='subprocess' \
+            and not self.pageByPage:
+            server.printStreamFn=self._openPrintStream
+        server.keepPrinterInstalled=self.keepPrinterInstalled
+        if self.lpdPort is not None:
+            from virtualPrinter.lpdServer import LpdServer
+            lpdServer=LpdServer(self.name,host,self.lpdPort,
+                self._printServerCallback,maxWorkers,self.lpdQueue)
+            lpdServer.metrics=self.metrics
+            lpdServer.limits=server.limits
+            server.alsoServe.append(lpdServer)
+        return server
+
+    def _closeGhostscriptPool(self)->None:
+        """
+        Shut down any ghostscript workers we have running
+        """
+        with self._gsPoolLock:
+            if self._gsPool is not None:
+                self._gsPool.close()
+                self._gsPool=None
+
+    def runPrefork(self,
+        host:str='127.0.0.1',
+        port:typing.Union[None,int,str]=None,
+        autoInstallPrinter:bool=True,
+        processes:typing.Optional[int]=None,
+        maxWorkers:int=1
+        )->None:
+        """
+        Same as run(), but serves jobs from several processes at once
+        (processes=None means one per cpu) that all listen on the
+        same port (Linux only, see preforkServer.py)
+        """
+        from virtualPrinter.preforkServer import PreforkServer
+        PreforkServer(self,host,port,autoInstallPrinter,
+            processes,maxWorkers).run()
+
+    async def runAsync(self,
+        host:str='127.0.0.1',
+        port:typing.Union[None,int,str]=None,
+        autoInstallPrinter:bool=True,
+        maxWorkers:int=4
+        )->None:
+        """
+        Same as run(), but serves jobs from an asyncio event loop
+        using an AsyncPrintServer
+
+        maxWorkers is how many ghostscript conversions can be
+        running on the executor at the same time
+        """
+        from virtualPrinter.asyncPrintServer import AsyncPrintServer
+        server=AsyncPrintServer(self.name,host,port,autoInstallPrinter,
+            self._asyncPrintServerCallback,maxWorkers=maxWorkers)
+        server.metrics=self.metrics
+        server.metricsPort=self.metricsPort
+        if self.limits is not None:
+            server.limits=self.limits
+        self._server=server
+        await server.serve()
+        del server
+        self._server=None
+        self._closeGhostscriptPool()
 
     def _printServerCallback(self,
         dataSource:PrintCallbackDocType,
@@ -151,16 +347,89 @@ class Printer:
         Default callback, turns around and calls
         printPostscript() with the data given to it
         """
-        self.printPostscript(dataSource,False,title,author,filename)
+        job=currentJob()
+        self.printPostscript(dataSource,False,title,author,filename,
+            dscIndex=job.dscIndex if job is not None else None)
+
+    def _openPrintStream(self,
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        )->'GhostscriptStream':
+        """
+        Callback for PrintServer when streaming.  Starts ghostscript
+        up so the job can be fed to it as it arrives.
+        """
+        from virtualPrinter.postscriptStream import GhostscriptStream
+        logger.debug('Converting data...')
+        gsDev,gsDevOptions=self._gsDevice()
+        stream=GhostscriptStream(self._gsCommand(gsDev,gsDevOptions),
+            lambda data: self._streamFinished(data,title,author,filename))
+        markJob('conversionStart')
+        return stream
+
+    def _streamFinished(self,
+        data:bytearray,
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        )->None:
+        """
+        Called when a GhostscriptStream has finished converting
+        """
+        markJob('conversionEnd')
+        self._printConverted(data,title,author,filename)
+
+    async def _asyncPrintServerCallback(self,
+        dataSource:PrintCallbackDocType,
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        ):
+        """
+        Callback for AsyncPrintServer.  Does the (blocking) ghostscript
+        conversion on an executor, then calls printThis(), awaiting it
+        if it is an async def.
+        """
+        from virtualPrinter.asyncPrintServer import AsyncPrintServer
+        executor=None
+        if isinstance(self._server,AsyncPrintServer):
+            executor=self._server.executor
+        loop=asyncio.get_running_loop()
+        job=currentJob()
+        dscIndex=job.dscIndex if job is not None else None
+        if self.pageByPage:
+            # (pages are handed over as they are rendered, so that all
+            # has to happen on the executor)
+            await loop.run_in_executor(executor,
+                contextvars.copy_context().run,self.printPostscript,
+                dataSource,False,title,author,filename)
+            return
+        # (run it in this job's context, so the conversion gets timed)
+        data=await loop.run_in_executor(executor,
+            contextvars.copy_context().run,self._convertDatasource,
+            dataSource,False,dscIndex)
+        doc=self._toPrintable(data)
+        logger.debug('Printing data...')
+        if inspect.iscoroutinefunction(self.printThis):
+            await self.printThis(doc,
+                title=title,author=author,filename=filename)
+        else:
+            await loop.run_in_executor(executor,
+                lambda: self.printThis(doc,
+                    title=title,author=author,filename=filename))
 
     def _postscriptToFormat(self,
-        data,
+        data:'PostscriptData',
         gsDev:str='pdfwrite',
         gsDevOptions:typing.Optional[typing.Iterable[str]]=None,
         outputDebug:bool=True
-        )->str:
+        )->bytes:
         """
-        Converts postscript data (in a string) to pdf data (in a string)
+        Converts postscript data to pdf (or whatever gsDev makes) data
+
+        data is a bytes-like object, or an open binary file, which
+        ghostscript then reads directly rather than through a pipe
 
         gsDev is a ghostscript format device
 
@@ -168,61 +437,235 @@ class Printer:
             http://www.ghostscript.com/doc/current/Devices.htm
             http://www.ghostscript.com/doc/current/Use.htm#Options
         """
-        if GHOSTSCRIPT_APP is None:
-            msg="ghostscript is inaccessible. Is it installed?"
+        if self.gsEngine=='libgs':
+            # (only load ctypes and friends if somebody wants them)
+            from virtualPrinter.ghostscriptLib import getGhostscriptLib
+            gsLib=getGhostscriptLib()
+            if gsLib is not None:
+                return gsLib.convert(data,gsDev,gsDevOptions)
+        if self.gsEngine=='pool':
+            return self._getGhostscriptPool().convert(data,gsDev,gsDevOptions)
+        if self.gsEngine not in ('subprocess','libgs'):
+            msg=f'Unknown ghostscript engine "{self.gsEngine}"'
             raise PrinterException(msg)
-        cmd:typing.List[str]=[GHOSTSCRIPT_APP,'-q','-sDEVICE='+gsDev]
-        if gsDevOptions is not None:
-            cmd.extend(gsDevOptions)
-        cmd.extend((r'-sstdout=%stderr','-sOutputFile=-','-dBATCH','-'))
+        cmd=self._gsCommand(gsDev,gsDevOptions)
         if outputDebug:
-            print(' '.join(cmd))
+            logger.debug('%s',' '.join(cmd))
+        stdin:typing.Any=subprocess.PIPE
+        stdinData:typing.Any=data # communicate() is fine with any buffer
+        if _fileno(data) is not None:
+            stdin=data
+            stdinData=None
         with subprocess.Popen(cmd,
-            stdin=subprocess.PIPE,stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,shell=True) as po:
-            data,gsStdoutStderr=po.communicate(input=data)
-        if outputDebug:
+            stdin=stdin,stderr=subprocess.PIPE,
+            stdout=subprocess.PIPE) as po:
+            result,gsStdoutStderr=po.communicate(input=stdinData)
+        if outputDebug and logger.isEnabledFor(logging.DEBUG):
             # note: stdout also goes to stderr because of
             # the -sstdout=%stderr flag above
-            print(gsStdoutStderr)
-        return data
+            logger.debug('ghostscript said:\n%s',
+                gsStdoutStderr.decode('utf-8',errors='replace'))
+        return result
+
+    def _gsCommand(self,
+        gsDev:str,
+        gsDevOptions:typing.Optional[typing.Iterable[str]]=None
+        )->typing.List[str]:
+        """
+        The ghostscript command line to convert postscript on stdin
+        to gsDev format on stdout
+        """
+        cmd:typing.List[str]=[getGhostscriptApp(),'-q','-sDEVICE='+gsDev]
+        if gsDevOptions is not None:
+            cmd.extend(gsDevOptions)
+        cmd.extend((r'-sstdout=%stderr','-sOutputFile=-','-dBATCH','-'))
+        return cmd
+
+    def _getGhostscriptPool(self)->'GhostscriptPool':
+        """
+        Get the pool of ghostscript workers, starting it if need be
+        """
+        from virtualPrinter.ghostscriptPool import GhostscriptPool
+        with self._gsPoolLock:
+            if self._gsPool is None:
+                self._gsPool=GhostscriptPool(getGhostscriptApp(),
+                    self.gsPoolSize,self.gsPoolMaxJobsPerWorker,
+                    self.gsTimeout)
+            return self._gsPool
 
     def printPostscript(self,
         datasource:PrintCallbackDocType,
         datasourceIsFilename:bool=False,
         title:typing.Optional[str]=None,
         author:typing.Optional[str]=None,
-        filename:typing.Optional[str]=None
+        filename:typing.Optional[str]=None,
+        dscIndex:typing.Optional['DscIndex']=None
         )->None:
         """
         datasource is either:
             a filename
             None to get data from stdin
+            a bytes-like object (bytes, bytearray, memoryview, etc)
             a file-like object
+            a list of bytes or str chunks
             something else to convert using str() and then print
         Keep in mind that it MUST contain postscript data
+
+        Binary data is never decoded, and is only copied when
+        there is no other way to get it to ghostscript.
+
+        dscIndex, if there is one, says where the pages are in
+        datasource (see dscIndex.py) so they don't need to be
+        looked for (PrintServer makes one for every job)
+        """
+        if title is None and datasourceIsFilename \
+            and isinstance(datasource,str):
+            title=datasource.rsplit(os.sep,1)[-1].rsplit('.',1)[0]
+        if self.pageByPage:
+            self.printPages(self.renderPages(datasource,datasourceIsFilename),
+                title,author,filename)
+            return
+        data=self._convertDatasource(datasource,datasourceIsFilename,
+            dscIndex)
+        self._printConverted(data,title,author,filename)
+
+    def _printConverted(self,
+        data:typing.Union[bytes,bytearray],
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        )->None:
+        """
+        Send converted data to the printThis function
+        """
+        doc=self._toPrintable(data)
+        logger.debug('Printing data...')
+        result=self.printThis(doc,title=title,author=author,filename=filename)
+        if inspect.isawaitable(result):
+            # printThis is an async def, but we were not called
+            # from an event loop, so give it one of its own
+            asyncio.run(result) # type: ignore[arg-type]
+
+    def _toPrintable(self,data:typing.Union[bytes,bytearray])->typing.Any:
+        """
+        Get converted data into the form printThis() takes it in
+
+        (this is the data itself, except for "raw", which is a list of
+        pages of pixels pointing into the data, so nothing is copied)
+        """
+        if self.acceptsFormat=='raw':
+            from virtualPrinter.pageStream import rawPages
+            return rawPages(data)
+        return data
+
+    def _convertDatasource(self,
+        datasource:PrintCallbackDocType,
+        datasourceIsFilename:bool=False,
+        dscIndex:typing.Optional['DscIndex']=None
+        )->bytes:
+        """
+        Open a datasource and convert it to the format printThis() accepts
+        """
+        markJob('conversionStart')
+        try:
+            with self._openDatasource(datasource,datasourceIsFilename) as data:
+                return self._convertPostscript(data,dscIndex)
+        finally:
+            markJob('conversionEnd')
+
+    @contextlib.contextmanager
+    def _openDatasource(self,
+        datasource:PrintCallbackDocType,
+        datasourceIsFilename:bool=False
+        )->typing.Iterator['PostscriptData']:
+        """
+        Get the postscript data out of whatever we were handed,
+        without decoding it
+
+        (see printPostscript() for what datasource can be)
         """
-        # -- open data source
-        data=None
         if datasource is None:
-            data=sys.stdin.read()
+            yield sys.stdin.buffer
         elif isinstance(datasource,str):
             if datasourceIsFilename:
-                with open(datasource,
-                    'rb',
-                    encoding='utf-8',
-                    errors='ignore') as f: # noqa: E129
-                    data=f.read()
-                if title is None:
-                    title=datasource.rsplit(os.sep,1)[-1].rsplit('.',1)[0]
+                with open(datasource,'rb') as f:
+                    yield f
             else:
-                data=datasource
+                yield datasource.encode('utf-8')
+        elif isinstance(datasource,(bytes,bytearray,memoryview,mmap.mmap)):
+            yield datasource
         elif hasattr(datasource,'read'):
-            data=datasource.read()
+            if isinstance(datasource,io.TextIOBase) \
+                and hasattr(datasource,'buffer'):
+                # (eg, sys.stdin) read the bytes under it, undecoded
+                datasource=datasource.buffer
+            if _fileno(datasource) is not None:
+                yield datasource
+            elif hasattr(datasource,'getbuffer'): # eg, io.BytesIO
+                yield datasource.getbuffer()[datasource.tell():]
+            else:
+                data=datasource.read()
+                if isinstance(data,str):
+                    data=data.encode('utf-8')
+                yield data
+        elif isinstance(datasource,(list,tuple)):
+            yield b''.join(
+                chunk.encode('utf-8') if isinstance(chunk,str) else chunk
+                for chunk in datasource)
         else:
-            data=str(datasource)
+            yield str(datasource).encode('utf-8')
+
+    def _convertPostscript(self,
+        data:'PostscriptData',
+        dscIndex:typing.Optional['DscIndex']=None
+        )->bytes:
+        """
+        Convert postscript data into whatever format printThis() accepts
+
+        dscIndex is where the pages are in data, if we know
+        """
         # -- convert the data to the required format
-        print('Converting data...')
+        logger.debug('Converting data...')
+        gsDev,gsDevOptions=self._gsDevice()
+        cacheKey=None
+        if self.conversionCache is not None:
+            cacheKey=self.conversionCache.key(data,gsDev,gsDevOptions,
+                self.acceptsFormat,self.acceptsColors,self.bgColor)
+            if cacheKey is not None:
+                cached=self.conversionCache.get(cacheKey)
+                if cached is not None:
+                    return cached
+        converted=None
+        if self.parallelPages and self.acceptsFormat!='pdf' \
+            and self.gsEngine=='subprocess':
+            # raster pages are independent, so can be rendered separately
+            from virtualPrinter.dscIndex import DscIndex
+            from virtualPrinter.parallelRender import countPages,\
+                renderParallel
+            if dscIndex is None and _fileno(data) is None \
+                and not hasattr(data,'read'):
+                dscIndex=DscIndex.build(data) # (quick, compared to gs)
+            if dscIndex is not None:
+                pageCount=dscIndex.pageCount
+            else:
+                pageCount=countPages(data)
+            if pageCount is not None and pageCount>1:
+                converted=renderParallel(data,
+                    self._gsCommand(gsDev,gsDevOptions),
+                    pageCount,self.renderWorkers,dscIndex=dscIndex)
+        if converted is None:
+            converted=self._postscriptToFormat(data,gsDev,gsDevOptions)
+        if cacheKey is not None and self.conversionCache is not None:
+            self.conversionCache.put(cacheKey,converted)
+        return converted
+
+    def _gsDevice(self)->typing.Tuple[str,typing.List[str]]:
+        """
+        Get the ghostscript device (and options for it) that
+        creates whatever format printThis() accepts
+
+        returns (gsDev,gsDevOptions)
+        """
         gsDevOptions=[]
         if self.acceptsFormat=='pdf':
             gsDev='pdfwrite'
@@ -243,13 +686,26 @@ class Printer:
             else:
                 msg=f'Unknown color format "{self.acceptsColors}"'
                 raise PrinterException(msg)
+        elif self.acceptsFormat=='raw':
+            # uncompressed, so there is no png encode/decode
+            # (ghostscript's raw devices can't downscale, so render at
+            # the final resolution and antialias instead)
+            gsDevOptions.append('-r200')
+            gsDevOptions.append('-dTextAlphaBits=4')
+            gsDevOptions.append('-dGraphicsAlphaBits=4')
+            if self.acceptsColors=='grey':
+                gsDev='pgmraw'
+            elif self.acceptsColors in ('rgb','rgba'):
+                # (ghostscript's raw devices have no alpha, so rgba
+                # gets rgb, on white)
+                gsDev='ppmraw'
+            else:
+                msg=f'Unknown color format "{self.acceptsColors}"'
+                raise PrinterException(msg)
         else:
             msg=r'Unacceptable data type format "{self.acceptsFormat}"'
             raise PrinterException(msg)
-        data=self._postscriptToFormat(data,gsDev,gsDevOptions)
-        # -- send the data to the printThis function
-        print('Printing data...')
-        self.printThis(data,title=title,author=author,filename=filename)
+        return gsDev,gsDevOptions
 
 
 if __name__=='__main__':
@@ -258,17 +714,54 @@ if __name__=='__main__':
         virtualPrinter filename.ps ..... print a file
         virtualPrinter - ............... print postscript piped in from stdin
         virtualPrinter ip[:port]........ start a print server
+        virtualPrinter dir|glob ........ batch convert files
+    OPTIONS:
+        -f format ...... what to convert to, pdf, png, or raw (default=png)
+        -o outputDir ... where batch conversions go (default=current dir)
+                         (this also makes filenames batch convert
+                         rather than print)
+        -j processes ... how many to convert at once (default=one per cpu)
+                         (for a print server, this serves it from
+                         that many processes, Linux only)
+        --lpd port ..... a print server also takes LPD jobs on this port
+                         (the standard one is 515)
+        --force ........ batch convert even if the output is newer
     NOTE:
         you can do multiple commands with the same virtualPrinter
+        (batch conversions happen after everything else)
     """
     if len(sys.argv)<2:
         print(usage)
     else:
         p=Printer()
-        for arg in sys.argv[1:]:
-            if arg=='-':
-                p.printPostscript(sys.stdin)
-            elif arg.find(os.sep)<0 and len(sys.argv[1].split('.'))>2:
+        batchPaths=[]
+        outputDir:typing.Optional[str]=None
+        processes:typing.Optional[int]=None
+        force=False
+        args=sys.argv[1:]
+        while args:
+            arg=args.pop(0)
+            if arg in ('-f','-o','-j','--lpd'):
+                if not args:
+                    print(usage)
+                    sys.exit(1)
+                value=args.pop(0)
+                if arg=='-f':
+                    p.acceptsFormat=value
+                elif arg=='-o':
+                    outputDir=value
+                elif arg=='--lpd':
+                    p.lpdPort=int(value)
+                else:
+                    processes=int(value)
+            elif arg=='--force':
+                force=True
+            elif arg=='-':
+                p.printPostscript(sys.stdin.buffer)
+            elif os.path.isdir(arg) or any(c in arg for c in '*?['):
+                batchPaths.append(arg)
+            elif arg.find(os.sep)<0 and len(arg.split('.'))>2 \
+                and not os.path.isfile(arg):
                 # looks like an ip to me!
                 ipPort=arg.rsplit(':',1)
                 port:typing.Union[None,str,int]
@@ -277,6 +770,19 @@ if __name__=='__main__':
                 else:
                     port=None
                 ip=ipPort[0]
-                p.run(ip,port)
+                if processes is not None:
+                    p.runPrefork(ip,port,processes=processes)
+                else:
+                    p.run(ip,port)
+            elif outputDir is not None:
+                batchPaths.append(arg)
             else:
                 p.printPostscript(arg,True)
+        if batchPaths:
+            from virtualPrinter.batchConvert import findInputs,batchConvert
+            items=findInputs(batchPaths,outputDir or '.',p.acceptsFormat)
+            result=batchConvert(items,p.acceptsFormat,p.acceptsColors,
+                p.gsEngine,processes,force)
+            print(result.summary())
+            if result.failed:
+                sys.exit(1)
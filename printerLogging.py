@@ -0,0 +1,150 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Logging for the virtual printer.
+
+Every module logs to its own logger under "virtualPrinter"
+(eg, "virtualPrinter.printServer").  startLogging() hooks those up
+to a queue, and a background thread does the actual writing, so a
+slow console (or pipe, or service log) never holds up receiving jobs.
+
+Debug messages (ghostscript command lines and output, the commands
+used to install printers, etc) are off unless you ask for them with
+startLogging(logging.DEBUG).
+"""
+import typing
+import os
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+
+from virtualPrinter.jobMetrics import currentJob
+
+
+LOGGER_NAME='virtualPrinter'
+DEFAULT_LOG_FORMAT=\
+    '%(asctime)s %(levelname)s [job %(jobId)s] %(name)s: %(message)s'
+
+
+class JobContextFilter(logging.Filter):
+    """
+    Adds fields for the job being handled right now (if any)
+    to every log record:
+        jobId ...... the job's number ("-" if not in a job)
+        jobTitle ... the title of the document (once it is known)
+        jobAddress . who sent it
+
+    (if you set up logging yourself, add this to your
+    handlers to be able to use them in your format)
+    """
+
+    def filter(self,record:logging.LogRecord)->bool:
+        job=currentJob()
+        if job is None:
+            record.jobId='-'
+            record.jobTitle=None
+            record.jobAddress=None
+        else:
+            record.jobId=job.jobId
+            record.jobTitle=job.title
+            record.jobAddress=job.address
+        return True
+
+
+_listener:typing.Optional[logging.handlers.QueueListener]=None
+_queueHandler:typing.Optional[logging.handlers.QueueHandler]=None
+_loggingLock=threading.Lock()
+
+
+def startLogging(
+    level:int=logging.INFO,
+    handlers:typing.Optional[typing.Iterable[logging.Handler]]=None,
+    logFormat:str=DEFAULT_LOG_FORMAT
+    )->logging.handlers.QueueListener:
+    """
+    Start sending virtualPrinter log messages to handlers
+    (by way of a queue and a background thread)
+
+    level is the lowest level to log (use logging.DEBUG to see
+        ghostscript command lines and output)
+
+    handlers is where to send the messages (None means to stderr)
+
+    If logging is already started, this just changes the level.
+
+    returns the QueueListener doing the writing
+    """
+    global _listener,_queueHandler # pylint: disable=global-statement
+    logger=logging.getLogger(LOGGER_NAME)
+    with _loggingLock:
+        logger.setLevel(level)
+        if _listener is not None:
+            return _listener
+        if handlers is None:
+            streamHandler=logging.StreamHandler(sys.stderr)
+            streamHandler.setFormatter(logging.Formatter(logFormat))
+            handlers=[streamHandler]
+        logQueue:queue.Queue=queue.Queue()
+        _queueHandler=logging.handlers.QueueHandler(logQueue)
+        # (filters run on the thread doing the logging, so they
+        # can still see which job it is working on)
+        _queueHandler.addFilter(JobContextFilter())
+        _listener=logging.handlers.QueueListener(logQueue,*handlers,
+            respect_handler_level=True)
+        _listener.start()
+        logger.addHandler(_queueHandler)
+        logger.propagate=False
+    atexit.register(stopLogging)
+    return _listener
+
+
+def stopLogging()->None:
+    """
+    Stop logging, after writing out anything that is still queued up
+    """
+    global _listener,_queueHandler # pylint: disable=global-statement
+    with _loggingLock:
+        if _listener is None:
+            return
+        logger=logging.getLogger(LOGGER_NAME)
+        if _queueHandler is not None:
+            logger.removeHandler(_queueHandler)
+        logger.propagate=True
+        _listener.stop()
+        _listener=None
+        _queueHandler=None
+
+
+def _afterFork()->None:
+    """
+    A forked child process (eg, a pre-fork worker) gets our queue
+    handler but not the thread that empties the queue, so give it
+    a fresh queue and a thread of its own
+    """
+    global _listener,_loggingLock # pylint: disable=global-statement
+    _loggingLock=threading.Lock() # could have been held during the fork
+    if _listener is None or _queueHandler is None:
+        return
+    logQueue:queue.Queue=queue.Queue()
+    _queueHandler.queue=logQueue
+    _listener=logging.handlers.QueueListener(logQueue,*_listener.handlers,
+        respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os,'register_at_fork'):
+    os.register_at_fork(after_in_child=_afterFork)
+
+
+def defaultLogging()->None:
+    """
+    Start logging with the default settings, unless logging
+    has already been set up (by us or by the application)
+    """
+    if _listener is not None or logging.getLogger().handlers \
+        or logging.getLogger(LOGGER_NAME).handlers:
+        return
+    startLogging()
@@ -0,0 +1,6 @@
+"""
+Tests for virtualPrinter
+
+Run them with:
+    python -m unittest discover virtualPrinter.tests
+"""
@@ -0,0 +1,104 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Tests for dscIndex.py
+"""
+import typing
+import unittest
+
+from virtualPrinter.dscIndex import DscIndex
+
+
+DOCUMENT=b'\n'.join([
+    b'@PJL JOB NAME="test"',
+    b'%!PS-Adobe-3.0',
+    b'%%Pages: 3',
+    b'%%BoundingBox: 0 0 612 792',
+    b'%%EndComments',
+    b'%%BeginProlog',
+    b'/x 1 def % not a DSC comment',
+    b'%%EndProlog',
+    b'%%BeginSetup',
+    b'%%EndSetup',
+    b'%%Page: 1 1',
+    b'(one) show',
+    b'%%Page: 2 2',
+    b'%%BeginDocument: embedded.eps',
+    b'%%Page: 99 99',
+    b'%%EndDocument',
+    b'(two) show',
+    b'%%Page: 3 3',
+    b'(three) show',
+    b'%%Trailer',
+    b'%%EOF'])
+
+
+def _summary(index:DscIndex)->typing.Dict[str,typing.Any]:
+    """
+    Everything that is in an index, to compare them
+    """
+    return {
+        'documentStart':index.documentStart,
+        'declaredPages':index.declaredPages,
+        'boundingBox':index.boundingBox,
+        'headerEnd':index.headerEnd,
+        'prolog':index.prolog,
+        'setup':index.setup,
+        'pages':[(page.label,page.ordinal,page.start,page.end)
+            for page in index.pages],
+        'trailerStart':index.trailerStart,
+        'eofOffset':index.eofOffset}
+
+
+def _feedInChunks(data:bytes,splits:typing.Iterable[int])->DscIndex:
+    """
+    Index data fed in pieces, split at the given offsets
+    """
+    index=DscIndex()
+    start=0
+    for split in list(splits)+[len(data)]:
+        index.feed(data[start:split])
+        start=split
+    index.close()
+    return index
+
+
+class TestDscIndex(unittest.TestCase):
+    """
+    Tests for DscIndex
+    """
+
+    def _checkEverySplit(self,data:bytes)->None:
+        """
+        Splitting the document anywhere must give the same index
+        """
+        expected=_summary(DscIndex.build(data))
+        self.assertEqual(len(expected['pages']),3)
+        for split in range(1,len(data)):
+            with self.subTest(split=split):
+                self.assertEqual(
+                    _summary(_feedInChunks(data,[split])),expected)
+        self.assertEqual(
+            _summary(_feedInChunks(data,range(1,len(data)))),expected)
+
+    def testWholeDocument(self)->None:
+        index=DscIndex.build(DOCUMENT)
+        self.assertEqual(index.documentStart,DOCUMENT.index(b'%!PS'))
+        self.assertEqual(index.pageCount,3)
+        self.assertEqual([page.label for page in index.pages],['1','2','3'])
+        self.assertEqual(index.trailerStart,DOCUMENT.index(b'%%Trailer'))
+        self.assertEqual(index.eofOffset,DOCUMENT.index(b'%%EOF'))
+        self.assertTrue(index.canExtractPages)
+
+    def testEverySplitPoint(self)->None:
+        self._checkEverySplit(DOCUMENT)
+
+    def testEverySplitPointCrLf(self)->None:
+        self._checkEverySplit(DOCUMENT.replace(b'\n',b'\r\n'))
+
+    def testEverySplitPointCr(self)->None:
+        self._checkEverySplit(DOCUMENT.replace(b'\n',b'\r'))
+
+
+if __name__=='__main__':
+    unittest.main()
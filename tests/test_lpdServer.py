@@ -0,0 +1,249 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Tests for lpdServer.py
+
+The protocol tests talk to an LpdServer over a socketpair, so
+nothing has to listen on a real port.
+"""
+import typing
+import socket
+import threading
+import unittest
+
+from virtualPrinter.lpdServer import LpdServer,LpdControlFile,ACK,NACK
+from virtualPrinter.jobLimits import JobLimits
+from virtualPrinter.jobMetrics import currentJob
+
+
+CONTROL=b'\n'.join([
+    b'Hmyhost',
+    b'Pbob',
+    b'JMy Document',
+    b'ldfA001myhost',
+    b'ldfA001myhost',
+    b'NMy Document.ps',
+    b'UdfA001myhost',
+    b''])
+DATA=b'%!PS-Adobe-3.0\n%%Pages: 1\n%%Page: 1 1\n(hello) show\n%%EOF\n'
+
+
+class TestLpdControlFile(unittest.TestCase):
+    """
+    Tests for parsing control files
+    """
+
+    def test_fields(self)->None:
+        """
+        The usual lines end up where they should
+        """
+        control=LpdControlFile(CONTROL)
+        self.assertEqual(control.host,'myhost')
+        self.assertEqual(control.author,'bob')
+        self.assertEqual(control.title,'My Document')
+        self.assertEqual(control.filename,'My Document.ps')
+        self.assertEqual(control.dataFiles,['dfA001myhost'])
+        self.assertEqual(control.copies,2)
+
+    def test_title(self)->None:
+        """
+        The title is the job name, else the banner title, else the
+        source filename (the first one given)
+        """
+        self.assertEqual(LpdControlFile(b'Tbanner\nNa.ps\n').title,'banner')
+        self.assertEqual(LpdControlFile(b'Na.ps\nNb.ps\n').title,'a.ps')
+        self.assertIsNone(LpdControlFile(b'').title)
+
+    def test_copies(self)->None:
+        """
+        Copies come from K if it is there, otherwise from how many
+        times the first data file is listed
+        """
+        self.assertEqual(LpdControlFile(b'ldfA\nK3\nldfA\n').copies,3)
+        self.assertEqual(LpdControlFile(b'ldfA\nKlots\n').copies,1)
+        self.assertEqual(LpdControlFile(b'ldfA\npdfB\nldfA\n').copies,2)
+        self.assertEqual(LpdControlFile(b'Hhost\n').copies,1)
+
+    def test_dataFiles(self)->None:
+        """
+        Every print command counts, in order, but each file only once
+        """
+        control=LpdControlFile(b'pdfB\nldfA\nfdfB\nodfC\nUdfD\nMbob\n')
+        self.assertEqual(control.dataFiles,['dfB','dfA','dfC'])
+        self.assertEqual(control.prints,
+            [('p','dfB'),('l','dfA'),('f','dfB'),('o','dfC')])
+
+    def test_crlf(self)->None:
+        """
+        Lines ending in \\r\\n work too
+        """
+        control=LpdControlFile(CONTROL.replace(b'\n',b'\r\n'))
+        self.assertEqual(control.title,'My Document')
+        self.assertEqual(control.dataFiles,['dfA001myhost'])
+
+
+class TestLpdProtocol(unittest.TestCase):
+    """
+    Tests for receiving jobs over LPD
+    """
+
+    def setUp(self)->None:
+        self.printed:typing.List[typing.Dict[str,typing.Any]]=[]
+        self.server=LpdServer('test',port=0,
+            printCallbackFn=self._print,queue='lp')
+        self.client,serverSide=socket.socketpair()
+        self.client.settimeout(5)
+        self.thread=threading.Thread(target=self.server._handleLpdConnection,
+            args=(serverSide,'test'),daemon=True)
+        self.thread.start()
+
+    def tearDown(self)->None:
+        self.client.close()
+        self.thread.join(5)
+
+    def _print(self,
+        doc:typing.Any,
+        title:typing.Optional[str]=None,
+        author:typing.Optional[str]=None,
+        filename:typing.Optional[str]=None
+        )->None:
+        """
+        The printCallbackFn, that keeps track of what it was given
+        """
+        job=currentJob()
+        assert job is not None
+        self.printed.append({'doc':bytes(doc),'title':title,
+            'author':author,'filename':filename,'copies':job.copies,
+            'bytes':job.bytesReceived})
+
+    def _send(self,data:bytes)->bytes:
+        """
+        Send something, and get back the one byte answer
+        """
+        self.client.sendall(data)
+        return self.client.recv(1)
+
+    def _sendFile(self,subcommand:int,name:bytes,data:bytes)->None:
+        """
+        Send a control file (2) or data file (3)
+        """
+        self.assertEqual(self._send(
+            bytes([subcommand])+b'%d '%len(data)+name+b'\n'),ACK)
+        self.assertEqual(self._send(data+b'\x00'),ACK)
+
+    def _finish(self)->None:
+        """
+        Hang up and wait for the server to be done
+        """
+        self.client.shutdown(socket.SHUT_WR)
+        self.assertEqual(self.client.recv(1),b'')
+        self.thread.join(5)
+
+    def test_job(self)->None:
+        """
+        A control file, then the data file
+        """
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        self._sendFile(2,b'cfA001myhost',CONTROL)
+        self._sendFile(3,b'dfA001myhost',DATA)
+        self._finish()
+        self.assertEqual(self.printed,[{'doc':DATA,'title':'My Document',
+            'author':'bob','filename':'My Document.ps','copies':2,
+            'bytes':len(DATA)}])
+
+    def test_dataFirst(self)->None:
+        """
+        The data file can come before the control file
+        """
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        self._sendFile(3,b'dfA001myhost',DATA)
+        self.assertEqual(self.printed,[])
+        self._sendFile(2,b'cfA001myhost',CONTROL)
+        self._finish()
+        self.assertEqual([p['doc'] for p in self.printed],[DATA])
+
+    def test_severalJobs(self)->None:
+        """
+        Any number of jobs can come over one connection
+        """
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        for n in (b'001',b'002',b'003'):
+            self._sendFile(2,b'cfA'+n+b'myhost',
+                CONTROL.replace(b'A001',b'A'+n).replace(b'My Doc',n+b' Doc'))
+            self._sendFile(3,b'dfA'+n+b'myhost',DATA+n)
+        self._finish()
+        self.assertEqual([p['title'] for p in self.printed],
+            ['001 Document','002 Document','003 Document'])
+        self.assertEqual([p['doc'] for p in self.printed],
+            [DATA+b'001',DATA+b'002',DATA+b'003'])
+
+    def test_abort(self)->None:
+        """
+        Subcommand 1 drops whatever has been sent so far
+        """
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        self._sendFile(3,b'dfA001myhost',DATA)
+        self.assertEqual(self._send(b'\x01\n'),ACK)
+        self._sendFile(2,b'cfA001myhost',CONTROL)
+        self._finish()
+        self.assertEqual(self.printed,[])
+        self.assertEqual(self.server.limits.snapshot()['queuedJobs'],0)
+
+    def test_badSubcommand(self)->None:
+        """
+        Subcommands other than 1, 2 and 3 are refused
+        """
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        self.assertEqual(self._send(b'\x07oops\n'),NACK)
+        self._finish()
+
+    def test_badCount(self)->None:
+        """
+        A file with no (or a nonsense) count is refused
+        """
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        self.assertEqual(self._send(b'\x03lots dfA001myhost\n'),NACK)
+        self._finish()
+
+    def test_controlFileTooBig(self)->None:
+        """
+        Control files are held to headerLimit
+        """
+        self.server.headerLimit=10
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        self._sendFile(3,b'dfA001myhost',DATA)
+        self.assertEqual(
+            self._send(b'\x02%d cfA001myhost\n'%len(CONTROL)),NACK)
+        self._finish()
+        self.assertEqual(self.printed,[])
+
+    def test_unknownQueue(self)->None:
+        """
+        Jobs for some other queue are refused
+        """
+        self.assertEqual(self._send(b'\x02other\n'),NACK)
+        self._finish()
+
+    def test_queueState(self)->None:
+        """
+        Commands 3 and 4 get back the state of the queue
+        """
+        self.client.sendall(b'\x03lp\n')
+        self.assertEqual(self.client.recv(100),b'lp: 0 printing, 0 waiting\n')
+        self._finish()
+
+    def test_controlFileNotCounted(self)->None:
+        """
+        Only data file bytes count against maxJobSize
+        """
+        self.server.limits=JobLimits(maxJobSize=len(DATA))
+        self.assertEqual(self._send(b'\x02lp\n'),ACK)
+        self._sendFile(2,b'cfA001myhost',CONTROL)
+        self._sendFile(3,b'dfA001myhost',DATA)
+        self._finish()
+        self.assertEqual([p['bytes'] for p in self.printed],[len(DATA)])
+        self.assertEqual(self.server.limits.snapshot()['rejected'],{})
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Tests for parallelRender.py
+
+Rather than ghostscript, these use a little python program that
+echoes back which pages it was asked for, and what it was given.
+"""
+import typing
+import io
+import sys
+import tempfile
+import unittest
+
+from virtualPrinter.parallelRender import renderParallel,splitPages
+
+
+# writes "[firstPage-lastPage]" and then whatever came in on stdin
+FAKE_GHOSTSCRIPT=[sys.executable,'-c',
+    'import sys\n'
+    'pages=[a.split("=")[1] for a in sys.argv[1:] if "Page=" in a]\n'
+    'sys.stdout.buffer.write(("["+"-".join(pages)+"]").encode())\n'
+    'sys.stdout.buffer.write(sys.stdin.buffer.read())\n',
+    '-']
+
+POSTSCRIPT=b'\n'.join([
+    b'%!PS-Adobe-3.0',
+    b'%%Pages: 4',
+    b'%%EndComments',
+    b'%%Page: 1 1',
+    b'(one) show',
+    b'%%Page: 2 2',
+    b'(two) show',
+    b'%%Page: 3 3',
+    b'(three) show',
+    b'%%Page: 4 4',
+    b'(four) show',
+    b'%%EOF',
+    b''])
+PJL=b'\x1b%-12345X@PJL JOB NAME="test"\r\n'\
+    b'@PJL ENTER LANGUAGE=POSTSCRIPT\r\n'
+
+
+class TestRenderParallel(unittest.TestCase):
+    """
+    Tests for renderParallel()
+    """
+
+    def _expected(self,workers:int)->bytes:
+        """
+        What rendering all of POSTSCRIPT, a range at a time, looks like
+        """
+        return b''.join(f'[{first}-{last}]'.encode('ascii')+POSTSCRIPT
+            for first,last in splitPages(4,workers))
+
+    def _render(self,data:typing.Any)->bytes:
+        """
+        Render data on two fake ghostscripts
+        """
+        return renderParallel(data,FAKE_GHOSTSCRIPT,4,2)
+
+    def test_bytes(self)->None:
+        """
+        A PJL header is left out of what ghostscript gets
+        """
+        self.assertEqual(self._render(PJL+POSTSCRIPT),self._expected(2))
+        self.assertEqual(self._render(POSTSCRIPT),self._expected(2))
+
+    def test_fileObject(self)->None:
+        """
+        Same for something file-like, eg, a spooled job
+        """
+        self.assertEqual(self._render(io.BytesIO(PJL+POSTSCRIPT)),
+            self._expected(2))
+        self.assertEqual(self._render(io.BytesIO(POSTSCRIPT)),
+            self._expected(2))
+
+    def test_realFile(self)->None:
+        """
+        Same for a real file
+        """
+        with tempfile.TemporaryFile() as f:
+            f.write(PJL+POSTSCRIPT)
+            f.seek(0)
+            self.assertEqual(self._render(f),self._expected(2))
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Tests for windowsPrinters.py
+
+These use a fake CommandRunner that pretends to be windows, so they
+run on any os.
+"""
+import typing
+import re
+import json
+import unittest
+
+from virtualPrinter.windowsPrinters import WindowsPrinters
+
+
+NAME="Bob's Printer" # (the ' has to survive PowerShell quoting)
+PORT_NAME="Bob's Printer Port"
+COMMENT='Virtual printer created in Python'
+
+# a PowerShell 'string' (with '' for '), a ; or a plain word
+_TOKEN=re.compile(r"'((?:[^']|'')*)'|(;)|([^\s;']+)")
+
+
+def _statements(script:str)->typing.List[typing.List[str]]:
+    """
+    Split a PowerShell script up into statements, each of which is
+    a list of words (with strings unquoted)
+    """
+    statements:typing.List[typing.List[str]]=[[]]
+    for quoted,semicolon,word in _TOKEN.findall(script):
+        if semicolon:
+            statements.append([])
+        elif word:
+            statements[-1].append(word)
+        else:
+            statements[-1].append(quoted.replace("''","'"))
+    return statements
+
+
+class FakeWindows:
+    """
+    A CommandRunner that keeps track of printers and ports like
+    windows would
+    """
+
+    def __init__(self,hasPowershell:bool=True):
+        self.hasPowershell=hasPowershell
+        self.ports:typing.Dict[str,typing.Tuple[str,int]]={}
+        self.printers:typing.Dict[str,typing.Dict[str,typing.Any]]={}
+        self.default:typing.Optional[str]=None
+        self.commands:typing.List[typing.List[str]]=[]
+
+    def __call__(self,cmd:typing.List[str])->typing.Tuple[int,str]:
+        self.commands.append(cmd)
+        if cmd[0]!='powershell':
+            return 0,''
+        if not self.hasPowershell:
+            return 1,"The term 'Get-PrinterPort' is not recognized"
+        statements=_statements(cmd[-1])
+        if 'ConvertTo-Json' in cmd[-1]:
+            return 0,json.dumps(self._state(
+                statements[2][2],statements[1][2]))
+        for statement in statements[1:]: # (skip $ErrorActionPreference)
+            self._do(statement)
+        return 0,''
+
+    def _state(self,name:str,portName:str)->typing.Dict[str,typing.Any]:
+        """
+        What getPrinterState() would get back
+        """
+        port=None
+        if portName in self.ports:
+            host,number=self.ports[portName]
+            port={'host':host,'port':number}
+        return {'port':port,'printer':self.printers.get(name),
+            'default':self.default}
+
+    def _do(self,statement:typing.List[str])->None:
+        """
+        Do one provisioning step
+        """
+        verb=statement[0]
+        if verb=='Get-CimInstance': # (SetDefaultPrinter)
+            name=_statements(statement[3][len('Name='):])[0][0]
+            assert name in self.printers,name
+            self.default=name
+            return
+        args=dict(zip(statement[1::2],statement[2::2]))
+        name=args['-Name']
+        if verb=='Add-PrinterPort':
+            assert name not in self.ports,name
+            self.ports[name]=(args['-PrinterHostAddress'],
+                int(args['-PortNumber']))
+        elif verb=='Remove-PrinterPort':
+            assert not any(printer['port']==name
+                for printer in self.printers.values()),'port in use'
+            del self.ports[name]
+        elif verb=='Add-Printer':
+            assert name not in self.printers,name
+            assert args['-PortName'] in self.ports,args['-PortName']
+            self.printers[name]={'port':args['-PortName'],
+                'driver':args['-DriverName'],'comment':None}
+        elif verb=='Remove-Printer':
+            del self.printers[name]
+        elif verb=='Set-Printer':
+            printer=self.printers[name]
+            for arg,key in (('-PortName','port'),
+                ('-DriverName','driver'),('-Comment','comment')):
+                if arg in args:
+                    printer[key]=args[arg]
+        else:
+            raise AssertionError(f'unexpected step {statement}')
+
+
+class TestWindowsPrinters(unittest.TestCase):
+    """
+    Tests for WindowsPrinters provisioning
+    """
+
+    def _addPrinter(self,
+        fake:FakeWindows,
+        port:int=9101,
+        makeDefault:bool=False
+        )->WindowsPrinters:
+        """
+        Add the test printer, with only this call's commands in fake
+        """
+        fake.commands=[]
+        printers=WindowsPrinters(fake)
+        printers.addPrinter(NAME,'127.0.0.1',port,PORT_NAME,
+            makeDefault,COMMENT)
+        return printers
+
+    def _setUpAlready(self,fake:FakeWindows,port:int=9101)->None:
+        """
+        Make it look like the test printer is already there
+        """
+        fake.ports[PORT_NAME]=('127.0.0.1',port)
+        fake.printers[NAME]={'port':PORT_NAME,
+            'driver':WindowsPrinters().defaultPostscriptPrinterDriver,
+            'comment':COMMENT}
+
+    def _assertSetUp(self,fake:FakeWindows,port:int=9101)->None:
+        """
+        Check that the test printer is set up how _addPrinter wants it
+        """
+        self.assertEqual(fake.ports,{PORT_NAME:('127.0.0.1',port)})
+        self.assertEqual(list(fake.printers),[NAME])
+        self.assertEqual(fake.printers[NAME]['port'],PORT_NAME)
+        self.assertEqual(fake.printers[NAME]['comment'],COMMENT)
+
+    def test_alreadySetUp(self)->None:
+        """
+        A printer that is already set up costs one command
+        """
+        fake=FakeWindows()
+        self._setUpAlready(fake)
+        self._addPrinter(fake)
+        self.assertEqual(len(fake.commands),1)
+        self._assertSetUp(fake)
+
+    def test_fromNothing(self)->None:
+        """
+        Setting up from nothing costs two commands, and then doing
+        it again costs one
+        """
+        fake=FakeWindows()
+        self._addPrinter(fake)
+        self.assertEqual(len(fake.commands),2)
+        self._assertSetUp(fake)
+        self._addPrinter(fake)
+        self.assertEqual(len(fake.commands),1)
+        self._assertSetUp(fake)
+
+    def test_missingPort(self)->None:
+        """
+        Only the port is added if only it is missing
+        """
+        fake=FakeWindows()
+        self._setUpAlready(fake)
+        del fake.ports[PORT_NAME]
+        self._addPrinter(fake)
+        self.assertEqual(len(fake.commands),2)
+        self.assertEqual([s[0] for s in _statements(fake.commands[1][-1])],
+            ["$ErrorActionPreference=",'Add-PrinterPort'])
+        self._assertSetUp(fake)
+
+    def test_missingPrinter(self)->None:
+        """
+        Only the printer is added if only it is missing
+        """
+        fake=FakeWindows()
+        self._setUpAlready(fake)
+        del fake.printers[NAME]
+        self._addPrinter(fake)
+        self.assertEqual(len(fake.commands),2)
+        self.assertNotIn('Add-PrinterPort',fake.commands[1][-1])
+        self._assertSetUp(fake)
+
+    def test_portMoved(self)->None:
+        """
+        A port that points somewhere else is removed and added again
+        (with the printer taken off of it while that happens)
+        """
+        fake=FakeWindows()
+        self._setUpAlready(fake,9101)
+        self._addPrinter(fake,9102)
+        self.assertEqual(len(fake.commands),2)
+        self.assertEqual(
+            [s[0] for s in _statements(fake.commands[1][-1])][1:5],
+            ['Remove-Printer','Remove-PrinterPort',
+            'Add-PrinterPort','Add-Printer'])
+        self._assertSetUp(fake,9102)
+
+    def test_makeDefault(self)->None:
+        """
+        Making it the default printer only happens if it isn't already
+        """
+        fake=FakeWindows()
+        self._setUpAlready(fake)
+        self._addPrinter(fake,makeDefault=True)
+        self.assertEqual(len(fake.commands),2)
+        self.assertEqual(fake.default,NAME)
+        self._addPrinter(fake,makeDefault=True)
+        self.assertEqual(len(fake.commands),1)
+
+    def test_noPowershell(self)->None:
+        """
+        Without the PowerShell printing module, it falls back to
+        prnport.vbs and printui.dll
+        """
+        fake=FakeWindows(hasPowershell=False)
+        printers=self._addPrinter(fake)
+        self.assertIsNone(printers.getPrinterState(NAME,PORT_NAME))
+        fake.commands=fake.commands[:-1] # (that getPrinterState())
+        self.assertEqual([cmd[0] for cmd in fake.commands],
+            ['powershell','cscript','rundll32','rundll32'])
+        addPort=fake.commands[1]
+        self.assertEqual(addPort[addPort.index('-r')+1],PORT_NAME)
+        self.assertEqual(addPort[addPort.index('-n')+1],'9101')
+        addPrinter=fake.commands[2]
+        self.assertIn('/if',addPrinter)
+        self.assertEqual(addPrinter[addPrinter.index('/b')+1],NAME)
+
+
+if __name__=='__main__':
+    unittest.main()
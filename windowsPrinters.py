@@ -3,10 +3,76 @@
 """
 Handy convenience class for managing (installing, removing, etc)
 windows printers
+
+Every command goes through a runner (see CommandRunner), so
+everything but the commands themselves can be tried out on any os
+by handing WindowsPrinters a fake one.
+
+Installing is idempotent: it asks (in one PowerShell call) what
+is already there, and only does (in one more) whatever is
+different.  So starting up a printer that is already set up costs
+one command, and one that isn't costs two, rather than one per step.
 """
 import typing
+import time
+import json
+import logging
 import subprocess
 
+logger=logging.getLogger(__name__)
+
+PRNPORT_VBS=r'c:\Windows\System32\Printing_Admin_Scripts\en-US\prnport.vbs'
+POWERSHELL=['powershell','-NoProfile','-NonInteractive',
+    '-ExecutionPolicy','Bypass','-Command']
+
+# runs a command, returns (exit code,everything it printed)
+CommandRunner=typing.Callable[[typing.List[str]],typing.Tuple[int,str]]
+
+
+def runCommand(cmd:typing.List[str])->typing.Tuple[int,str]:
+    """
+    The normal CommandRunner, that actually runs the command
+    """
+    start=time.perf_counter()
+    po=subprocess.run(cmd,stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,stderr=subprocess.STDOUT,check=False)
+    stdout=po.stdout.decode('utf-8',errors='replace')
+    logger.debug('%s took %.3fs',cmd[0],time.perf_counter()-start)
+    return po.returncode,stdout
+
+
+def psQuote(value:typing.Any)->str:
+    """
+    Quote a value as a PowerShell string
+    """
+    return "'"+str(value).replace("'","''")+"'"
+
+
+class PrinterSetup:
+    """
+    How a printer (and its port) should be set up
+    """
+
+    def __init__(self,
+        name:str,
+        host:str='127.0.0.1',port:typing.Union[int,str]=9101,
+        printerPortName:typing.Optional[str]=None,
+        makeDefault:bool=False,
+        comment:typing.Optional[str]=None,
+        driver:typing.Optional[str]=None):
+        """
+        (see WindowsPrinters.addPrinter)
+        """
+        self.name:str=name
+        self.host:str=host
+        self.port:int=int(port)
+        if printerPortName is None:
+            printerPortName=f'{host}:{port}'
+        self.printerPortName:str=printerPortName
+        self.makeDefault:bool=makeDefault
+        self.comment:typing.Optional[str]=comment
+        self.driver:typing.Optional[str]=driver
+
 
 class WindowsPrinters:
     """
@@ -14,78 +80,167 @@ class WindowsPrinters:
     windows printers
     """
 
-    def __init__(self):
+    def __init__(self,runner:typing.Optional[CommandRunner]=None):
         """
+        runner is what runs the commands (None = runCommand)
+
         NOTE: there may be a better default driver to use
         """
         self.defaultPostscriptPrinterDriver='HP Color LaserJet 2800 Series PS'
+        if runner is None:
+            runner=runCommand
+        self.runner:CommandRunner=runner
+
+    def _run(self,cmd:typing.List[str])->typing.Tuple[int,str]:
+        """
+        Run a command through the runner
+        """
+        logger.debug('%s',cmd)
+        returncode,stdout=self.runner(cmd)
+        logger.debug('%s',stdout)
+        return returncode,stdout
+
+    def _runPowershell(self,lines:typing.List[str])->typing.Tuple[int,str]:
+        """
+        Run a bunch of PowerShell lines as one script (one process),
+        stopping at the first one that fails
+        """
+        script='; '.join(["$ErrorActionPreference='Stop'"]+lines)
+        return self._run(POWERSHELL+[script])
 
     def removePort(self,printerPortName):
         """
         Remove a printer port
         """
-        cmd=['cscript',
-             r'c:\Windows\System32\Printing_Admin_Scripts\en-US\prnport.vbs',
-             '-d','-r',printerPortName]
-        print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+        self._run(['cscript',PRNPORT_VBS,'-d','-r',printerPortName])
 
     def removePrinter(self,name):
         """
         Remove an installed printer
         """
-        cmd=['rundll32','printui.dll,PrintUIEntry','/dl','/n',name]
-        #print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+        self._run(['rundll32','printui.dll,PrintUIEntry','/dl','/n',name])
+
+    def removePrinterAndPort(self,name:str,printerPortName:str)->None:
+        """
+        Remove an installed printer and its port, all at once
+        (whichever of them are there)
+        """
+        returncode,_=self._runPowershell([
+            f'Get-Printer -Name {psQuote(name)} -ErrorAction '
+            'SilentlyContinue | Remove-Printer',
+            f'Get-PrinterPort -Name {psQuote(printerPortName)} '
+            '-ErrorAction SilentlyContinue | Remove-PrinterPort'])
+        if returncode!=0: # no PowerShell printing module, do it the old way
+            self.removePrinter(name)
+            self.removePort(printerPortName)
 
     def listPorts(self):
         """
         List all installed printer ports
         """
-        cmd=['cscript',
-             r'c:\Windows\System32\Printing_Admin_Scripts\en-US\prnport.vbs',
-             '-l']
-        #print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+        self._run(['cscript',PRNPORT_VBS,'-l'])
 
     def makePrinterDefault(self,name):
         """
         Assign a printer to be the system default
         """
-        cmd=['rundll32','printui.dll,PrintUIEntry','/y','/n',name]
-        #print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+        self._run(['rundll32','printui.dll,PrintUIEntry','/y','/n',name])
 
     def setPrinterComment(self,name:str,comment:str)->None:
         """
         Add a comment to the given printer device
         """
         comment=comment.replace('"','\\"').replace('\n','\\n')
-        cmd=['rundll32','printui.dll,PrintUIEntry','/Xs',
+        self._run(['rundll32','printui.dll,PrintUIEntry','/Xs',
             '/n',name,
-            'comment',comment]
-        #print(cmd)
-        with subprocess.Popen(
-            cmd,stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+            'comment',comment])
+
+    def getPrinterState(self,
+        name:str,
+        printerPortName:str
+        )->typing.Optional[typing.Dict[str,typing.Any]]:
+        """
+        Ask (in one go) how a printer and its port are set up now
+
+        returns {'port':{'host','port'} or None,
+            'printer':{'port','driver','comment'} or None,
+            'default':name of the default printer}
+            or None if that can't be found out
+        """
+        returncode,stdout=self._runPowershell([
+            f'$port=Get-PrinterPort -Name {psQuote(printerPortName)} '
+            '-ErrorAction SilentlyContinue',
+            f'$printer=Get-Printer -Name {psQuote(name)} '
+            '-ErrorAction SilentlyContinue',
+            "$default=Get-CimInstance Win32_Printer -Filter 'Default=True'",
+            '@{'
+            'port=$(if($port){@{host=$port.PrinterHostAddress;'
+            'port=$port.PortNumber}});'
+            'printer=$(if($printer){@{port=$printer.PortName;'
+            'driver=$printer.DriverName;comment=$printer.Comment}});'
+            'default=$(if($default){$default.Name})'
+            '} | ConvertTo-Json -Compress'])
+        if returncode!=0:
+            return None
+        try:
+            state=json.loads(stdout.strip().splitlines()[-1])
+        except (ValueError,IndexError):
+            return None
+        if not isinstance(state,dict):
+            return None
+        return state
+
+    def _provisioningSteps(self,
+        setup:PrinterSetup,
+        state:typing.Dict[str,typing.Any]
+        )->typing.List[str]:
+        """
+        Work out the PowerShell lines needed to go from state
+        (see getPrinterState()) to setup
+
+        returns [] if it is already set up that way
+        """
+        steps=[]
+        name=psQuote(setup.name)
+        portName=psQuote(setup.printerPortName)
+        driver=setup.driver or self.defaultPostscriptPrinterDriver
+        port=state.get('port')
+        printer=state.get('printer')
+        portMoved=port is not None and (port.get('host'),
+            str(port.get('port')))!=(setup.host,str(setup.port))
+        if portMoved:
+            # a port can't be changed, only replaced (and not while
+            # a printer is using it)
+            if printer is not None:
+                steps.append(f'Remove-Printer -Name {name}')
+                printer=None
+            steps.append(f'Remove-PrinterPort -Name {portName}')
+            port=None
+        if port is None:
+            steps.append(f'Add-PrinterPort -Name {portName} '
+                f'-PrinterHostAddress {psQuote(setup.host)} '
+                f'-PortNumber {setup.port}')
+        if printer is None:
+            steps.append(f'Add-Printer -Name {name} '
+                f'-DriverName {psQuote(driver)} -PortName {portName}')
+            if setup.comment is not None:
+                steps.append(f'Set-Printer -Name {name} '
+                    f'-Comment {psQuote(setup.comment)}')
+        else:
+            if printer.get('port')!=setup.printerPortName:
+                steps.append(f'Set-Printer -Name {name} -PortName {portName}')
+            if printer.get('driver')!=driver:
+                steps.append(f'Set-Printer -Name {name} '
+                    f'-DriverName {psQuote(driver)}')
+            if setup.comment is not None \
+                and printer.get('comment')!=setup.comment:
+                steps.append(f'Set-Printer -Name {name} '
+                    f'-Comment {psQuote(setup.comment)}')
+        if setup.makeDefault and state.get('default')!=setup.name:
+            steps.append("Get-CimInstance Win32_Printer -Filter "
+                f"{psQuote('Name='+psQuote(setup.name))} "
+                '| Invoke-CimMethod -MethodName SetDefaultPrinter')
+        return steps
 
     def addPrinter(self,
         name:str,
@@ -96,70 +251,72 @@ class WindowsPrinters:
         )->None:
         """
         Add a new printer to the system
+
+        If it (and its port) are already there and set up the same,
+        nothing is done.  Otherwise, only whatever is different is
+        changed.
+        """
+        self.setUpPrinter(PrinterSetup(name,host,port,printerPortName,
+            makeDefault,comment))
+
+    def setUpPrinter(self,setup:PrinterSetup)->None:
+        """
+        Make sure a printer (and its port) are set up like this
+        (see addPrinter())
+        """
+        state=self.getPrinterState(setup.name,setup.printerPortName)
+        if state is None: # no PowerShell printing module
+            self._addPrinterTheOldWay(setup)
+            return
+        steps=self._provisioningSteps(setup,state)
+        if not steps:
+            logger.debug('Printer "%s" is already set up',setup.name)
+            return
+        returncode,stdout=self._runPowershell(steps)
+        if returncode!=0:
+            logger.warning('Setting up printer "%s" failed: %s',
+                setup.name,stdout.strip())
+
+    def _addPrinterTheOldWay(self,setup:PrinterSetup)->None:
+        """
+        Add a printer with prnport.vbs and printui.dll
+        (for when there is no PowerShell printing module)
         """
-        port=str(port)
         # -- create the printer port
-        if printerPortName is None:
-            printerPortName=host+':'+port
-        cmd:typing.List[str]=['cscript',
-            r'c:\Windows\System32\Printing_Admin_Scripts\en-US\prnport.vbs',
+        self._run(['cscript',PRNPORT_VBS,
             '-md','-a','-o','raw',
-            '-r',printerPortName,
-            '-h',host,'-n',port]
-        #print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+            '-r',setup.printerPortName,
+            '-h',setup.host,'-n',str(setup.port)])
         # -- create the printer
-        cmd=['rundll32','printui.dll,PrintUIEntry','/if',
-            '/b',name,
-            '/r',printerPortName,
-            '/m',self.defaultPostscriptPrinterDriver,
-            '/Z']
-        print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+        self._run(['rundll32','printui.dll,PrintUIEntry','/if',
+            '/b',setup.name,
+            '/r',setup.printerPortName,
+            '/m',setup.driver or self.defaultPostscriptPrinterDriver,
+            '/Z'])
         # -- set the default printer flag
-        if makeDefault:
-            self.makePrinterDefault(name)
+        if setup.makeDefault:
+            self.makePrinterDefault(setup.name)
         # -- set the printer comment
-        if comment is not None:
-            self.setPrinterComment(name,comment)
+        if setup.comment is not None:
+            self.setPrinterComment(setup.name,setup.comment)
 
     def printTestPage(self,name:str)->None:
         """
         Send a test page to the given printer
         """
-        cmd=['rundll32',
+        self._run(['rundll32',
             'printui.dll,PrintUIEntry',
             '/k',
-            '/n',name]
-        print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+            '/n',name])
 
     def showSettingsDialog(self,name:str)->None:
         """
         Pop up the settings dialog for a given printer
         """
-        cmd=['rundll32',
+        self._run(['rundll32',
             'printui.dll,PrintUIEntry',
             '/e',
-            '/n',name]
-        print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+            '/n',name])
 
     def saveSettings(self,name:str,filename:str)->None:
         """
@@ -168,17 +325,11 @@ class WindowsPrinters:
         (I have no idea what the format is,
         so it cannot yet be edited externally.)
         """
-        cmd=['rundll32',
+        self._run(['rundll32',
             'printui.dll,PrintUIEntry',
             '/Ss',
             '/n',name,
-            '/a',filename]
-        print(cmd)
-        with subprocess.Popen(cmd,
-            stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+            '/a',filename])
 
     def loadSettings(self,name,filename):
         """
@@ -187,33 +338,24 @@ class WindowsPrinters:
         (I have no idea what the format is,
         so it cannot yet be edited externally.)
         """
-        cmd=['rundll32',
+        self._run(['rundll32',
             'printui.dll,PrintUIEntry',
             '/Sr',
             '/n',name,
-            '/a',filename]
-        print(cmd)
-        with subprocess.Popen(
-            cmd,stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po:
-            stdout,_=po.communicate()
-        print(stdout)
+            '/a',filename])
 
     def showPrintUIdllOptions(self):
         """
         Show the ui options
         """
-        cmd=r'rundll32 PrintUI.dll,PrintUIEntry /?'
-        with subprocess.Popen(
-            cmd,stdin=None,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,
-            shell=True) as po: # nosemgrep
-            stdout,_=po.communicate()
-        print(stdout)
+        self._run(['rundll32','PrintUI.dll,PrintUIEntry','/?'])
         # TODO: it might be cool to do this someday
         #ctypes.windll.PrintUI.PrintUIEntry('/?')
 
 
 if __name__=='__main__':
+    from virtualPrinter.printerLogging import startLogging
+    startLogging(logging.DEBUG)
     print('Presently the command line is diagnostic only,')
     print('registering, and then unregistering a printer')
     p=WindowsPrinters()